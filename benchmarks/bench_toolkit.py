@@ -0,0 +1,128 @@
+"""Benchmark the toolkit functions and the product pipelines of the apps on synthetic data. No network access is needed.
+
+Run from the root of the repository:
+
+    python benchmarks/bench_toolkit.py --output results.json
+    python benchmarks/bench_toolkit.py --compare results.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import numpy as np
+import xarray as xr
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bokeh-app"))
+
+import toolkit as tk  # noqa: E402
+import products as pr  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def time_function(func, repeat):
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        runs.append(time.perf_counter() - start)
+
+    return {"min": min(runs), "median": statistics.median(runs), "mean": statistics.mean(runs), "runs": runs}
+
+
+def benchmarks(index):
+    """Return the benchmarks as a dictionary of names and functions without arguments."""
+    da = synthetic.create_data_array(index, "daily")
+    da_monthly = synthetic.create_data_array(index, "monthly")
+
+    day_of_year_index = tk.DayOfYearIndex(da.time.values)
+    da_leap, da_converted = tk.convert_and_interpolate_calendar(da, day_of_year_index)
+    baselines = tk.ReferenceBaselines(da_converted, day_of_year_index)
+    mean = baselines.mean(1981, 2010)
+    years = tk.get_list_of_years(da)
+    colors_dict = tk.find_line_colors(years, "viridis")
+
+    return {
+        "day_of_year_index": lambda: tk.DayOfYearIndex(da.time.values),
+        "convert_and_interpolate_calendar": lambda: tk.convert_and_interpolate_calendar(da, day_of_year_index),
+        "reference_baselines": lambda: tk.ReferenceBaselines(da_converted, day_of_year_index),
+        "percentiles_and_median": lambda: baselines.percentiles_and_median(1981, 2010),
+        "calculate_min_max": lambda: tk.calculate_min_max(da_converted),
+        "calculate_decadal_span_and_median": lambda: tk.calculate_decadal_span_and_median(da_converted,
+                                                                                               day_of_year_index),
+        "calculate_anomalies": lambda: tk.calculate_anomalies(da_leap, da_converted, mean, day_of_year_index),
+        "calculate_individual_years": lambda: tk.calculate_individual_years(da_leap, da_converted),
+        "find_yearly_min_max": lambda: tk.find_yearly_min_max(da_converted, da_converted, colors_dict),
+        "find_line_colors_viridis": lambda: tk.find_line_colors(years, "viridis"),
+        "find_line_colors_decadal": lambda: tk.find_line_colors(years, "decadal"),
+        "calculate_monthly": lambda: tk.calculate_monthly(da_monthly, month_offset=False),
+        "calculate_all_months": lambda: tk.calculate_all_months(da_monthly),
+        "trends_monthly": lambda: tk.Trends(da_monthly, 1981, 2010, False).calculate_monthly_trend(),
+        "trends_decadal": lambda: tk.Trends(da_monthly, 1981, 2010, False).calculate_decadal_trend(edge_padding=0.1),
+        "daily_pipeline_absolute": lambda: pr.calculate_daily_products(da),
+        "daily_pipeline_anomaly_from_absolute": lambda: pr.calculate_anomaly_products(da_leap,
+                                                                                     da_converted,
+                                                                                     mean,
+                                                                                     day_of_year_index),
+        "daily_decadal": lambda: pr.calculate_decadal_products(da_converted, day_of_year_index),
+        "monthly_pipeline": lambda: pr.calculate_monthly_products(da_monthly, "1981-2010", False),
+        "monthly_decadal_trend": lambda: pr.calculate_decadal_trend_products(da_monthly, "1981-2010", False, "January"),
+    }
+
+
+def metadata():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {"date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": commit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "xarray": xr.__version__,
+            "machine": platform.machine(),
+            "processor_count": os.cpu_count()}
+
+
+def compare(results, baseline):
+    print(f"{'benchmark':40} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:40} {'-':>10} {result['median']:10.4f} {'-':>7}")
+            continue
+        baseline_median = baseline[name]["median"]
+        ratio = result["median"] / baseline_median
+        print(f"{name:40} {baseline_median:10.4f} {result['median']:10.4f} {ratio:7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default="sie", choices=["sie", "sia"])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of runs of each benchmark.")
+    parser.add_argument("--filter", default="", help="Only run the benchmarks with this substring in the name.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--compare", help="Compare the median run times with the results in this JSON file.")
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in benchmarks(args.index).items():
+        if args.filter in name:
+            results[name] = time_function(func, args.repeat)
+            print(f"{name:40} median {results[name]['median']:.4f} s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Compare the memory use of the cached products, and the size of the daily document sent to the browser, with and
+without COMPACT_PRODUCTS, with the products calculated from local fixture files. That compact mode doesn't change the
+shown values and ranks is tested by tests/test_compact_products.py.
+
+Run from the root of the repository:
+
+    python benchmarks/compact_products.py --output compact_products.json
+
+Each mode runs in its own process, since COMPACT_PRODUCTS is read when the products module is imported. The memory of
+the products is the memory that is allocated while calculating them and still held afterwards, traced with tracemalloc
+after the data has been loaded.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+import numpy as np
+
+import harness
+from bench_toolkit import metadata
+
+REFERENCE_PERIOD = "1981-2010"
+
+
+def measure_mode(areas, indices):
+    """Calculate the products of both apps in this process, and return the memory they use and the size of the daily
+    documents."""
+    import products as pr
+    import figures
+    from bokeh.document import Document
+    from bokeh.protocol import Protocol
+
+    datasets = list(itertools.product(indices, areas))
+    # Load the data first, so that only the products are traced.
+    for (index, area), frequency in itertools.product(datasets, ["daily", "monthly"]):
+        pr.get_data(index, area, frequency, "v2p2")["da"].load()
+
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    for index, area in datasets:
+        for plot_type in pr.PLOT_TYPES:
+            pr.get_daily_products(index, area, "v2p2", REFERENCE_PERIOD, plot_type)
+            pr.get_decadal_products(index, area, "v2p2", REFERENCE_PERIOD, plot_type)
+        pr.get_monthly_products(index, area, "v2p2", REFERENCE_PERIOD, False)
+    gc.collect()
+    products_bytes = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+
+    # The size of the document that is sent to the browser when a daily session is opened.
+    document_bytes = []
+    for index, area in datasets:
+        for plot_type in pr.PLOT_TYPES:
+            products = pr.get_daily_products(index, area, "v2p2", REFERENCE_PERIOD, plot_type)
+            doc = Document()
+            doc.add_root(figures.DailyFigure(products, REFERENCE_PERIOD, plot_type, "viridis").plot)
+            document_bytes.append(len(Protocol().create("PULL-DOC-REPLY", "benchmark", doc).content_json))
+
+    return {"products_bytes": products_bytes,
+            "document_bytes_median": float(np.median(document_bytes)),
+            "document_bytes_total": sum(document_bytes)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="Directory with fixture files (written to a temporary directory if not set).")
+    parser.add_argument("--areas", nargs="+", default=["glb", "nh", "sh", "bar", "ross"])
+    parser.add_argument("--indices", nargs="+", default=["sie", "sia"])
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--measure", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        # Run by the parent process with the fixtures and COMPACT_PRODUCTS in the environment.
+        json.dump(measure_mode(args.areas, args.indices), sys.stdout)
+        return 0
+
+    results = {}
+    with harness.fixtures_directory(args.fixtures) as fixtures:
+        for mode in ["0", "1"]:
+            env = dict(os.environ,
+                       COMPACT_PRODUCTS=mode,
+                       DATA_URL_PREFIX=os.path.abspath(fixtures),
+                       PYTHONPATH=os.pathsep.join([harness.APP_ROOT, os.environ.get("PYTHONPATH", "")]))
+            env.pop("PRODUCT_CACHE_DIR", None)
+            process = subprocess.run([sys.executable, __file__, "--measure",
+                                      "--areas", *args.areas, "--indices", *args.indices],
+                                     env=env, stdout=subprocess.PIPE, check=True)
+            results["compact" if mode == "1" else "default"] = json.loads(process.stdout)
+
+    for mode in ["default", "compact"]:
+        print(f"{mode}: products {results[mode]['products_bytes'] / 2**20:.1f} MiB, "
+              f"daily document median {results[mode]['document_bytes_median'] / 2**10:.0f} KiB", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
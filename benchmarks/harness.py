@@ -0,0 +1,105 @@
+"""Helpers for running the apps against local fixture files and driving sessions with the Bokeh client."""
+from contextlib import contextmanager
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+import panel.models  # noqa: F401 Registers the Panel models so the client can deserialize the documents.
+from bokeh.client import pull_session
+from bokeh.document.events import MessageSentEvent
+from bokeh.events import DocumentReady
+from bokeh.models import DataTable, Plot
+
+import make_fixtures
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+APP_ROOT = os.path.join(REPO_ROOT, "bokeh-app")
+
+
+@contextmanager
+def fixtures_directory(directory=None):
+    """Use the given directory with fixture files, or write them to a temporary directory."""
+    if directory is not None:
+        yield directory
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        make_fixtures.make_fixtures(directory)
+        yield directory
+
+
+@contextmanager
+def served_apps(fixtures, port, env=None, args=(), timeout=60):
+    """Serve the apps with panel serve, reading the data from the fixture files, until the with block exits."""
+    server_env = dict(os.environ,
+                      DATA_URL_PREFIX=os.path.abspath(fixtures),
+                      APP_ROOT=APP_ROOT,
+                      PYTHONPATH=os.pathsep.join([APP_ROOT, os.environ.get("PYTHONPATH", "")]),
+                      **(env or {}))
+    command = [sys.executable, "-m", "panel", "serve",
+               *(os.path.join(APP_ROOT, app) for app in ["daily", "monthly", "compare", "summary"]),
+               "--port", str(port), "--plugins", "routes", *args]
+
+    with subprocess.Popen(command, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as server:
+        try:
+            wait_for_server(port, timeout)
+            yield server
+        finally:
+            server.terminate()
+
+
+def wait_for_server(port, timeout):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(f"http://localhost:{port}/metrics")
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
+
+
+def open_session(url, arguments=None):
+    """Open a session, and simulate that the page has finished loading in the browser so that the plot is added."""
+    session = pull_session(url=url, arguments=arguments)
+    event = MessageSentEvent(session.document, "bokeh_event", DocumentReady())
+    session._connection._send_patch_document(session.id, event)
+
+    return session
+
+
+def wait_until(session, predicate, timeout=120):
+    """Process messages from the server until the predicate is true. Returns False if the timeout was reached."""
+    deadline = time.monotonic() + timeout
+    session._connection._loop_until(lambda: predicate() or time.monotonic() > deadline)
+
+    return predicate()
+
+
+def round_trip(session):
+    """Wait until the server has processed the messages sent before, and the updates have been received. The server
+    handles the messages of a connection in order, but Panel runs the callbacks of the changes on the next tick of the
+    event loop, after replying to the first server info request. The reply to the second request arrives after them."""
+    # ClientSession.request_server_info only asks the server once, and caches the reply.
+    for _ in range(2):
+        session._connection._send_request_server_info()
+
+
+def has_plot(session):
+    # The summary app shows a table instead of a plot.
+    return any(isinstance(model, (Plot, DataTable)) for model in session.document.models)
+
+
+def time_to_first_plot(url, arguments=None, timeout=120):
+    """Time from opening a session until the document with the plot has been received."""
+    start = time.perf_counter()
+    session = open_session(url, arguments)
+    try:
+        if not wait_until(session, lambda: has_plot(session), timeout):
+            raise TimeoutError(f"No plot received from {url} within {timeout} s")
+        return time.perf_counter() - start
+    finally:
+        session.close()
@@ -0,0 +1,237 @@
+"""Load test the apps with many concurrent sessions that interact with the widgets, served from local fixture files.
+
+Run from the root of the repository:
+
+    python benchmarks/loadtest.py --sessions 20 --output loadtest.json
+    python benchmarks/loadtest.py --sessions 20 --compare loadtest.json
+
+Each session opens /daily or /monthly, waits for the plot, and then changes areas, plot and zoom shortcuts, colour
+maps and trend lines at random. The latency of an interaction is the time until the server has processed the change
+and sent back the updates. The memory per session and the CPU use are read from /proc for the server process.
+"""
+import argparse
+import json
+import os
+import random
+import shlex
+import sys
+import threading
+import time
+import numpy as np
+from bokeh.document.events import MessageSentEvent
+from bokeh.events import MenuItemClick
+from bokeh.models import AutocompleteInput
+
+import harness
+from bench_toolkit import metadata
+
+
+def _option_values(options):
+    if isinstance(options, dict):
+        return [value for group in options.values() for value in _option_values(group)]
+
+    return [option[0] if isinstance(option, (list, tuple)) else option for option in options]
+
+
+def select_option(title):
+    def interact(session, rng):
+        model = session.document.select_one({"title": title})
+        # The suggestions of an autocomplete input, e.g. the reference periods, are its completions.
+        options = model.completions if isinstance(model, AutocompleteInput) else model.options
+        model.value = rng.choice([value for value in _option_values(options) if value != model.value])
+
+    return interact
+
+
+def choose_options(title, count):
+    def interact(session, rng):
+        model = session.document.select_one({"title": title})
+        model.value = rng.sample(_option_values(model.options), rng.randint(1, count))
+
+    return interact
+
+
+class _MenuItemClick(MenuItemClick):
+    # The item is sent along with the click by the browser, but is not serialized by the Python event.
+    def event_values(self):
+        return dict(**super().event_values(), item=self.item)
+
+
+def click_menu_item(label):
+    def interact(session, rng):
+        model = session.document.select_one({"label": label})
+        event = _MenuItemClick(model, item=rng.choice([value for _, value in model.menu]))
+        session._connection._send_patch_document(session.id, MessageSentEvent(session.document, "bokeh_event", event))
+
+    return interact
+
+
+INTERACTIONS = {
+    "daily": {"area": select_option("Area:"),
+              "plot_shortcut": click_menu_item("Plot shortcuts"),
+              "zoom": click_menu_item("Zoom shortcuts:"),
+              "colour": select_option("Color scale of yearly data:")},
+    "monthly": {"area": select_option("Area:"),
+                "colour": select_option("Colour map:"),
+                "trend": select_option("Trend line:")},
+    "compare": {"areas": choose_options("Areas:", 4),
+                "plot_type": select_option("Plot type:")},
+    "summary": {"ref_period": select_option("Reference period of anomalies:")},
+}
+
+
+def read_proc_stats(pid):
+    """Return the resident memory in bytes, and the CPU time in seconds of a process."""
+    with open(f"/proc/{pid}/status") as f:
+        rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+        cpu_time = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+    return rss, cpu_time
+
+
+def run_session(url, app, interactions, think_time, seed, barrier, results):
+    rng = random.Random(seed)
+    session = None
+    try:
+        start = time.perf_counter()
+        session = harness.open_session(url)
+        harness.wait_until(session, lambda: harness.has_plot(session))
+        results["session_open"].append(time.perf_counter() - start)
+
+        # Wait until all sessions are open before interacting.
+        barrier.wait()
+
+        for _ in range(interactions):
+            name = rng.choice(list(INTERACTIONS[app]))
+            start = time.perf_counter()
+            INTERACTIONS[app][name](session, rng)
+            harness.round_trip(session)
+            results["interactions"].append((f"{app}_{name}", time.perf_counter() - start))
+            time.sleep(rng.uniform(0, 2 * think_time))
+    except Exception as ex:
+        results["errors"].append(repr(ex))
+        barrier.abort()
+    finally:
+        # Keep the session open until all sessions are done, so that the memory is measured with all of them open.
+        try:
+            barrier.wait()
+        except threading.BrokenBarrierError:
+            pass
+        if session is not None:
+            session.close()
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0}
+
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"count": len(values), "p50": p50, "p95": p95, "p99": p99, "max": max(values)}
+
+
+def run(port, server_pid, sessions, apps, interactions, think_time, timeout):
+    results = {"session_open": [], "interactions": [], "errors": []}
+    barrier = threading.Barrier(sessions + 1, timeout=timeout)
+
+    rss_before, _ = read_proc_stats(server_pid)
+    threads = [threading.Thread(target=run_session,
+                                args=(f"http://localhost:{port}/{apps[i % len(apps)]}",
+                                      apps[i % len(apps)],
+                                      interactions,
+                                      think_time,
+                                      i,
+                                      barrier,
+                                      results))
+               for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+
+    # All sessions are open.
+    barrier.wait()
+    rss_open, cpu_start = read_proc_stats(server_pid)
+    wall_start = time.perf_counter()
+
+    # All sessions are done interacting.
+    barrier.wait()
+    rss_end, cpu_end = read_proc_stats(server_pid)
+    wall_time = time.perf_counter() - wall_start
+
+    for thread in threads:
+        thread.join()
+
+    by_interaction = {}
+    for name, latency in results["interactions"]:
+        by_interaction.setdefault(name, []).append(latency)
+
+    return {"latency": percentiles([latency for _, latency in results["interactions"]]),
+            "latency_by_interaction": {name: percentiles(values) for name, values in sorted(by_interaction.items())},
+            "session_open": percentiles(results["session_open"]),
+            "memory": {"rss_before_mb": rss_before / 2**20,
+                       "rss_sessions_open_mb": rss_open / 2**20,
+                       "rss_end_mb": rss_end / 2**20,
+                       "per_session_mb": (rss_end - rss_before) / 2**20 / sessions},
+            # The server handles the sessions on one thread, so 100% means that it is saturated.
+            "cpu": {"percent_of_one_core": 100 * (cpu_end - cpu_start) / wall_time,
+                    "cpu_seconds": cpu_end - cpu_start,
+                    "wall_seconds": wall_time},
+            "errors": results["errors"]}
+
+
+def print_summary(summary, baseline=None):
+    def row(name, stats, baseline_stats):
+        line = f"{name:28} n={stats['count']:<5}"
+        for key in ["p50", "p95", "p99"]:
+            if key in stats:
+                line += f" {key} {stats[key]:7.3f} s"
+                if baseline_stats and key in baseline_stats:
+                    line += f" ({stats[key] / baseline_stats[key]:4.2f}x)"
+        print(line)
+
+    baseline = baseline or {}
+    row("all interactions", summary["latency"], baseline.get("latency"))
+    for name, stats in summary["latency_by_interaction"].items():
+        row(name, stats, baseline.get("latency_by_interaction", {}).get(name))
+    row("session open", summary["session_open"], baseline.get("session_open"))
+    print(f"memory per session {summary['memory']['per_session_mb']:.1f} MB, "
+          f"server CPU {summary['cpu']['percent_of_one_core']:.0f}% of one core, "
+          f"{len(summary['errors'])} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="Directory with fixture files (written to a temporary directory if not set).")
+    parser.add_argument("--port", type=int, default=5011)
+    parser.add_argument("--sessions", type=int, default=10, help="Number of concurrent sessions.")
+    parser.add_argument("--apps", nargs="+", default=["daily", "monthly"], choices=list(INTERACTIONS))
+    parser.add_argument("--interactions", type=int, default=10, help="Number of interactions per session.")
+    parser.add_argument("--think-time", type=float, default=1, help="Mean pause in seconds between interactions.")
+    parser.add_argument("--timeout", type=float, default=600, help="Maximum time in seconds to wait for sessions.")
+    parser.add_argument("--server-args", default="", help="Extra arguments to panel serve, e.g. '--num-threads 4'.")
+    parser.add_argument("--output", help="Write the summary to this JSON file.")
+    parser.add_argument("--compare", help="Compare the latencies with the summary in this JSON file.")
+    args = parser.parse_args()
+
+    with harness.fixtures_directory(args.fixtures) as fixtures, \
+            harness.served_apps(fixtures, args.port, args=shlex.split(args.server_args)) as server:
+        summary = run(args.port, server.pid, args.sessions, args.apps, args.interactions, args.think_time,
+                      args.timeout)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["summary"]
+    print_summary(summary, baseline)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "config": vars(args), "summary": summary}, f, indent=2)
+
+    if summary["errors"]:
+        print("\n".join(summary["errors"]), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Write synthetic NetCDF files for all datasets served by the apps, in the same directory structure as on thredds.
+
+Run from the root of the repository, and point the apps at the files with the DATA_URL_PREFIX environment variable:
+
+    python benchmarks/make_fixtures.py fixtures
+    DATA_URL_PREFIX=$PWD/fixtures panel serve bokeh-app/daily bokeh-app/monthly
+"""
+import argparse
+import itertools
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bokeh-app"))
+
+import products as pr  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def make_fixtures(directory, end=None):
+    for seed, (version, area, index, frequency) in enumerate(itertools.product(pr.VERSIONS,
+                                                                                pr.AREAS,
+                                                                                pr.INDICES,
+                                                                                ["daily", "monthly"])):
+        path = os.path.join(directory, version, area, f"osisaf_{area}_{index}_{frequency}.nc")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        synthetic.create_dataset(index, area, frequency, version, end, seed).to_netcdf(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory to write the NetCDF files to.")
+    parser.add_argument("--end", help="Date of the last data point (default today).")
+    args = parser.parse_args()
+
+    make_fixtures(args.directory, args.end)
+
+
+if __name__ == "__main__":
+    main()
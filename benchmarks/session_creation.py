@@ -0,0 +1,92 @@
+"""Measure the time to create /daily sessions with and without the pool of prebuilt figures, with the apps served from
+local fixture files.
+
+Run from the root of the repository:
+
+    python benchmarks/session_creation.py --output session_creation.json
+
+For each pool size a server is started, and sessions of the same selection are opened one at a time with a pause in
+between, so that the figures taken from the pool are built again before the next session. The session build time is
+the time the server spends running the app script, read from the session_build histogram on /metrics, and the time to
+first plot is measured by the client. The first session of each server reads the data and calculates the products, so
+it's not counted.
+"""
+import argparse
+import json
+import re
+import statistics
+import sys
+import time
+import urllib.request
+
+import harness
+from bench_toolkit import metadata
+
+
+def stage_total(port, stage):
+    """Return the total time and number of calls of a stage, summed over all labels, from /metrics."""
+    total = count = 0
+    metrics = urllib.request.urlopen(f"http://localhost:{port}/metrics").read().decode()
+    for name, labels, value in re.findall(r"^sea_ice_stage_duration_seconds_(sum|count)\{(.*)\} (\S+)$", metrics,
+                                          flags=re.MULTILINE):
+        if f'stage="{stage}"' in labels:
+            if name == "sum":
+                total += float(value)
+            else:
+                count += int(value)
+
+    return total, count
+
+
+def measure(fixtures, port, pool_size, sessions, pause, arguments):
+    url = f"http://localhost:{port}/daily"
+    with harness.served_apps(fixtures, port, env={"FIGURE_POOL_SIZE": str(pool_size)}):
+        harness.time_to_first_plot(url, arguments)
+        time.sleep(pause)
+
+        build_times = []
+        first_plot_times = []
+        for _ in range(sessions):
+            total_before, _ = stage_total(port, "session_build")
+            first_plot_times.append(harness.time_to_first_plot(url, arguments))
+            total_after, _ = stage_total(port, "session_build")
+            build_times.append(total_after - total_before)
+            time.sleep(pause)
+
+    return {"session_build_median": statistics.median(build_times),
+            "first_plot_median": statistics.median(first_plot_times),
+            "session_build": build_times,
+            "first_plot": first_plot_times}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="Directory with fixture files (written to a temporary directory if not set).")
+    parser.add_argument("--port", type=int, default=5012)
+    parser.add_argument("--sessions", type=int, default=10, help="Number of sessions per pool size.")
+    parser.add_argument("--pause", type=float, default=2, help="Pause in seconds between the sessions.")
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[0, 2])
+    parser.add_argument("--area", default="nh")
+    parser.add_argument("--index", default="sie")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    results = {}
+    with harness.fixtures_directory(args.fixtures) as fixtures:
+        for pool_size in args.pool_sizes:
+            results[pool_size] = measure(fixtures,
+                                         args.port,
+                                         pool_size,
+                                         args.sessions,
+                                         args.pause,
+                                         {"area": args.area, "index": args.index})
+            print(f"pool size {pool_size}: session build median {results[pool_size]['session_build_median']:.3f} s, "
+                  f"time to first plot median {results[pool_size]['first_plot_median']:.3f} s", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
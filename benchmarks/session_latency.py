@@ -0,0 +1,61 @@
+"""Measure the time to first plot of /daily and /monthly sessions, with the apps served from local fixture files.
+
+Run from the root of the repository:
+
+    python benchmarks/session_latency.py --output latency.json
+
+The startup time is the time until the server answers requests. The first session of each app is cold: the app
+modules are imported, the data has to be read and the products calculated. The following sessions show the cost when
+the products are cached.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+
+import harness
+from bench_toolkit import metadata
+
+APPS = ["daily", "monthly"]
+
+
+def measure(port, sessions, arguments):
+    results = {}
+    for app in APPS:
+        url = f"http://localhost:{port}/{app}"
+        runs = [harness.time_to_first_plot(url, arguments) for _ in range(sessions)]
+        warm_runs = runs[1:] or runs
+        results[app] = {"cold": runs[0],
+                        "warm_median": statistics.median(warm_runs),
+                        "warm_min": min(warm_runs),
+                        "runs": runs}
+        print(f"{app:10} cold {runs[0]:.3f} s, warm median {results[app]['warm_median']:.3f} s", file=sys.stderr)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="Directory with fixture files (written to a temporary directory if not set).")
+    parser.add_argument("--port", type=int, default=5010)
+    parser.add_argument("--sessions", type=int, default=5, help="Number of sessions per app.")
+    parser.add_argument("--area", default="nh")
+    parser.add_argument("--index", default="sie")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    args = parser.parse_args()
+
+    with harness.fixtures_directory(args.fixtures) as fixtures:
+        start = time.perf_counter()
+        with harness.served_apps(fixtures, args.port):
+            startup = time.perf_counter() - start
+            print(f"{'startup':10} {startup:.3f} s", file=sys.stderr)
+            results = {"startup": startup, **measure(args.port, args.sessions, {"area": args.area, "index": args.index})}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": metadata(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Synthetic sea ice index data with the same shape as the OSI SAF index datasets on thredds."""
+import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+LONG_NAMES = {"sie": "Sea Ice Extent", "sia": "Sea Ice Area"}
+
+
+def _index_values(time, index, seed):
+    # A seasonal cycle with a minimum in September, a slow decline over the years, and some noise.
+    rng = np.random.default_rng(seed)
+    day_of_year = time.dayofyear.values
+    years_since_start = time.year.values - 1978
+    values = 10.5 + 4.5 * np.cos(2 * np.pi * (day_of_year - 70) / 365.25) - 0.05 * years_since_start
+
+    if index == "sia":
+        values = 0.85 * values
+
+    return np.round(values + rng.normal(0, 0.15, len(time)), 3)
+
+
+def create_data_array(index="sie", frequency="daily", end=None, seed=0):
+    """Create a synthetic daily or monthly sea ice index starting in autumn 1978 and ending at the given date (today by
+    default), so the last year is only partially covered. Like the real data, the daily values are only available
+    every other day until August 1987, and there is a gap in December 1987 and January 1988."""
+    if end is None:
+        end = datetime.date.today()
+
+    if frequency == "daily":
+        time = pd.date_range("1978-10-25", end, freq="D")
+    else:
+        time = pd.date_range("1978-11-01", end, freq="MS")
+
+    values = _index_values(time, index, seed)
+
+    if frequency == "daily":
+        values[(time < "1987-08-20") & (np.arange(len(time)) % 2 == 1)] = np.nan
+    values[(time >= "1987-12-03") & (time < "1988-01-13")] = np.nan
+
+    return xr.DataArray(values,
+                        coords={"time": time.values.astype("datetime64[ns]")},
+                        dims="time",
+                        name=index,
+                        attrs={"long_name": LONG_NAMES[index], "units": "10^6 km^2"})
+
+
+def create_dataset(index="sie", area="nh", frequency="daily", version="v2p2", end=None, seed=0):
+    """Create a synthetic dataset with the variables and attributes that are used by the apps."""
+    da = create_data_array(index, frequency, end, seed)
+    title = f"{'Mean ' if frequency == 'monthly' else ''}{area.upper()} {LONG_NAMES[index]} ({version}) " \
+            "from EUMETSAT OSI SAF"
+
+    return xr.Dataset({index: da}, attrs={"title": title, "version": version})
+
+
+def create_extracted_data(index="sie", area="nh", frequency="daily", version="v2p2", end=None, seed=0):
+    """Create a dictionary like the one returned by toolkit.download_and_extract_data."""
+    ds = create_dataset(index, area, frequency, version, end, seed)
+    da = ds[index]
+
+    return {"da": da,
+            "title": ds.title,
+            "ds_version": ds.version,
+            "long_name": da.attrs["long_name"],
+            "units": da.attrs["units"]}
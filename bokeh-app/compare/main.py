@@ -0,0 +1,331 @@
+import panel as pn
+from panel.io.notifications import NotificationArea
+from bokeh.plotting import figure
+from bokeh.models import HoverTool, Paragraph, Legend, Label, Range1d, ColumnDataSource
+import logging
+import param
+import time
+import os
+import toolkit as tk
+import products as pr
+import metrics
+import profiling
+import sessions
+import figures
+
+# Start timing (and possibly profiling) the creation of the session.
+session_start = time.perf_counter()
+session_profiler = profiling.start()
+
+# Get the root directory of the app.
+app_root = os.getenv('APP_ROOT')
+
+# Specify a loading spinner wheel to display when data is being loaded.
+pn.extension(loading_spinner='dots', loading_color='#696969')
+
+
+def exception_handler(ex):
+    # Function used to handle exceptions by showing an error message to the user.
+    logging.error("Error", exc_info=ex)
+    notifications.error(f'{ex}')
+
+
+# Handle exceptions. The notification area is added to the page by the app instead of by Panel, since Panel doesn't
+# remove its own one from its registry of views when the session is destroyed, which keeps the document in memory.
+pn.extension('notifications')
+pn.extension(exception_handler=exception_handler, notifications=False)
+notifications = NotificationArea()
+notifications.servable()
+
+
+# Add a parameter for setting the desired version of the sea ice data, and sync to url parameter.
+class VersionUrlParameter(param.Parameterized):
+    value = param.Parameter("v2p2")
+
+
+pn.state.location.sync(VersionUrlParameter, {'value': 'version'})
+
+# Add dropdown menu for plot type selection, and sync to url parameter. The percentiles are the percentiles of each
+# value among the values of the reference period of its own area, so that areas of different sizes can be compared.
+plot_type_selector = pn.widgets.Select(name='Plot type:',
+                                       options={'Absolute values': 'absolute',
+                                                'Anomalies': 'anomaly',
+                                                'Percentiles of the reference period': 'percentile'},
+                                       value='absolute',
+                                       sizing_mode='stretch_width')
+pn.state.location.sync(plot_type_selector, {'value': 'type'})
+
+# Add dropdown menu for index selection, and sync to url parameter.
+index_selector = pn.widgets.Select(name="Index:",
+                                   options={"Sea Ice Extent": "sie", "Sea Ice Area": "sia"},
+                                   value="sie",
+                                   sizing_mode="stretch_width")
+pn.state.location.sync(index_selector, {"value": "index"})
+
+# Add a multiple choice menu for the areas to compare, and sync to url parameter.
+area_names = {
+    "glb": "Global",
+    "nh": "Northern Hemisphere",
+    "sh": "Southern Hemisphere",
+    "bar": "Barents Sea",
+    "beau": "Beaufort Sea",
+    "chuk": "Chukchi Sea",
+    "ess": "East Siberian Sea",
+    "fram": "Fram Strait",
+    "kara": "Kara Sea",
+    "lap": "Laptev Sea",
+    "sval": "Svalbard",
+    "bell": "Amundsen-Bellingshausen Sea",
+    "drml": "Dronning Maud Land",
+    "indi": "Indian Ocean",
+    "ross": "Ross Sea",
+    "trol": "Troll Station",
+    "wedd": "Weddell Sea",
+    "wpac": "Western Pacific Ocean",
+}
+
+area_selector = pn.widgets.MultiChoice(name="Areas:",
+                                       options={name: area for area, name in area_names.items()},
+                                       value=["bar", "kara"],
+                                       sizing_mode="stretch_width")
+pn.state.location.sync(area_selector, {"value": "areas"})
+
+# Add an input for the reference period of the anomalies and percentiles, and sync to url parameter. Any period can be
+# given as the first and last year, and the standard periods are suggested.
+reference_period_selector = pn.widgets.AutocompleteInput(name="Reference period of anomalies and percentiles:",
+                                                         options=pr.REFERENCE_PERIODS,
+                                                         value="1981-2010",
+                                                         restrict=False,
+                                                         min_characters=0,
+                                                         placeholder="First and last year, e.g. 1981-2010",
+                                                         sizing_mode="stretch_width")
+pn.state.location.sync(reference_period_selector, {"value": "ref_period"})
+
+# The column of the products that is plotted, and the formatting of the values in the hovertool, for each plot type.
+PLOT_COLUMNS = {"absolute": "index_values", "anomaly": "anomaly", "percentile": "percentile"}
+VALUE_TOOLTIPS = {"absolute": ("Index value", "@index_values{0.000}"),
+                  "anomaly": ("Anomaly", "@anomaly{+0.000}"),
+                  "percentile": ("Percentile", "@percentile{0}")}
+
+TOOLTIPS = """
+    <div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">Area:</span>
+            <span style="font-size: 12px;">$name</span>
+        </div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">Date:</span>
+            <span style="font-size: 12px;">@date</span>
+        </div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">{name}:</span>
+            <span style="font-size: 12px;">{value}</span>
+        </div>
+    </div>
+    """
+
+
+def tooltips(plot_type):
+    name, value = VALUE_TOOLTIPS[plot_type]
+    return TOOLTIPS.format(name=name, value=value)
+
+
+def metric_labels():
+    # Labels of the timing metrics of this session. The areas are not included, since there are too many combinations.
+    return {"app": "compare", "index": index_selector.value}
+
+
+def profile_labels():
+    # The selection of this session, used to tag the profiles.
+    return {**metric_labels(),
+            "areas": ",".join(area_selector.value),
+            "plot_type": plot_type_selector.value,
+            "reference_period": reference_period_selector.value}
+
+
+def get_products():
+    # Get the products of the selected areas from the cache that is shared by all sessions.
+    return pr.get_comparison_products(index_selector.value,
+                                      area_selector.value,
+                                      VersionUrlParameter.value,
+                                      reference_period_selector.value)
+
+
+try:
+    products = get_products()
+    extracted_data = pr.get_data(index_selector.value, area_selector.value[0], "daily", VersionUrlParameter.value)
+
+    plot = figure(tools="pan, wheel_zoom, box_zoom, save, reset")
+    plot.sizing_mode = "stretch_both"
+    plot.x_range = Range1d(start=1, end=366)
+    plot.xaxis.ticker = list(figures.X_TICKS.keys())
+    plot.xaxis.major_label_overrides = figures.X_TICKS
+    plot.xaxis.axis_label = "Date"
+
+    legend = Legend(items=[], location="top_center")
+    legend.spacing = 1
+    plot.add_layout(legend, "right")
+    plot.legend.click_policy = "hide"
+
+    hovertool = HoverTool(tooltips=tooltips(plot_type_selector.value), toggleable=False)
+    plot.add_tools(hovertool)
+
+    # The sources and lines of the areas are created for each selection of areas, since the number of areas changes.
+    cds_areas = {}
+    area_lines = {}
+
+    def draw_areas():
+        # Replace the lines of the previous selection with one line of the current year per area.
+        for line in area_lines.values():
+            plot.renderers.remove(line)
+        cds_areas.clear()
+        area_lines.clear()
+
+        colors_dict = tk.find_line_colors(list(products["areas"]), "cyclic_17")
+        for area, data in products["areas"].items():
+            cds_areas[area] = ColumnDataSource(data)
+            area_lines[area] = plot.line(x="day_of_year",
+                                         y=PLOT_COLUMNS[plot_type_selector.value],
+                                         source=cds_areas[area],
+                                         line_width=2,
+                                         color=colors_dict[area],
+                                         name=area_names[area])
+
+        legend.items = [(area_names[area], [line]) for area, line in area_lines.items()]
+        hovertool.renderers = list(area_lines.values())
+
+    def update_labels():
+        # Update the title, the axis label and the text label to the selection.
+        year = max(products["last_dates"].values())[:4]
+        if plot_type_selector.value == "anomaly":
+            plot.title.text = f"{extracted_data['long_name']} Anomaly {year}"
+            plot.yaxis.axis_label = f"{extracted_data['long_name']} Anomaly - {extracted_data['units']}"
+        elif plot_type_selector.value == "percentile":
+            plot.title.text = f"{extracted_data['long_name']} Percentile {year}"
+            plot.yaxis.axis_label = f"Percentile of {reference_period_selector.value}"
+        else:
+            plot.title.text = f"{extracted_data['long_name']} {year}"
+            plot.yaxis.axis_label = f"{extracted_data['long_name']} - {extracted_data['units']}"
+
+        if plot_type_selector.value == "anomaly":
+            label_text = f"Anomalies calculated relative to mean of {reference_period_selector.value}\n"
+        elif plot_type_selector.value == "percentile":
+            label_text = f"Percentiles among the values of each area in {reference_period_selector.value}\n"
+        else:
+            label_text = ""
+
+        # All areas come from the same CDR, so the version of the first area is used.
+        cdr_version = "v2.1" if extracted_data["ds_version"] == "v2p1" else "v3"
+        label_text += f"Data: Derived from OSI SAF Sea Ice Concentration CDRs {cdr_version}\n" \
+                      "Source: EUMETSAT OSI SAF data with R&D input from ESA CCI\n" \
+                      f"Last data point: {max(products['last_dates'].values())}"
+
+        info_label.text = label_text
+
+    info_label = Label(x=5,
+                       y=5,
+                       x_units='screen',
+                       y_units='screen',
+                       text_font_size='12px',
+                       text_color='black')
+    plot.add_layout(info_label)
+
+    draw_areas()
+    update_labels()
+
+    # Use a grid layout.
+    gspec = pn.GridSpec(sizing_mode="stretch_both")
+
+    inputs = pn.Column(plot_type_selector,
+                       index_selector,
+                       area_selector,
+                       reference_period_selector)
+
+
+    def on_load():
+        # Divide the layout into 5 rows and 5 columns. The plot uses 5 rows and 4 columns,
+        # the widgets get the last column and first 3 rows, and the logo gets the last 2 rows.
+        gspec[0:5, 0:4] = pn.pane.Bokeh(plot)
+        gspec[0:3, 4] = inputs
+        gspec[3:5, 4] = pn.pane.PNG(f'{app_root}/assets/logo.png', sizing_mode='scale_both')
+
+    # There is currently a bug in Bokeh 3.1.1 where it incorrectly calculates the amount of available space. To work
+    # around this we load the gridspec elements after the page has finished loading.
+    pn.state.onload(on_load)
+
+
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
+    def update_data(event):
+        with pn.param.set_values(gspec, loading=True):
+            # At least one area must be selected, so keep the lines of the previous selection until one is selected.
+            if not area_selector.value:
+                return
+
+            # Try fetching new data because it might not be available.
+            try:
+                # The products of all selected areas are fetched at once. The datasets of the areas are fetched
+                # concurrently if FETCH_PROCESSES is set, and the products are only calculated if no other session has
+                # requested them before.
+                global products, extracted_data
+                products = get_products()
+                extracted_data = pr.get_data(index_selector.value,
+                                             area_selector.value[0],
+                                             "daily",
+                                             VersionUrlParameter.value)
+
+                draw_areas()
+                update_labels()
+
+            except OSError:
+                # Raise an exception with a custom error message that will be displayed in error prompt for the user.
+                raise ValueError("Data currently unavailable. Please try again later.")
+
+
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
+    def update_plot_type(event):
+        # All plot types are in the sources, so only the plotted column and the hovertool are changed.
+        for line in area_lines.values():
+            line.glyph.y = PLOT_COLUMNS[event.new]
+        hovertool.tooltips = tooltips(event.new)
+        update_labels()
+
+    # Run callbacks when widget values change.
+    plot_type_selector.param.watch(update_plot_type, "value")
+    index_selector.param.watch(update_data, "value")
+    area_selector.param.watch(update_data, "value")
+    reference_period_selector.param.watch(update_data, "value")
+
+    gspec.servable()
+
+    def release_session(session_context, sources=cds_areas):
+        # Drop the references of the session to the data when it's closed, so that the memory is freed even if
+        # something still refers to the callbacks or models of the session. Bokeh may clear the module of the session
+        # before this runs, so the sources are bound when the function is defined.
+        global products, extracted_data
+        for source in sources.values():
+            source.data = {}
+        products = extracted_data = None
+
+    # Register the session for the memory accounting, and release its data when it's closed.
+    sessions.register("compare", profile_labels, lambda: products)
+    pn.state.on_session_destroyed(release_session)
+
+    metrics.observe("session_build", time.perf_counter() - session_start, **metric_labels())
+
+except OSError:
+    # If the datafile is unavailable when the script starts display the message below instead of running the script.
+    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.",
+                     styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+except ValueError as ex:
+    # If the selection in the url is not valid, e.g. a reference period without data, display the reason instead.
+    text = Paragraph(text=str(ex), styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+finally:
+    profiling.stop(session_profiler, "session_build", **profile_labels())
@@ -1,11 +1,20 @@
 import panel as pn
-from bokeh.plotting import figure
-from bokeh.models import AdaptiveTicker, HoverTool, Range1d, Legend, Paragraph, Label, CustomJSHover
-from bokeh.core.properties import value
+from panel.io.notifications import NotificationArea
+from bokeh.models import Paragraph
 import logging
 import param
+import time
 import os
 import toolkit as tk
+import products as pr
+import metrics
+import profiling
+import sessions
+import figures
+
+# Start timing (and possibly profiling) the creation of the session.
+session_start = time.perf_counter()
+session_profiler = profiling.start()
 
 # Get the root directory of the app.
 app_root = os.getenv('APP_ROOT')
@@ -17,12 +26,15 @@ pn.extension(loading_spinner='dots', loading_color='#696969')
 def exception_handler(ex):
     # Function used to handle exceptions by showing an error message to the user.
     logging.error("Error", exc_info=ex)
-    pn.state.notifications.error(f'{ex}')
+    notifications.error(f'{ex}')
 
 
-# Handle exceptions.
+# Handle exceptions. The notification area is added to the page by the app instead of by Panel, since Panel doesn't
+# remove its own one from its registry of views when the session is destroyed, which keeps the document in memory.
 pn.extension('notifications')
-pn.extension(exception_handler=exception_handler, notifications=True)
+pn.extension(exception_handler=exception_handler, notifications=False)
+notifications = NotificationArea()
+notifications.servable()
 
 
 # Add a parameter for setting the desired version of the sea ice data, and sync to url parameter.
@@ -80,11 +92,15 @@ area_selector = pn.widgets.Select(name="Area:",
                                   sizing_mode="stretch_width")
 pn.state.location.sync(area_selector, {"value": "area"})
 
-# Add a dropdown menu for selecting the reference period of the percentile and median plots, and sync to url parameter.
-reference_period_selector = pn.widgets.Select(name="Reference period of percentiles and median:",
-                                              options=["1981-2010", "1991-2020"],
-                                              value="1981-2010",
-                                              sizing_mode="stretch_width")
+# Add an input for the reference period of the percentile and median plots, and sync to url parameter. Any period can be
+# given as the first and last year, and the standard periods are suggested.
+reference_period_selector = pn.widgets.AutocompleteInput(name="Reference period of percentiles and median:",
+                                                         options=pr.REFERENCE_PERIODS,
+                                                         value="1981-2010",
+                                                         restrict=False,
+                                                         min_characters=0,
+                                                         placeholder="First and last year, e.g. 1981-2010",
+                                                         sizing_mode="stretch_width")
 pn.state.location.sync(reference_period_selector, {"value": "ref_period"})
 
 # Create a dropdown button with plot shortcuts, and sync to url parameter.
@@ -135,407 +151,122 @@ color_scale_selector = pn.widgets.Select(name="Color scale of yearly data:",
                                          sizing_mode="stretch_width")
 pn.state.location.sync(color_scale_selector, {"value": "colour"})
 
-# Sometimes the data files are not available on the thredds server, so use try/except to check this.
 
-@pn.cache(max_items=4)
-def get_data(index_selector, area_selector, VersionUrlParameter):
-    extracted_data = tk.download_and_extract_data(index_selector,
-                                                  area_selector,
-                                                  "daily",
-                                                  VersionUrlParameter)
-    return extracted_data
+def metric_labels():
+    # Labels of the timing metrics of this session.
+    return {"app": "daily", "area": area_selector.value, "index": index_selector.value}
+
+
+def profile_labels():
+    # The selection of this session, used to tag the profiles.
+    return {**metric_labels(),
+            "plot_type": plot_type_selector.value,
+            "reference_period": reference_period_selector.value,
+            "colour": color_scale_selector.value}
+
 
+# Sometimes the data files are not available on the thredds server, so use try/except to check this.
 try:
-    extracted_data = get_data(index_selector.value, area_selector.value, VersionUrlParameter.value)
-
-    da = extracted_data["da"]
-
-    # Convert the calendar to an all_leap calendar and interpolate the missing February 29th values.
-    da_converted = tk.convert_and_interpolate_calendar(da)
-
-    reference_period = reference_period_selector.value
-    start_year = reference_period[:4]
-    end_year = reference_period[5:]
-
-    if plot_type_selector.value == 'anomaly':
-        mean = da_converted.sel(time=slice(start_year, end_year)).groupby('time.dayofyear').mean()
-        anomaly = da_converted.groupby('time.dayofyear') - mean
-        da_converted = anomaly
-
-        da_new_calendar = da.convert_calendar('all_leap')
-        da_anomaly = da_new_calendar.groupby('time.dayofyear') - mean
-        da = da_anomaly
-
-    # Calculate the reference period climatology (percentiles and median)
-    percentiles_and_median_dict = tk.calculate_percentiles_and_median(da_converted.sel(time=slice(start_year,
-                                                                                                  end_year)))
-    cds_percentile_1090 = percentiles_and_median_dict["cds_percentile_1090"]
-    cds_percentile_2575 = percentiles_and_median_dict["cds_percentile_2575"]
-    cds_median = percentiles_and_median_dict["cds_median"]
-
-    # Calculate the maximum and minumum values of the index for the entire time series except the current year.
-    min_max_dict = tk.calculate_min_max(da_converted)
-    cds_minimum = min_max_dict["cds_minimum"]
-    cds_maximum = min_max_dict["cds_maximum"]
-
-    # Calculate the decadal climatology (0-100 percentile and median).
-    clim_1980s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("1978", "1989")))
-    clim_1990s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("1990", "1999")))
-    clim_2000s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("2000", "2009")))
-    clim_2010s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("2010", "2019")))
-
-    cds_span_1980s = clim_1980s_dict["cds_span"]
-    cds_median_1980s = clim_1980s_dict["cds_median"]
-    cds_span_1990s = clim_1990s_dict["cds_span"]
-    cds_median_1990s = clim_1990s_dict["cds_median"]
-    cds_span_2000s = clim_2000s_dict["cds_span"]
-    cds_median_2000s = clim_2000s_dict["cds_median"]
-    cds_span_2010s = clim_2010s_dict["cds_span"]
-    cds_median_2010s = clim_2010s_dict["cds_median"]
-
-    # Calculate the index for the individual years.
-    cds_individual_years = tk.calculate_individual_years(da, da_converted)
-
-    # Calculate the yearly min and max values.
-    data_years = tk.get_list_of_years(da)
-    colors_dict = tk.find_line_colors(data_years, color_scale_selector.value)
-    cds_yearly_max, cds_yearly_min = tk.find_yearly_min_max(da_converted, colors_dict)
-
-    # Trim the title to not contain the version number, and to deduplicate "Sea" substrings.
-    trimmed_title = tk.trim_title(extracted_data["title"], plot_type_selector.value)
-
-    # Plot the figure and make sure that it uses all available space.
-    plot = figure(title=trimmed_title, tools="pan, wheel_zoom, box_zoom, save")
-    plot.sizing_mode = "stretch_both"
-    # Add a thick horizontal line to make y=0 stand out.
-    plot.hspan(y=0, line_color='#d0d0d0', line_dash=value([10, 10]), line_width=3)
-
-    # Plot the reference period climatology (percentiles and median).
-    percentile_1090_glyph = plot.varea(x="day_of_year",
-                                       y1="percentile_10",
-                                       y2="percentile_90",
-                                       source=cds_percentile_1090,
-                                       fill_alpha=0.6,
-                                       fill_color="darkgray")
-
-    percentile_2575_glyph = plot.varea(x="day_of_year",
-                                       y1="percentile_25",
-                                       y2="percentile_75",
-                                       source=cds_percentile_2575,
-                                       fill_alpha=0.6,
-                                       fill_color="gray")
-
-    median_glyph = plot.line(x="day_of_year", y="median", source=cds_median, line_width=2, color="dimgray", alpha=0.6)
-
-    # Plot the min and max lines based on the min and max values of the entire period except the current year.
-    min_line_glyph = plot.line(x="day_of_year",
-                               y="minimum",
-                               source=cds_minimum,
-                               line_alpha=0.8,
-                               color="black",
-                               line_width=1.5,
-                               line_dash=[4, 1])
-
-    max_line_glyph = plot.line(x="day_of_year",
-                               y="maximum",
-                               source=cds_maximum,
-                               line_alpha=0.8,
-                               color="black",
-                               line_width=1.5,
-                               line_dash=[4, 1])
-
-    # Create a function for plotting the decadal climatology.
-    def decadal_curves(plot, percentile_source, median_source, fill_color, line_color):
-        percentile = plot.varea(x="day_of_year",
-                                y1="minimum",
-                                y2="maximum",
-                                source=percentile_source,
-                                fill_alpha=0.5,
-                                fill_color=fill_color,
-                                visible=False)
-
-        median_outline = plot.line(x="day_of_year",
-                                   y="median",
-                                   source=median_source,
-                                   line_width=2.2,
-                                   color="black",
-                                   alpha=0.6,
-                                   visible=False)
-
-        median = plot.line(x="day_of_year",
-                           y="median",
-                           source=median_source,
-                           line_width=2,
-                           color=line_color,
-                           alpha=0.6,
-                           visible=False)
-
-        return [percentile, median_outline, median]
-
-    # Plot the decadal climatology.
-    curve_1980s_glyph_list = decadal_curves(plot,
-                                            cds_span_1980s,
-                                            cds_median_1980s,
-                                            colors_dict["1984"],
-                                            colors_dict["1984"])
-
-    curve_1990s_glyph_list = decadal_curves(plot,
-                                            cds_span_1990s,
-                                            cds_median_1990s,
-                                            colors_dict["1994"],
-                                            colors_dict["1994"])
-
-    curve_2000s_glyph_list = decadal_curves(plot,
-                                            cds_span_2000s,
-                                            cds_median_2000s,
-                                            colors_dict["2004"],
-                                            colors_dict["2004"])
-
-    curve_2010s_glyph_list = decadal_curves(plot,
-                                            cds_span_2010s,
-                                            cds_median_2010s,
-                                            colors_dict["2014"],
-                                            colors_dict["2014"])
-
-    # Plot the individual years.
+    # Get the derived products from the cache that is shared by all sessions.
+    products = pr.get_daily_products(index_selector.value,
+                                     area_selector.value,
+                                     VersionUrlParameter.value,
+                                     reference_period_selector.value,
+                                     plot_type_selector.value)
+
+    extracted_data = products["extracted_data"]
+    da = products["da"]
+
+    # Take the figure of the selection from the pool of figures that are built ahead of time. The sources of the figure
+    # are filled with the products, so creating the session only adds the callbacks.
+    daily_figure = figures.daily_figures.take((index_selector.value,
+                                               area_selector.value,
+                                               VersionUrlParameter.value,
+                                               reference_period_selector.value,
+                                               plot_type_selector.value,
+                                               color_scale_selector.value),
+                                              products,
+                                              reference_period_selector.value,
+                                              plot_type_selector.value,
+                                              color_scale_selector.value)
+    plot = daily_figure.plot
+
+    # The sources of the reference period climatology, the min and max values, the individual years and the yearly min
+    # and max values.
+    cds_percentile_1090 = daily_figure.cds_percentile_1090
+    cds_percentile_2575 = daily_figure.cds_percentile_2575
+    cds_median = daily_figure.cds_median
+    cds_minimum = daily_figure.cds_minimum
+    cds_maximum = daily_figure.cds_maximum
+    cds_individual_years = daily_figure.cds_individual_years
+    cds_yearly_max = daily_figure.cds_yearly_max
+    cds_yearly_min = daily_figure.cds_yearly_min
+
+    # The glyphs and hovertools of the figure.
+    percentile_1090_glyph = daily_figure.percentile_1090_glyph
+    percentile_2575_glyph = daily_figure.percentile_2575_glyph
+    median_glyph = daily_figure.median_glyph
+    min_line_glyph = daily_figure.min_line_glyph
+    max_line_glyph = daily_figure.max_line_glyph
+    individual_years_glyphs = daily_figure.individual_years_glyphs
+    yearly_max_glyph = daily_figure.yearly_max_glyph
+    yearly_min_glyph = daily_figure.yearly_min_glyph
+    current_year_outline = daily_figure.current_year_outline
+    current_year_filler = daily_figure.current_year_filler
+    individual_years_hovertool = daily_figure.individual_years_hovertool
+    max_line_hovertool = daily_figure.max_line_hovertool
+    min_line_hovertool = daily_figure.min_line_hovertool
+    TOOLTIPS = daily_figure.tooltips
+    MAX_TOOLTIPS = daily_figure.max_tooltips
+    MIN_TOOLTIPS = daily_figure.min_tooltips
+
+    # The sources and glyphs of the decadal climatology are kept by decade, along with the decades whose climatology
+    # has been loaded into the sources.
+    decadal_curves_dict = daily_figure.decadal_curves_dict
+    loaded_decades = set()
+
+    def load_decade(decade):
+        # Get the climatology of the decade from the cache that is shared by all sessions, and only calculate it if no
+        # other session has shown the decade before.
+        decadal_products = pr.get_decadal_products(index_selector.value,
+                                                   area_selector.value,
+                                                   VersionUrlParameter.value,
+                                                   reference_period_selector.value,
+                                                   plot_type_selector.value)
+        cds_decadal_span, cds_decadal_median, _ = decadal_curves_dict[decade]
+        cds_decadal_span.data.update(decadal_products[decade]["span"])
+        cds_decadal_median.data.update(decadal_products[decade]["median"])
+        loaded_decades.add(decade)
+
+    def show_decade_callback(decade):
+        # Load the climatology of the decade when its curves are shown by clicking the legend.
+        def callback(attr, old, new):
+            if new and decade not in loaded_decades:
+                load_decade(decade)
+
+        return callback
+
+    for decade, (_, _, curve_glyph_list) in decadal_curves_dict.items():
+        curve_glyph_list[0].on_change("visible", show_decade_callback(decade))
+
+    # The colours of the individual years, which are also used for the yearly min/max values when the data is updated.
     data_years = tk.get_list_of_years(da)
     colors_dict = tk.find_line_colors(data_years[:-1], color_scale_selector.value)
-    individual_years_glyphs = []
-    individual_years_glyphs_legend_list = []
-    cds_individual_years_list = list(cds_individual_years.values())
-
-    # Plot all lines except for current year.
-    for year, cds_individual_year in zip(data_years[:-1], cds_individual_years_list[:-1]):
-        line_glyph = plot.line(x="day_of_year",
-                               y="index_values",
-                               source=cds_individual_year,
-                               line_width=2,
-                               line_color=colors_dict[year])
-        individual_years_glyphs.append(line_glyph)
-        individual_years_glyphs_legend_list.append((year, [line_glyph]))
-
-    # Plot the yearly max and min values as triangles and circles, respectively.
-    yearly_max_glyph = plot.circle(x="day_of_year",
-                                   y="index_value",
-                                   color="color",
-                                   size=6,
-                                   source=cds_yearly_max,
-                                   visible=False)
-
-    yearly_min_glyph = plot.circle(x="day_of_year",
-                                   y="index_value",
-                                   color="color",
-                                   size=6,
-                                   source=cds_yearly_min,
-                                   visible=False)
-
-    # Plot the current year as two lines on top of each other (black and white dashed line).
-    current_year_outline = plot.line(x="day_of_year",
-                                     y="index_values",
-                                     source=cds_individual_years_list[-1],
-                                     line_width=3,
-                                     line_color="black")
-
-    current_year_filler = plot.line(x="day_of_year",
-                                    y="index_values",
-                                    source=cds_individual_years_list[-1],
-                                    line_width=2,
-                                    line_dash=[4, 4],
-                                    line_color="white")
-
-    # Add only the current year outline to list of individual year glyphs since we only need one of the current year
-    # glyphs to display the hovertool values.
-    individual_years_glyphs.append(current_year_outline)
-
-    # Add labels and glyphs to legend list to get the desired order.
-    legend_list = [("Climatology", [percentile_1090_glyph, percentile_2575_glyph, median_glyph]),
-                   ("Min/Max", [min_line_glyph, max_line_glyph]),
-                   ("Yearly min/max", [yearly_max_glyph, yearly_min_glyph])]
-    legend_list.extend([("1980s", curve_1980s_glyph_list),
-                        ("1990s", curve_1990s_glyph_list),
-                        ("2000s", curve_2000s_glyph_list),
-                        ("2010s", curve_2010s_glyph_list)])
-    legend_list.extend(individual_years_glyphs_legend_list)
-    legend_list.append((data_years[-1], [current_year_outline, current_year_filler]))
-
-    # To plot legends for the individual years we need to split the list of legends into several sublists. If we
-    # don't do this the list will be so long that it's out of frame. The number below is the maximum number of
-    # elements that can be inside one sublist. This number was determined with basic testing on one specific
-    # computer. This is an issue because other clients can have computers with a different screen resolution which
-    # can fit more legends. Keep this solution for now, but check if there's a better way to solve this.
-    n = 23
-    legend_split = [legend_list[i:i+n] for i in range(0, len(legend_list), n)]
-
-    for sublist in legend_split:
-        legend = Legend(items=sublist, location="top_center")
-        legend.spacing = 1
-        plot.add_layout(legend, "right")
-
-    # Make the clicking the legend hide/show the given element.
-    plot.legend.click_policy = "hide"
-
-    # Add a hovertool to display the date, index value, and rank of the individual years.
-
-    # Function for custom formatting of rank values. If decimal is zero don't show it, otherwise show only one decimal.
-    rank_custom = CustomJSHover(code="""
-    if (Number.isInteger(value)) {
-      return value.toFixed();
-    } else {
-      return value.toFixed(1);
-    }
-    """)
-
-    TOOLTIPS = """
-    <div>
-        <div>
-            <span style="font-size: 12px; font-weight: bold">Date:</span>
-            <span style="font-size: 12px;">@date</span>
-        </div>
-        <div>
-            <span style="font-size: 12px; font-weight: bold">Index:</span>
-            <span style="font-size: 12px;">@index_values{0.000}</span>
-            <span style="font-size: 12px;">mill. km<sup>2</sup></span>
-        </div>
-        <div>
-            <span style="font-size: 12px; font-weight: bold">Rank:</span>
-            <span style="font-size: 12px;">@rank{custom}</span>
-        </div>
-    </div>
-    """
-    if plot_type_selector.value == 'anomaly':
-        TOOLTIPS = TOOLTIPS.replace('0.000', '+0.000')
-
-    individual_years_hovertool = HoverTool(renderers=individual_years_glyphs,
-                                           tooltips=TOOLTIPS,
-                                           formatters={'@rank': rank_custom},
-                                           toggleable=False)
-    plot.add_tools(individual_years_hovertool)
-
-    # Add a hovertool to display the date, index value, and rank of the yearly max values.
-    MAX_TOOLTIPS = """
-        <div>
-            <div>
-                <span style="font-size: 14px; font-weight: bold;">Yearly maximum</span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Date:</span>
-                <span style="font-size: 12px;">@date</span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Index:</span>
-                <span style="font-size: 12px;">@index_value{0.000}</span>
-                <span style="font-size: 12px;">mill. km<sup>2</sup></span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Rank:</span>
-                <span style="font-size: 12px;">@rank{custom}</span>
-            </div>
-        </div>
-        """
-    if plot_type_selector.value == 'anomaly':
-        MAX_TOOLTIPS = MAX_TOOLTIPS.replace('0.000', '+0.000')
-
-    max_line_hovertool = HoverTool(renderers=[yearly_max_glyph],
-                                   tooltips=MAX_TOOLTIPS,
-                                   formatters={'@rank': rank_custom},
-                                   toggleable=False)
-    plot.add_tools(max_line_hovertool)
-
-    # Add a hovertool to display the date, index value, and rank of the yearly min values.
-    MIN_TOOLTIPS = """
-        <div>
-            <div>
-                <span style="font-size: 14px; font-weight: bold;">Yearly minimum</span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Date:</span>
-                <span style="font-size: 12px;">@date</span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Index:</span>
-                <span style="font-size: 12px;">@index_value{0.000}</span>
-                <span style="font-size: 12px;">mill. km<sup>2</sup></span>
-            </div>
-            <div>
-                <span style="font-size: 12px; font-weight: bold">Rank:</span>
-                <span style="font-size: 12px;">@rank{custom}</span>
-            </div>
-        </div>
-        """
-    if plot_type_selector.value == 'anomaly':
-        MIN_TOOLTIPS = MIN_TOOLTIPS.replace('0.000', '+0.000')
-
-    min_line_hovertool = HoverTool(renderers=[yearly_min_glyph],
-                                   tooltips=MIN_TOOLTIPS,
-                                   formatters={'@rank': rank_custom},
-                                   toggleable=False)
-    plot.add_tools(min_line_hovertool)
-
-    # Hardcode the x-ticks (day_of_year, date), and set x-label.
-    plot.x_range = Range1d(start=1, end=366)
-    x_ticks = {1: '1 Jan',
-               32: '1 Feb',
-               61: '1 Mar',
-               92: '1 Apr',
-               122: '1 May',
-               153: '1 Jun',
-               183: '1 Jul',
-               214: '1 Aug',
-               245: '1 Sep',
-               275: '1 Oct',
-               306: '1 Nov',
-               336: '1 Dec',
-               366: '31 Dec'}
-
-    plot.xaxis.ticker = list(x_ticks.keys())
-    plot.xaxis.major_label_overrides = x_ticks
-    plot.xaxis.axis_label = "Date"
-
-    # Initialise the y-range, and aet y-tick properties and y-label.
-    plot.y_range = Range1d()
-    plot.yaxis.ticker = AdaptiveTicker(base=10, mantissas=[1, 2], num_minor_ticks=4, desired_num_ticks=10)
-    if plot_type_selector.value == 'anomaly':
-        plot.yaxis.axis_label = f"{extracted_data['long_name']} Anomaly - {extracted_data['units']}"
-    else:
-        plot.yaxis.axis_label = f"{extracted_data['long_name']} - {extracted_data['units']}"
 
     # Find the day of year with the minimum and maximum values. These are used in the zoom shortcuts.
-    doy_minimum = da_converted.groupby("time.dayofyear").median().idxmin().values.astype(int)
-    doy_maximum = da_converted.groupby("time.dayofyear").median().idxmax().values.astype(int)
-
-    # Add a bottom label with information about the data that's used to make the graphic.
-    first_year = str(data_years[0])
-    second_to_last_year = str(data_years[-2])
-    last_date_string = str(da.time[-1].dt.strftime('%Y-%m-%d').values)
-
-    # Find the version of the data in order to add it to the label, and give the v3p0 data a custom label.
-    if extracted_data["ds_version"] == "v2p1":
-        version_label = "v2.1"
-        cdr_version = "v2.1"
-    elif extracted_data["ds_version"] == "v2p2":
-        version_label = "v2.2"
-        cdr_version = "v3"
-
-    label_text = f"Median and percentiles (25-75% and 10-90%) for {reference_period_selector.value}, " \
-                 f"min/max for {first_year}-{second_to_last_year}\n" \
-                 f"Data: Derived from OSI SAF Sea Ice Concentration CDRs {cdr_version}\n" \
-                 "Source: EUMETSAT OSI SAF data with R&D input from ESA CCI\n" \
-                 f"Last data point: {last_date_string}"
-
-    if plot_type_selector.value == 'anomaly':
-        label_text = f'Anomalies calculated relative to mean of {reference_period_selector.value}\n' + label_text
-
-    info_label = Label(x=5,
-                       y=5,
-                       x_units='screen',
-                       y_units='screen',
-                       text=label_text,
-                       text_font_size='12px',
-                       text_color='black')
-
-    plot.add_layout(info_label)
+    doy_minimum = products["doy_minimum"]
+    doy_maximum = products["doy_maximum"]
+
+    # The information about the data in the bottom label.
+    info_label = daily_figure.info_label
+    first_year = daily_figure.first_year
+    second_to_last_year = daily_figure.second_to_last_year
+    last_date_string = daily_figure.last_date_string
+    cdr_version = daily_figure.cdr_version
 
     # Create a callback for plot shortcuts to hide and show different elements of the plot.
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def plot_shortcuts_callback(event):
         if event.new == "erase_all":
             # All glyphs will be hidden.
@@ -545,11 +276,9 @@ try:
             min_line_glyph.visible = False
             max_line_glyph.visible = False
 
-            for i in range(3):
-                curve_1980s_glyph_list[i].visible = False
-                curve_1990s_glyph_list[i].visible = False
-                curve_2000s_glyph_list[i].visible = False
-                curve_2010s_glyph_list[i].visible = False
+            for _, _, curve_glyph_list in decadal_curves_dict.values():
+                for glyph in curve_glyph_list:
+                    glyph.visible = False
 
             for glyph in individual_years_glyphs:
                 glyph.visible = False
@@ -568,11 +297,9 @@ try:
             min_line_glyph.visible = True
             max_line_glyph.visible = True
 
-            for i in range(3):
-                curve_1980s_glyph_list[i].visible = False
-                curve_1990s_glyph_list[i].visible = False
-                curve_2000s_glyph_list[i].visible = False
-                curve_2010s_glyph_list[i].visible = False
+            for _, _, curve_glyph_list in decadal_curves_dict.values():
+                for glyph in curve_glyph_list:
+                    glyph.visible = False
 
             for glyph in individual_years_glyphs:
                 glyph.visible = True
@@ -592,11 +319,9 @@ try:
             min_line_glyph.visible = True
             max_line_glyph.visible = True
 
-            for i in range(3):
-                curve_1980s_glyph_list[i].visible = False
-                curve_1990s_glyph_list[i].visible = False
-                curve_2000s_glyph_list[i].visible = False
-                curve_2010s_glyph_list[i].visible = False
+            for _, _, curve_glyph_list in decadal_curves_dict.values():
+                for glyph in curve_glyph_list:
+                    glyph.visible = False
 
             yearly_min_glyph.visible = False
             yearly_max_glyph.visible = False
@@ -619,11 +344,9 @@ try:
             min_line_glyph.visible = True
             max_line_glyph.visible = True
 
-            for i in range(3):
-                curve_1980s_glyph_list[i].visible = False
-                curve_1990s_glyph_list[i].visible = False
-                curve_2000s_glyph_list[i].visible = False
-                curve_2010s_glyph_list[i].visible = False
+            for _, _, curve_glyph_list in decadal_curves_dict.values():
+                for glyph in curve_glyph_list:
+                    glyph.visible = False
 
             yearly_min_glyph.visible = False
             yearly_max_glyph.visible = False
@@ -683,11 +406,8 @@ try:
     percentile_1090_glyph.on_change("visible", update_label_text)
     min_line_glyph.on_change("visible", update_label_text)
 
-    # Calculate the height of the text label in pixels in the lower left corner. The number of lines is hardcoded to
-    # 5 in order to have a consistent value that does not depend on whether all of the lines are visible (this
-    # depends on which plot elements are selected).
-    number_of_lines = 6
-    label_height = float(info_label.text_font_size.rstrip('px')) * info_label.text_line_height * number_of_lines
+    # The height of the text label in pixels in the lower left corner.
+    label_height = daily_figure.label_height
 
     y_range_start_fraction = None
     runs = 0
@@ -738,87 +458,54 @@ try:
     pn.state.onload(on_load)
 
 
-    def update_reference_period():
-        with pn.param.set_values(final_pane, loading=True):
-            # Function that is used to update the climatology when the reference period is changed.
-            reference_period = reference_period_selector.value
-            start_year = reference_period[:4]
-            end_year = reference_period[5:]
-
-            percentiles_and_median_dict = tk.calculate_percentiles_and_median(da_converted.sel(time=slice(start_year,
-                                                                                                          end_year)))
-
-            cds_percentile_1090.data.update(percentiles_and_median_dict["cds_percentile_1090"].data)
-            cds_percentile_2575.data.update(percentiles_and_median_dict["cds_percentile_2575"].data)
-            cds_median.data.update(percentiles_and_median_dict["cds_median"].data)
-
-            # Update the label text to display the new reference period.
-            update_label_text(None, None, None)
-
-
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_data(event):
         with pn.param.set_values(final_pane, loading=True):
             # Try fetching new data because it might not be available.
             try:
-                # Update plot with new values from selectors.
-                version = VersionUrlParameter.value
-                index = index_selector.value
-                area = area_selector.value
-
-                # Download and extract new data.
-                extracted_data = tk.download_and_extract_data(index, area, "daily", version)
-                da = extracted_data["da"]
+                # Update plot with new values from selectors. The derived products are fetched from the cache that
+                # is shared by all sessions, and only calculated if no other session has requested them before.
+                global products
+                products = pr.get_daily_products(index_selector.value,
+                                                 area_selector.value,
+                                                 VersionUrlParameter.value,
+                                                 reference_period_selector.value,
+                                                 plot_type_selector.value)
 
-                # Make sure da_converted is global because it's used by other callback functions.
-                global da_converted
-                # Convert calendar to all_leap and interpolate missing February 29th values.
-                da_converted = tk.convert_and_interpolate_calendar(da)
+                extracted_data = products["extracted_data"]
 
-                reference_period = reference_period_selector.value
-                start_year = reference_period[:4]
-                end_year = reference_period[5:]
-
-                if plot_type_selector.value == 'anomaly':
-                    mean = da_converted.sel(time=slice(start_year, end_year)).groupby('time.dayofyear').mean()
-                    anomaly = da_converted.groupby('time.dayofyear') - mean
-                    da_converted = anomaly
+                # Update the climatology plots (percentiles and median).
+                cds_percentile_1090.data.update(products["percentile_1090"])
+                cds_percentile_2575.data.update(products["percentile_2575"])
+                cds_median.data.update(products["median"])
 
-                    da_new_calendar = da.convert_calendar('all_leap')
-                    da_anomaly = da_new_calendar.groupby('time.dayofyear') - mean
-                    da = da_anomaly
-
-                # Recalculate and update the climatology plots (percentiles and median).
-                update_reference_period()
+                # Update the label text to display the new reference period.
+                update_label_text(None, None, None)
 
                 # Update min/max lines.
-                min_max_dict = tk.calculate_min_max(da_converted)
-                cds_minimum.data.update(min_max_dict["cds_minimum"].data)
-                cds_maximum.data.update(min_max_dict["cds_maximum"].data)
-
-                # Update decadal climatology.
-                clim_1980s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("1978", "1989")))
-                clim_1990s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("1990", "1999")))
-                clim_2000s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("2000", "2009")))
-                clim_2010s_dict = tk.calculate_span_and_median(da_converted.sel(time=slice("2010", "2019")))
-
-                cds_span_1980s.data.update(clim_1980s_dict["cds_span"].data)
-                cds_median_1980s.data.update(clim_1980s_dict["cds_median"].data)
-                cds_span_1990s.data.update(clim_1990s_dict["cds_span"].data)
-                cds_median_1990s.data.update(clim_1990s_dict["cds_median"].data)
-                cds_span_2000s.data.update(clim_2000s_dict["cds_span"].data)
-                cds_median_2000s.data.update(clim_2000s_dict["cds_median"].data)
-                cds_span_2010s.data.update(clim_2010s_dict["cds_span"].data)
-                cds_median_2010s.data.update(clim_2010s_dict["cds_median"].data)
+                cds_minimum.data.update(products["minimum"])
+                cds_maximum.data.update(products["maximum"])
+
+                # Update the decadal climatology of the visible decades. The other decades are emptied, and loaded
+                # again when they are shown.
+                loaded_decades.clear()
+                for decade, (cds_decadal_span, cds_decadal_median, curve_glyph_list) in decadal_curves_dict.items():
+                    if curve_glyph_list[0].visible:
+                        load_decade(decade)
+                    else:
+                        cds_decadal_span.data = figures.empty_span_data()
+                        cds_decadal_median.data = figures.empty_median_data()
 
                 # Update the individual years.
-                new_cds_individual_years = tk.calculate_individual_years(da, da_converted)
-                for new_cds, old_cds in zip(new_cds_individual_years.values(), cds_individual_years.values()):
-                    old_cds.data.update(new_cds.data)
+                for new_data, old_cds in zip(products["individual_years"].values(), cds_individual_years.values()):
+                    old_cds.data.update(new_data)
 
                 # Update the yearly min/max values.
-                new_cds_yearly_max, new_cds_yearly_min = tk.find_yearly_min_max(da_converted, colors_dict)
-                cds_yearly_max.data.update(new_cds_yearly_max.data)
-                cds_yearly_min.data.update(new_cds_yearly_min.data)
+                cds_yearly_max.data.update(products["yearly_max"],
+                                           color=tk.yearly_min_max_colors(products["yearly_max"], colors_dict))
+                cds_yearly_min.data.update(products["yearly_min"],
+                                           color=tk.yearly_min_max_colors(products["yearly_min"], colors_dict))
 
                 # Update the index formatting in the hovertools.
                 global MIN_TOOLTIPS
@@ -849,9 +536,9 @@ try:
                 # Find the day of year for the average minimum and maximum values. These are global variables because
                 # they are used in other callbacks.
                 global doy_minimum
-                doy_minimum = da_converted.groupby("time.dayofyear").median().idxmin().values.astype(int)
+                doy_minimum = products["doy_minimum"]
                 global doy_maximum
-                doy_maximum = da_converted.groupby("time.dayofyear").median().idxmax().values.astype(int)
+                doy_maximum = products["doy_maximum"]
 
                 # Update the zoom to the new data using the current zoom state.
                 zoom_shortcuts.param.trigger("clicked")
@@ -861,6 +548,8 @@ try:
                 raise ValueError("Data currently unavailable. Please try again later.")
 
 
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_zoom(event):
         # The callback function that updates the zoom level when the zoom shortcut is used.
         with pn.param.set_values(final_pane, loading=True):
@@ -902,43 +591,18 @@ try:
 
 
     def set_zoom_yrange(padding_frac, y_range_start_fraction, plot_type):
-        # Set the y-range between the minimum and maximum values plus a little padding. Also account for the height
-        # of the text label in the lower left corner by lowering the start value of the y-range accordingly.
-
-        # Find the x-range.
-        doy_start = plot.x_range.start
-        doy_end = plot.x_range.end
-
-        # Find the min and max values for each day of year.
-        dayofyear_min_values = da_converted.groupby("time.dayofyear").min()
-        dayofyear_max_values = da_converted.groupby("time.dayofyear").max()
-
-        # Find the lowest min and highest max values inside the x-range displayed.
-        data_min_value = dayofyear_min_values.sel(dayofyear=slice(doy_start, doy_end)).min().values
-        data_max_value = dayofyear_max_values.sel(dayofyear=slice(doy_start, doy_end)).max().values
-
-        if plot_type != 'anomaly':
-            text_label_height = y_range_start_fraction * (data_max_value - data_min_value)
-        else:
-            # We use the absolute max value since anomalies are centred on y=0.
-            data_max_value = max(abs(data_min_value), abs(data_max_value))
-            text_label_height = y_range_start_fraction * 2 * data_max_value
-
-        # Sometimes the minimum and maximum values are the same. Account for this to always have some padding.
-        if data_max_value - data_min_value < 1E-3:
-            padding = data_max_value * padding_frac
-        else:
-            padding = (data_max_value - data_min_value) * padding_frac
-
-        # Set the y-range.
-        if plot_type != 'anomaly':
-            plot.y_range.start = data_min_value - (text_label_height + padding)
-            plot.y_range.end = data_max_value + padding
-        else:
-            plot.y_range.start = -(data_max_value + text_label_height + padding)
-            plot.y_range.end = data_max_value + padding
-
-
+        # Set the y-range between the minimum and maximum values of the displayed x-range plus a little padding, with
+        # room for the text label in the lower left corner.
+        plot.y_range.start, plot.y_range.end = figures.zoom_y_range(products,
+                                                                    plot.x_range.start,
+                                                                    plot.x_range.end,
+                                                                    padding_frac,
+                                                                    y_range_start_fraction,
+                                                                    plot_type)
+
+
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_line_color(event):
         # Function that updates the colors of glyphs.
         with pn.param.set_values(final_pane, loading=True):
@@ -946,21 +610,15 @@ try:
             data_years = list(cds_individual_years.keys())
             colors_dict = tk.find_line_colors(data_years[:-1], color)
 
-            curve_1980s_glyph_list[0].glyph.fill_color = colors_dict["1984"]
-            curve_1980s_glyph_list[2].glyph.line_color = colors_dict["1984"]
-            curve_1990s_glyph_list[0].glyph.fill_color = colors_dict["1994"]
-            curve_1990s_glyph_list[2].glyph.line_color = colors_dict["1994"]
-            curve_2000s_glyph_list[0].glyph.fill_color = colors_dict["2004"]
-            curve_2000s_glyph_list[2].glyph.line_color = colors_dict["2004"]
-            curve_2010s_glyph_list[0].glyph.fill_color = colors_dict["2014"]
-            curve_2010s_glyph_list[2].glyph.line_color = colors_dict["2014"]
+            for decade, (_, _, curve_glyph_list) in decadal_curves_dict.items():
+                curve_glyph_list[0].glyph.fill_color = figures.decade_color(colors_dict, decade)
+                curve_glyph_list[2].glyph.line_color = figures.decade_color(colors_dict, decade)
 
             for year, individual_year_glyph in zip(data_years[:-1], individual_years_glyphs[:-1]):
                 individual_year_glyph.glyph.line_color = colors_dict[year]
 
-            new_cds_yearly_max, new_cds_yearly_min = tk.find_yearly_min_max(da_converted, colors_dict)
-            cds_yearly_max.data.update(new_cds_yearly_max.data)
-            cds_yearly_min.data.update(new_cds_yearly_min.data)
+            cds_yearly_max.data["color"] = tk.yearly_min_max_colors(cds_yearly_max.data, colors_dict)
+            cds_yearly_min.data["color"] = tk.yearly_min_max_colors(cds_yearly_min.data, colors_dict)
 
     # Run callbacks when widget values change.
     plot_type_selector.param.watch(update_data, 'value')
@@ -975,8 +633,33 @@ try:
     # Make sure plot shortcut get set correctly if url parameter is provided.
     plot_shortcuts.param.trigger("clicked")
 
+    def release_session(session_context, sources=daily_figure.sources):
+        # Drop the references of the session to the data when it's closed, so that the memory is freed even if
+        # something still refers to the callbacks or models of the session. Bokeh may clear the module of the session
+        # before this runs, so the sources are bound when the function is defined.
+        global products, extracted_data, da
+        for source in sources:
+            source.data = {}
+        products = extracted_data = da = None
+
+    # Register the session for the memory accounting, and release its data when it's closed.
+    sessions.register("daily", profile_labels, lambda: products)
+    pn.state.on_session_destroyed(release_session)
+
+    metrics.observe("session_build", time.perf_counter() - session_start, **metric_labels())
+
 except OSError:
     # If the datafile is unavailable when the script starts display the message below instead of running the script.
-    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.", style={"font-size": "30px"})
+    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.",
+                     styles={"font-size": "30px"})
 
     bokeh_pane = pn.pane.Bokeh(text).servable()
+
+except ValueError as ex:
+    # If the selection in the url is not valid, e.g. a reference period without data, display the reason instead.
+    text = Paragraph(text=str(ex), styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+finally:
+    profiling.stop(session_profiler, "session_build", **profile_labels())
@@ -0,0 +1,201 @@
+"""Export the default view of the daily app for all areas, indices and plot types as standalone HTML files, and
+optionally as PNG snapshots, so that a static file server or a CDN can serve the views that don't need a live session:
+
+    python bokeh-app/export.py <directory> [--png]
+
+The datasets are exported in parallel by a pool of worker processes, using the same product pipeline as the apps, and
+the derived products are read from PRODUCT_CACHE_DIR if it's set. The data stamp of each output is kept in
+manifest.json in the directory, and only the outputs whose data has changed since the last export are written again,
+so the command can run e.g. every hour. The PNG snapshots are made in a browser, and need selenium and geckodriver or
+chromedriver, which are not in requirements.txt.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from bokeh.embed import file_html
+from bokeh.io import export_png
+from bokeh.resources import CDN, INLINE
+
+import products as pr
+import figures
+
+# The selection of the default view of the daily app.
+REFERENCE_PERIOD = "1981-2010"
+COLOR = "viridis"
+
+# The size of the exported figures in pixels. The HTML figures are stretched to the width of the page.
+WIDTH = 1400
+HEIGHT = 700
+# The approximate height of the title and the x-axis in pixels, used to find the height of the plot canvas, which is
+# only known once the figure is rendered.
+FRAME_MARGIN = 80
+
+MANIFEST = "manifest.json"
+
+
+def output_name(index, area, version, plot_type):
+    return f"{version}_{index}_{area}_{plot_type}"
+
+
+def build_figure(index, area, version, plot_type):
+    """Build the daily figure of the default view with all decadal climatologies loaded, since there is no server to
+    load them when they are shown, and zoomed to the whole year."""
+    products = pr.get_daily_products(index, area, version, REFERENCE_PERIOD, plot_type)
+    daily_figure = figures.DailyFigure(products, REFERENCE_PERIOD, plot_type, COLOR)
+
+    decadal_products = pr.get_decadal_products(index, area, version, REFERENCE_PERIOD, plot_type)
+    for decade, (cds_decadal_span, cds_decadal_median, _) in daily_figure.decadal_curves_dict.items():
+        cds_decadal_span.data.update(decadal_products[decade]["span"])
+        cds_decadal_median.data.update(decadal_products[decade]["median"])
+
+    plot = daily_figure.plot
+    plot.sizing_mode = "stretch_width"
+    plot.width = WIDTH
+    plot.height = HEIGHT
+    y_range_start_fraction = daily_figure.label_height / (HEIGHT - FRAME_MARGIN)
+    plot.y_range.start, plot.y_range.end = figures.zoom_y_range(products,
+                                                                plot.x_range.start,
+                                                                plot.x_range.end,
+                                                                0.05,
+                                                                y_range_start_fraction,
+                                                                plot_type)
+
+    return plot
+
+
+def write_atomically(path, write):
+    # Write to a temporary file and rename it, so that the file server never serves a partially written file.
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), suffix=os.path.splitext(path)[1], delete=False) as f:
+        temporary_path = f.name
+
+    try:
+        write(temporary_path)
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def export_dataset(directory, index, area, version, formats, options, manifest):
+    """Export the figures of all plot types of a dataset in the given formats, and return the manifest entries of the
+    written outputs. Outputs that are listed in the manifest with the current data stamp and options are skipped."""
+    stamp = pr.dataset_stamp(pr.get_data(index, area, "daily", version))
+    entry = {"stamp": stamp, "options": options}
+
+    written = {}
+    for plot_type in pr.PLOT_TYPES:
+        paths = [os.path.join(directory, f"{output_name(index, area, version, plot_type)}.{output_format}")
+                 for output_format in formats]
+        outdated = [path for path in paths
+                    if manifest.get(os.path.basename(path)) != entry or not os.path.exists(path)]
+        if not outdated:
+            continue
+
+        plot = build_figure(index, area, version, plot_type)
+        for path in outdated:
+            if path.endswith(".html"):
+                resources = INLINE if options["resources"] == "inline" else CDN
+                html = file_html(plot, resources, title=plot.title.text)
+
+                def write(temporary_path):
+                    with open(temporary_path, "w", encoding="utf-8") as f:
+                        f.write(html)
+            else:
+                def write(temporary_path):
+                    # The snapshot is made with a fixed size, since there is no page to stretch to.
+                    plot.sizing_mode = "fixed"
+                    export_png(plot, filename=temporary_path, width=WIDTH, height=HEIGHT)
+
+            write_atomically(path, write)
+            written[os.path.basename(path)] = entry
+
+    return written
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def write_manifest(directory, manifest):
+    def write(temporary_path):
+        with open(temporary_path, "w") as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+
+    write_atomically(os.path.join(directory, MANIFEST), write)
+
+
+def init_worker():
+    # The workers already fetch the datasets in parallel, so they don't start pools of fetch processes of their own.
+    pr.FETCH_PROCESSES = 0
+
+
+def export(directory, formats, resources, max_workers=None):
+    """Export all datasets with a pool of worker processes, and return the number of written outputs and the datasets
+    that failed."""
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory)
+    options = {"reference_period": REFERENCE_PERIOD, "color": COLOR, "resources": resources, "size": [WIDTH, HEIGHT]}
+
+    datasets = list(itertools.product(pr.INDICES, pr.AREAS, pr.VERSIONS))
+    failed = []
+    written = 0
+    # Use spawn instead of fork, like the compute pool of the server.
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context("spawn"),
+                             initializer=init_worker) as executor:
+        futures = {executor.submit(export_dataset, directory, *dataset, formats, options, manifest): dataset
+                   for dataset in datasets}
+        for future in as_completed(futures):
+            # A dataset that is unavailable should not stop the export of the others. Its outputs are left as they
+            # are, and exported again on the next run.
+            if future.exception() is not None:
+                logging.warning(f"Export of {futures[future]} failed: {future.exception()}")
+                failed.append(futures[future])
+                continue
+
+            manifest.update(future.result())
+            written += len(future.result())
+
+    write_manifest(directory, manifest)
+
+    return written, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory to write the outputs to.")
+    parser.add_argument("--png", action="store_true", help="Also write PNG snapshots (needs selenium).")
+    parser.add_argument("--resources", choices=["cdn", "inline"], default="cdn",
+                        help="Load BokehJS from the Bokeh CDN, or include it in every HTML file.")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("EXPORT_WORKERS", 4)),
+                        help="Number of worker processes (default EXPORT_WORKERS or 4).")
+    args = parser.parse_args()
+
+    if args.png:
+        try:
+            import selenium  # noqa: F401
+        except ImportError:
+            parser.error("--png needs selenium, and geckodriver or chromedriver")
+
+    formats = ["html", "png"] if args.png else ["html"]
+    written, failed = export(args.directory, formats, args.resources, args.workers)
+    print(f"{written} outputs written, {len(failed)} datasets failed", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,173 @@
+"""Write the derived products of the apps as columnar files for analysis: the climatology, the min/max envelopes, the
+individual years with their ranks, the yearly extremes and the monthly and decadal trends. Each table of each selection
+is written to a Parquet (or Arrow) file in a directory that is partitioned by the selection, e.g.
+
+    <directory>/daily/individual_years/version=v2p2/index=sie/area=nh/reference_period=1981-2010/type=absolute/
+
+so that each table can be read as one dataset with pyarrow.dataset or pandas.read_parquet. Run e.g.
+
+    python bokeh-app/export_products.py <directory> --areas nh sh --incremental
+
+The areas are exported one at a time, and the caches are cleared in between, so that the memory use does not grow with
+the number of areas. The derived products are read from PRODUCT_CACHE_DIR if it's set. The file names include a hash of
+the data stamp, and with --incremental only the partitions whose data has changed are written again.
+"""
+import argparse
+import glob
+import hashlib
+import itertools
+import logging
+import os
+import sys
+import tempfile
+
+import pyarrow as pa
+import pyarrow.feather
+import pyarrow.parquet
+
+import products as pr
+
+# The tables of products.get_product_tables.
+TABLES = {"daily": ["climatology", "min_max", "individual_years", "yearly_max", "yearly_min"],
+          "monthly": ["all_months", "monthly", "monthly_trend", "decadal_trend"]}
+
+EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow"}
+
+
+def partition_directory(directory, frequency, table, index, area, version, reference_period, plot_type):
+    # The partitions are named key=value, which is understood by the readers as the columns of the selection.
+    partitions = [f"version={version}", f"index={index}", f"area={area}", f"reference_period={reference_period}"]
+    if plot_type is not None:
+        partitions.append(f"type={plot_type}")
+
+    return os.path.join(directory, frequency, table, *partitions)
+
+
+def write_table(partition, name, table, metadata, output_format):
+    """Write a table to the file name in the partition, and remove the files of older data from the partition."""
+    arrow_table = pa.table({column: pa.array(values) for column, values in table.items()},
+                           metadata={key: str(value) for key, value in metadata.items() if value is not None})
+
+    # Write to a hidden file, which is skipped by the readers, and rename it so that the readers never see a partially
+    # written file.
+    os.makedirs(partition, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=partition, prefix=".", delete=False) as f:
+        temporary_path = f.name
+    try:
+        if output_format == "parquet":
+            pyarrow.parquet.write_table(arrow_table, temporary_path, compression="zstd")
+        else:
+            pyarrow.feather.write_feather(arrow_table, temporary_path, compression="zstd")
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, os.path.join(partition, name))
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+    for old_path in glob.glob(os.path.join(glob.escape(partition), f"part-*{EXTENSIONS[output_format]}")):
+        if os.path.basename(old_path) != name:
+            os.remove(old_path)
+
+
+def export_dataset(directory, index, area, version, frequency, reference_periods, output_format, incremental):
+    """Export the tables of all reference periods and plot types of a dataset, and return the number of written and
+    skipped files."""
+    stamp = pr.dataset_stamp(pr.get_data(index, area, frequency, version))
+    name = f"part-{hashlib.sha256(stamp.encode()).hexdigest()[:16]}{EXTENSIONS[output_format]}"
+
+    written = skipped = 0
+    plot_types = pr.PLOT_TYPES if frequency == "daily" else [None]
+    for reference_period, plot_type in itertools.product(reference_periods, plot_types):
+        partitions = {table: partition_directory(directory,
+                                                 frequency,
+                                                 table,
+                                                 index,
+                                                 area,
+                                                 version,
+                                                 reference_period,
+                                                 plot_type)
+                      for table in TABLES[frequency]}
+        if incremental:
+            # The file of the current data already exists if the data hasn't changed since the last export.
+            partitions = {table: partition for table, partition in partitions.items()
+                          if not os.path.exists(os.path.join(partition, name))}
+            skipped += len(TABLES[frequency]) - len(partitions)
+            if not partitions:
+                continue
+
+        tables = pr.get_product_tables(index, area, version, frequency, reference_period, plot_type)
+        metadata = {"index": index,
+                    "area": area,
+                    "version": version,
+                    "frequency": frequency,
+                    "reference_period": reference_period,
+                    "type": plot_type,
+                    "stamp": stamp}
+        for table, partition in partitions.items():
+            write_table(partition, name, tables[table], metadata, output_format)
+            written += 1
+
+    return written, skipped
+
+
+def export(directory, areas, indices, versions, frequencies, reference_periods, output_format, incremental):
+    """Export the tables of all the selected datasets, one area at a time. Returns the number of written and skipped
+    files, and the datasets that failed."""
+    written = skipped = 0
+    failed = []
+    for area in areas:
+        for index, version, frequency in itertools.product(indices, versions, frequencies):
+            # A dataset that is unavailable should not stop the export of the others. Its files are left as they are,
+            # and exported again on the next run.
+            try:
+                dataset_written, dataset_skipped = export_dataset(directory,
+                                                                  index,
+                                                                  area,
+                                                                  version,
+                                                                  frequency,
+                                                                  reference_periods,
+                                                                  output_format,
+                                                                  incremental)
+            except (OSError, ValueError) as ex:
+                logging.warning(f"Export of {(index, area, version, frequency)} failed: {ex}")
+                failed.append((index, area, version, frequency))
+                continue
+
+            written += dataset_written
+            skipped += dataset_skipped
+
+        # Drop the data and products of the area before exporting the next one.
+        pr.clear_caches()
+
+    return written, skipped, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Directory to write the tables to.")
+    parser.add_argument("--areas", nargs="+", choices=pr.AREAS, default=pr.AREAS)
+    parser.add_argument("--indices", nargs="+", choices=pr.INDICES, default=pr.INDICES)
+    parser.add_argument("--versions", nargs="+", choices=pr.VERSIONS, default=pr.VERSIONS)
+    parser.add_argument("--frequencies", nargs="+", choices=list(TABLES), default=list(TABLES))
+    parser.add_argument("--reference-periods", nargs="+", default=pr.REFERENCE_PERIODS)
+    parser.add_argument("--format", choices=list(EXTENSIONS), default="parquet")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only write the partitions whose data has changed since the last export.")
+    args = parser.parse_args()
+
+    written, skipped, failed = export(args.directory,
+                                      args.areas,
+                                      args.indices,
+                                      args.versions,
+                                      args.frequencies,
+                                      args.reference_periods,
+                                      args.format,
+                                      args.incremental)
+    print(f"{written} files written, {skipped} unchanged, {len(failed)} datasets failed", file=sys.stderr)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
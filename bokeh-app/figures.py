@@ -0,0 +1,490 @@
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+from bokeh.plotting import figure
+from bokeh.models import AdaptiveTicker, HoverTool, Range1d, Legend, Label, CustomJSHover, ColumnDataSource
+from bokeh.core.properties import value
+import toolkit as tk
+import metrics
+
+# Creating the Bokeh models of the daily figure takes most of the time of creating a session. The figures are therefore
+# built ahead of time in a background thread, and each new session takes a prebuilt figure for its selection from a
+# pool. FIGURE_POOL_SIZE figures are kept ready for each of the FIGURE_POOL_MAX_SELECTIONS most recently requested
+# selections that have been requested more than once. Set FIGURE_POOL_SIZE to 0 to build the figure in each session
+# instead.
+FIGURE_POOL_SIZE = int(os.getenv("FIGURE_POOL_SIZE", 2))
+FIGURE_POOL_MAX_SELECTIONS = int(os.getenv("FIGURE_POOL_MAX_SELECTIONS", 8))
+
+# Function for custom formatting of rank values. If decimal is zero don't show it, otherwise show only one decimal.
+RANK_CUSTOM_CODE = """
+    if (Number.isInteger(value)) {
+      return value.toFixed();
+    } else {
+      return value.toFixed(1);
+    }
+    """
+
+TOOLTIPS = """
+    <div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">Date:</span>
+            <span style="font-size: 12px;">@date</span>
+        </div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">Index:</span>
+            <span style="font-size: 12px;">@index_values{0.000}</span>
+            <span style="font-size: 12px;">mill. km<sup>2</sup></span>
+        </div>
+        <div>
+            <span style="font-size: 12px; font-weight: bold">Rank:</span>
+            <span style="font-size: 12px;">@rank{custom}</span>
+        </div>
+    </div>
+    """
+
+MAX_TOOLTIPS = """
+        <div>
+            <div>
+                <span style="font-size: 14px; font-weight: bold;">Yearly maximum</span>
+            </div>
+            <div>
+                <span style="font-size: 12px; font-weight: bold">Date:</span>
+                <span style="font-size: 12px;">@date</span>
+            </div>
+            <div>
+                <span style="font-size: 12px; font-weight: bold">Index:</span>
+                <span style="font-size: 12px;">@index_value{0.000}</span>
+                <span style="font-size: 12px;">mill. km<sup>2</sup></span>
+            </div>
+            <div>
+                <span style="font-size: 12px; font-weight: bold">Rank:</span>
+                <span style="font-size: 12px;">@rank{custom}</span>
+            </div>
+        </div>
+        """
+
+MIN_TOOLTIPS = MAX_TOOLTIPS.replace("Yearly maximum", "Yearly minimum")
+
+# Hardcode the x-ticks (day_of_year, date).
+X_TICKS = {1: '1 Jan',
+           32: '1 Feb',
+           61: '1 Mar',
+           92: '1 Apr',
+           122: '1 May',
+           153: '1 Jun',
+           183: '1 Jul',
+           214: '1 Aug',
+           245: '1 Sep',
+           275: '1 Oct',
+           306: '1 Nov',
+           336: '1 Dec',
+           366: '31 Dec'}
+
+
+def empty_span_data():
+    return {"day_of_year": [], "minimum": [], "maximum": []}
+
+
+def empty_median_data():
+    return {"day_of_year": [], "median": []}
+
+
+def decade_color(colors_dict, decade):
+    # Use the colour of the middle year of the decade, or of the last year with a colour if the decade has not reached
+    # its middle year yet.
+    year = min(int(decade[:4]) + 4, max(int(year) for year in colors_dict))
+    return colors_dict[str(year)]
+
+
+def decadal_curves(plot, percentile_source, median_source, fill_color, line_color):
+    # Plot the decadal climatology of one decade.
+    percentile = plot.varea(x="day_of_year",
+                            y1="minimum",
+                            y2="maximum",
+                            source=percentile_source,
+                            fill_alpha=0.5,
+                            fill_color=fill_color,
+                            visible=False)
+
+    median_outline = plot.line(x="day_of_year",
+                               y="median",
+                               source=median_source,
+                               line_width=2.2,
+                               color="black",
+                               alpha=0.6,
+                               visible=False)
+
+    median = plot.line(x="day_of_year",
+                       y="median",
+                       source=median_source,
+                       line_width=2,
+                       color=line_color,
+                       alpha=0.6,
+                       visible=False)
+
+    return [percentile, median_outline, median]
+
+
+def zoom_y_range(products, doy_start, doy_end, padding_frac, y_range_start_fraction, plot_type):
+    """Return the start and end of the y-range between the minimum and maximum values of the days of year from
+    doy_start to doy_end plus a little padding. The start is lowered by the fraction y_range_start_fraction of the
+    height of the plot, to account for the height of the text label in the lower left corner."""
+    # Find the min and max values for each day of year.
+    dayofyear_min_values = products["dayofyear_min"]
+    dayofyear_max_values = products["dayofyear_max"]
+
+    # Find the lowest min and highest max values inside the x-range displayed.
+    data_min_value = dayofyear_min_values.sel(dayofyear=slice(doy_start, doy_end)).min().values
+    data_max_value = dayofyear_max_values.sel(dayofyear=slice(doy_start, doy_end)).max().values
+
+    if plot_type != 'anomaly':
+        text_label_height = y_range_start_fraction * (data_max_value - data_min_value)
+    else:
+        # We use the absolute max value since anomalies are centred on y=0.
+        data_max_value = max(abs(data_min_value), abs(data_max_value))
+        text_label_height = y_range_start_fraction * 2 * data_max_value
+
+    # Sometimes the minimum and maximum values are the same. Account for this to always have some padding.
+    if data_max_value - data_min_value < 1E-3:
+        padding = data_max_value * padding_frac
+    else:
+        padding = (data_max_value - data_min_value) * padding_frac
+
+    if plot_type != 'anomaly':
+        return data_min_value - (text_label_height + padding), data_max_value + padding
+    else:
+        return -(data_max_value + text_label_height + padding), data_max_value + padding
+
+
+class DailyFigure:
+    """The figure of the daily app with the sources, glyphs, legends, hovertools and label of a selection. The sources
+    are filled with the products, so a session only has to add its callbacks."""
+    def __init__(self, products, reference_period, plot_type, color):
+        self.products = products
+        extracted_data = products["extracted_data"]
+        da = products["da"]
+
+        # Create the reference period climatology (percentiles and median) sources.
+        self.cds_percentile_1090 = ColumnDataSource(products["percentile_1090"])
+        self.cds_percentile_2575 = ColumnDataSource(products["percentile_2575"])
+        self.cds_median = ColumnDataSource(products["median"])
+
+        # Create the sources with maximum and minumum values of the index for the entire time series except the
+        # current year.
+        self.cds_minimum = ColumnDataSource(products["minimum"])
+        self.cds_maximum = ColumnDataSource(products["maximum"])
+
+        # Create the decadal climatology (0-100 percentile and median) sources. The decadal curves are hidden by
+        # default, so the sources are empty until a decade is shown for the first time. The decades are found from the
+        # years in the data, so that a new decade is added when its first year starts.
+        decades = tk.find_decades(tk.get_list_of_years(da))
+        cds_decadal_dict = {decade: (ColumnDataSource(empty_span_data()), ColumnDataSource(empty_median_data()))
+                            for decade in decades}
+
+        # Create the sources of the individual years.
+        self.cds_individual_years = {year: ColumnDataSource(data)
+                                     for year, data in products["individual_years"].items()}
+
+        # Create the sources of the yearly min and max values.
+        data_years = tk.get_list_of_years(da)
+        colors_dict = tk.find_line_colors(data_years, color)
+        self.cds_yearly_max = ColumnDataSource(products["yearly_max"])
+        self.cds_yearly_max.data["color"] = tk.yearly_min_max_colors(products["yearly_max"], colors_dict)
+        self.cds_yearly_min = ColumnDataSource(products["yearly_min"])
+        self.cds_yearly_min.data["color"] = tk.yearly_min_max_colors(products["yearly_min"], colors_dict)
+
+        # Trim the title to not contain the version number, and to deduplicate "Sea" substrings.
+        trimmed_title = tk.trim_title(extracted_data["title"], plot_type)
+
+        # Plot the figure and make sure that it uses all available space.
+        plot = figure(title=trimmed_title, tools="pan, wheel_zoom, box_zoom, save")
+        plot.sizing_mode = "stretch_both"
+        # Add a thick horizontal line to make y=0 stand out.
+        plot.hspan(y=0, line_color='#d0d0d0', line_dash=value([10, 10]), line_width=3)
+        self.plot = plot
+
+        # Plot the reference period climatology (percentiles and median).
+        self.percentile_1090_glyph = plot.varea(x="day_of_year",
+                                                y1="percentile_10",
+                                                y2="percentile_90",
+                                                source=self.cds_percentile_1090,
+                                                fill_alpha=0.6,
+                                                fill_color="darkgray")
+
+        self.percentile_2575_glyph = plot.varea(x="day_of_year",
+                                                y1="percentile_25",
+                                                y2="percentile_75",
+                                                source=self.cds_percentile_2575,
+                                                fill_alpha=0.6,
+                                                fill_color="gray")
+
+        self.median_glyph = plot.line(x="day_of_year",
+                                      y="median",
+                                      source=self.cds_median,
+                                      line_width=2,
+                                      color="dimgray",
+                                      alpha=0.6)
+
+        # Plot the min and max lines based on the min and max values of the entire period except the current year.
+        self.min_line_glyph = plot.line(x="day_of_year",
+                                        y="minimum",
+                                        source=self.cds_minimum,
+                                        line_alpha=0.8,
+                                        color="black",
+                                        line_width=1.5,
+                                        line_dash=[4, 1])
+
+        self.max_line_glyph = plot.line(x="day_of_year",
+                                        y="maximum",
+                                        source=self.cds_maximum,
+                                        line_alpha=0.8,
+                                        color="black",
+                                        line_width=1.5,
+                                        line_dash=[4, 1])
+
+        # Plot the decadal climatology. The sources and glyphs are kept by decade.
+        self.decadal_curves_dict = {}
+        for decade, (cds_decadal_span, cds_decadal_median) in cds_decadal_dict.items():
+            curve_glyph_list = decadal_curves(plot,
+                                              cds_decadal_span,
+                                              cds_decadal_median,
+                                              decade_color(colors_dict, decade),
+                                              decade_color(colors_dict, decade))
+            self.decadal_curves_dict[decade] = (cds_decadal_span, cds_decadal_median, curve_glyph_list)
+
+        # Plot the individual years.
+        colors_dict = tk.find_line_colors(data_years[:-1], color)
+        self.individual_years_glyphs = []
+        individual_years_glyphs_legend_list = []
+        cds_individual_years_list = list(self.cds_individual_years.values())
+
+        # Plot all lines except for current year.
+        for year, cds_individual_year in zip(data_years[:-1], cds_individual_years_list[:-1]):
+            line_glyph = plot.line(x="day_of_year",
+                                   y="index_values",
+                                   source=cds_individual_year,
+                                   line_width=2,
+                                   line_color=colors_dict[year])
+            self.individual_years_glyphs.append(line_glyph)
+            individual_years_glyphs_legend_list.append((year, [line_glyph]))
+
+        # Plot the yearly max and min values as triangles and circles, respectively.
+        self.yearly_max_glyph = plot.circle(x="day_of_year",
+                                            y="index_value",
+                                            color="color",
+                                            size=6,
+                                            source=self.cds_yearly_max,
+                                            visible=False)
+
+        self.yearly_min_glyph = plot.circle(x="day_of_year",
+                                            y="index_value",
+                                            color="color",
+                                            size=6,
+                                            source=self.cds_yearly_min,
+                                            visible=False)
+
+        # Plot the current year as two lines on top of each other (black and white dashed line).
+        self.current_year_outline = plot.line(x="day_of_year",
+                                              y="index_values",
+                                              source=cds_individual_years_list[-1],
+                                              line_width=3,
+                                              line_color="black")
+
+        self.current_year_filler = plot.line(x="day_of_year",
+                                             y="index_values",
+                                             source=cds_individual_years_list[-1],
+                                             line_width=2,
+                                             line_dash=[4, 4],
+                                             line_color="white")
+
+        # Add only the current year outline to list of individual year glyphs since we only need one of the current
+        # year glyphs to display the hovertool values.
+        self.individual_years_glyphs.append(self.current_year_outline)
+
+        # Add labels and glyphs to legend list to get the desired order.
+        legend_list = [("Climatology", [self.percentile_1090_glyph, self.percentile_2575_glyph, self.median_glyph]),
+                       ("Min/Max", [self.min_line_glyph, self.max_line_glyph]),
+                       ("Yearly min/max", [self.yearly_max_glyph, self.yearly_min_glyph])]
+        legend_list.extend([(decade, curve_glyph_list)
+                            for decade, (_, _, curve_glyph_list) in self.decadal_curves_dict.items()])
+        legend_list.extend(individual_years_glyphs_legend_list)
+        legend_list.append((data_years[-1], [self.current_year_outline, self.current_year_filler]))
+
+        # To plot legends for the individual years we need to split the list of legends into several sublists. If we
+        # don't do this the list will be so long that it's out of frame. The number below is the maximum number of
+        # elements that can be inside one sublist. This number was determined with basic testing on one specific
+        # computer. This is an issue because other clients can have computers with a different screen resolution
+        # which can fit more legends. Keep this solution for now, but check if there's a better way to solve this.
+        n = 23
+        legend_split = [legend_list[i:i+n] for i in range(0, len(legend_list), n)]
+
+        for sublist in legend_split:
+            legend = Legend(items=sublist, location="top_center")
+            legend.spacing = 1
+            plot.add_layout(legend, "right")
+
+        # Make the clicking the legend hide/show the given element.
+        plot.legend.click_policy = "hide"
+
+        # Add hovertools to display the date, index value, and rank of the individual years, and of the yearly max and
+        # min values.
+        self.tooltips = TOOLTIPS
+        self.max_tooltips = MAX_TOOLTIPS
+        self.min_tooltips = MIN_TOOLTIPS
+        if plot_type == 'anomaly':
+            self.tooltips = self.tooltips.replace('0.000', '+0.000')
+            self.max_tooltips = self.max_tooltips.replace('0.000', '+0.000')
+            self.min_tooltips = self.min_tooltips.replace('0.000', '+0.000')
+
+        rank_custom = CustomJSHover(code=RANK_CUSTOM_CODE)
+
+        self.individual_years_hovertool = HoverTool(renderers=self.individual_years_glyphs,
+                                                    tooltips=self.tooltips,
+                                                    formatters={'@rank': rank_custom},
+                                                    toggleable=False)
+        plot.add_tools(self.individual_years_hovertool)
+
+        self.max_line_hovertool = HoverTool(renderers=[self.yearly_max_glyph],
+                                            tooltips=self.max_tooltips,
+                                            formatters={'@rank': rank_custom},
+                                            toggleable=False)
+        plot.add_tools(self.max_line_hovertool)
+
+        self.min_line_hovertool = HoverTool(renderers=[self.yearly_min_glyph],
+                                            tooltips=self.min_tooltips,
+                                            formatters={'@rank': rank_custom},
+                                            toggleable=False)
+        plot.add_tools(self.min_line_hovertool)
+
+        # Set the x-ticks and x-label.
+        plot.x_range = Range1d(start=1, end=366)
+        plot.xaxis.ticker = list(X_TICKS.keys())
+        plot.xaxis.major_label_overrides = X_TICKS
+        plot.xaxis.axis_label = "Date"
+
+        # Initialise the y-range, and aet y-tick properties and y-label.
+        plot.y_range = Range1d()
+        plot.yaxis.ticker = AdaptiveTicker(base=10, mantissas=[1, 2], num_minor_ticks=4, desired_num_ticks=10)
+        if plot_type == 'anomaly':
+            plot.yaxis.axis_label = f"{extracted_data['long_name']} Anomaly - {extracted_data['units']}"
+        else:
+            plot.yaxis.axis_label = f"{extracted_data['long_name']} - {extracted_data['units']}"
+
+        # Add a bottom label with information about the data that's used to make the graphic.
+        self.first_year = str(data_years[0])
+        self.second_to_last_year = str(data_years[-2])
+        self.last_date_string = str(tk.format_dates(da.time[-1]))
+
+        # Find the version of the data in order to add it to the label, and give the v3p0 data a custom label.
+        if extracted_data["ds_version"] == "v2p1":
+            self.cdr_version = "v2.1"
+        elif extracted_data["ds_version"] == "v2p2":
+            self.cdr_version = "v3"
+
+        label_text = f"Median and percentiles (25-75% and 10-90%) for {reference_period}, " \
+                     f"min/max for {self.first_year}-{self.second_to_last_year}\n" \
+                     f"Data: Derived from OSI SAF Sea Ice Concentration CDRs {self.cdr_version}\n" \
+                     "Source: EUMETSAT OSI SAF data with R&D input from ESA CCI\n" \
+                     f"Last data point: {self.last_date_string}"
+
+        if plot_type == 'anomaly':
+            label_text = f'Anomalies calculated relative to mean of {reference_period}\n' + label_text
+
+        self.info_label = Label(x=5,
+                                y=5,
+                                x_units='screen',
+                                y_units='screen',
+                                text=label_text,
+                                text_font_size='12px',
+                                text_color='black')
+
+        plot.add_layout(self.info_label)
+
+        # Calculate the height of the text label in pixels in the lower left corner. The number of lines is hardcoded to
+        # 5 in order to have a consistent value that does not depend on whether all of the lines are visible (this
+        # depends on which plot elements are selected).
+        number_of_lines = 6
+        self.label_height = float(self.info_label.text_font_size.rstrip('px')) * self.info_label.text_line_height \
+            * number_of_lines
+
+        # All sources of the figure, so that a session can release their data without searching the figure.
+        self.sources = list(plot.select(type=ColumnDataSource))
+
+
+class FigurePool:
+    """Figures that are built ahead of time in a background thread, by selection. A figure is only handed out if it was
+    built from the same products as the session uses, so figures of data that has since been updated are dropped."""
+    def __init__(self, app, build, size=FIGURE_POOL_SIZE, max_selections=FIGURE_POOL_MAX_SELECTIONS):
+        self.app = app
+        self.build = build
+        self.size = size
+        self.max_selections = max_selections
+        self._lock = threading.Lock()
+        # The prebuilt figures of the most recently requested selections, and the number of figures being built.
+        self._figures = OrderedDict()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="figures")
+
+    def take(self, selection, products, *args):
+        """Return a figure of the selection built from the products, and build a new one in the background."""
+        figure = None
+        with self._lock:
+            # Spares are only built for the selections that are requested again, so that the figures of the many
+            # selections that are only opened once are not built in vain.
+            requested_before = selection in self._figures
+            figures = self._figures.setdefault(selection, deque())
+            self._figures.move_to_end(selection)
+            while figures and figure is None:
+                candidate = figures.popleft()
+                if _same_products(candidate.products, products):
+                    figure = candidate
+
+            # Forget the figures of the selections that haven't been requested for the longest time.
+            while len(self._figures) > self.max_selections:
+                self._figures.popitem(last=False)
+
+            missing = self.size - len(figures) - self._pending.get(selection, 0) if requested_before else 0
+            if missing > 0:
+                self._pending[selection] = self._pending.get(selection, 0) + missing
+
+        metrics.count("figure_pool_requests", app=self.app)
+        for _ in range(missing):
+            self._executor.submit(self._prebuild, selection, products, *args)
+
+        if figure is None:
+            metrics.count("figure_pool_misses", app=self.app)
+            figure = self._build(products, *args)
+
+        return figure
+
+    def _build(self, products, *args):
+        with metrics.span("figure_build", app=self.app):
+            return self.build(products, *args)
+
+    def _prebuild(self, selection, products, *args):
+        try:
+            figure = self._build(products, *args)
+        except Exception:
+            logging.exception(f"Prebuilding a figure of {selection} failed")
+            figure = None
+
+        with self._lock:
+            self._pending[selection] -= 1
+            if self._pending[selection] == 0:
+                del self._pending[selection]
+            if figure is not None and selection in self._figures:
+                self._figures[selection].append(figure)
+
+    def clear(self):
+        with self._lock:
+            self._figures.clear()
+
+
+def _same_products(products, other_products):
+    # The products of a selection are shared by all sessions until the data is updated.
+    return products.keys() == other_products.keys() and all(products[key] is other_products[key] for key in products)
+
+
+daily_figures = FigurePool("daily", DailyFigure)
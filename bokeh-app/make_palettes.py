@@ -0,0 +1,38 @@
+"""Write the colour tables of the colour maps used by the apps to assets/palettes.json. The apps look up the colours in
+the tables, so that matplotlib and cmcrameri are only needed to write them, e.g. when a colour map is added to
+toolkit.SEQUENTIAL_COLOR_MAPS or toolkit.DECADAL_COLOR_MAPS:
+
+    pip install matplotlib cmcrameri
+    python bokeh-app/make_palettes.py
+"""
+import json
+
+import cmcrameri.cm
+import matplotlib
+import matplotlib.colors
+import numpy as np
+
+import toolkit as tk
+
+
+def colormap(name):
+    # The cmcrameri colour maps, e.g. batlow, are registered with a prefix in matplotlib.
+    return cmcrameri.cm.cmaps[name] if name in cmcrameri.cm.cmaps else matplotlib.colormaps[name]
+
+
+def make_palettes():
+    """Return the N colours of each colour map as hex strings."""
+    names = [*tk.SEQUENTIAL_COLOR_MAPS, *dict.fromkeys(tk.DECADAL_COLOR_MAPS.values())]
+    palettes = {}
+    for name in names:
+        cmap = colormap(name)
+        # Integer values index the colour table of the colour map directly.
+        palettes[name] = [matplotlib.colors.to_hex(color) for color in cmap(np.arange(cmap.N))]
+
+    return palettes
+
+
+if __name__ == "__main__":
+    with open(tk.PALETTES_PATH, "w") as f:
+        json.dump(make_palettes(), f, indent=1)
+        f.write("\n")
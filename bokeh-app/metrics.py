@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+import contextvars
+import functools
+import threading
+import time
+
+# The upper bounds in seconds of the histogram buckets of the stage durations.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+# Labels that are added to all the metrics recorded in the current context, e.g. the app, area and index of the
+# products that are being calculated.
+_context_labels = contextvars.ContextVar("context_labels", default={})
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+
+
+def _key(labels):
+    return tuple(sorted((name, str(value)) for name, value in {**_context_labels.get(), **labels}.items()))
+
+
+@contextmanager
+def labels(**new_labels):
+    """Add labels to all metrics recorded inside the with block."""
+    token = _context_labels.set({**_context_labels.get(), **new_labels})
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+
+def observe(stage, seconds, **labels):
+    """Record the duration of a stage in the histogram of the stage."""
+    key = _key({"stage": stage, **labels})
+    with _lock:
+        bucket_counts, total, count = _histograms.get(key, ([0] * len(BUCKETS), 0.0, 0))
+        for i, upper_bound in enumerate(BUCKETS):
+            if seconds <= upper_bound:
+                bucket_counts[i] += 1
+        _histograms[key] = (bucket_counts, total + seconds, count + 1)
+
+
+@contextmanager
+def span(stage, **labels):
+    """Time the code inside the with block."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+
+def timed(func=None, *, labels=None):
+    """Decorator that times each call of a function, using the function name as the stage. The labels can be given as
+    a function that is called to find the labels at the time of the call, e.g. the selected area of a session."""
+    if func is None:
+        return functools.partial(timed, labels=labels)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with span(func.__name__, **(labels() if labels else {})):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def count(name, **labels):
+    """Increase a counter by one."""
+    key = (name, _key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + 1
+
+
+def _format_labels(key, extra=()):
+    def escape(value):
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in key + extra) + "}"
+
+
+def render():
+    """Render all metrics in the Prometheus text format."""
+    # The bucket counts are updated in place by observe, so they are copied too, to render a consistent snapshot.
+    with _lock:
+        histograms = {key: (list(bucket_counts), total, count)
+                      for key, (bucket_counts, total, count) in _histograms.items()}
+        counters = dict(_counters)
+
+    lines = ["# HELP sea_ice_stage_duration_seconds Time spent in each stage of the apps.",
+             "# TYPE sea_ice_stage_duration_seconds histogram"]
+    for key, (bucket_counts, total, count) in sorted(histograms.items()):
+        for upper_bound, bucket_count in zip(BUCKETS, bucket_counts):
+            le = "+Inf" if upper_bound == float("inf") else str(upper_bound)
+            lines.append(f"sea_ice_stage_duration_seconds_bucket{_format_labels(key, (('le', le),))} {bucket_count}")
+        lines.append(f"sea_ice_stage_duration_seconds_sum{_format_labels(key)} {total}")
+        lines.append(f"sea_ice_stage_duration_seconds_count{_format_labels(key)} {count}")
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE sea_ice_{name}_total counter")
+        for (counter_name, key), value in sorted(counters.items()):
+            if counter_name == name:
+                lines.append(f"sea_ice_{name}_total{_format_labels(key)} {value}")
+
+    return "\n".join(lines) + "\n"
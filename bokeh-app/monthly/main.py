@@ -1,12 +1,22 @@
 import panel as pn
+from panel.io.notifications import NotificationArea
 from bokeh.plotting import figure
-from bokeh.models import HoverTool, Paragraph, Legend, Label, CustomJSHover
+from bokeh.models import HoverTool, Paragraph, Legend, Label, CustomJSHover, ColumnDataSource
 import logging
 import param
 import calendar
 from datetime import datetime
+import time
 import os
 import toolkit as tk
+import products as pr
+import metrics
+import profiling
+import sessions
+
+# Start timing (and possibly profiling) the creation of the session.
+session_start = time.perf_counter()
+session_profiler = profiling.start()
 
 # Get the root directory of the app.
 app_root = os.getenv('APP_ROOT')
@@ -18,12 +28,15 @@ pn.extension(loading_spinner='dots', loading_color='#696969')
 def exception_handler(ex):
     # Function used to handle exceptions by showing an error message to the user.
     logging.error("Error", exc_info=ex)
-    pn.state.notifications.error(f'{ex}')
+    notifications.error(f'{ex}')
 
 
-# Handle exceptions.
+# Handle exceptions. The notification area is added to the page by the app instead of by Panel, since Panel doesn't
+# remove its own one from its registry of views when the session is destroyed, which keeps the document in memory.
 pn.extension('notifications')
-pn.extension(exception_handler=exception_handler, notifications=True)
+pn.extension(exception_handler=exception_handler, notifications=False)
+notifications = NotificationArea()
+notifications.servable()
 
 
 # Add a parameter for setting the desired version of the sea ice data, and sync to url parameter.
@@ -74,11 +87,15 @@ area_selector = pn.widgets.Select(name="Area:",
                                   sizing_mode="stretch_width")
 pn.state.location.sync(area_selector, {"value": "area"})
 
-# Add a dropdown menu for selecting the reference period of the percentile and median plots, and sync to url parameter.
-reference_period_selector = pn.widgets.Select(name="Reference period of percentiles and median:",
-                                              options=["1981-2010", "1991-2020"],
-                                              value="1981-2010",
-                                              sizing_mode="stretch_width")
+# Add an input for the reference period of the percentile and median plots, and sync to url parameter. Any period can be
+# given as the first and last year, and the standard periods are suggested.
+reference_period_selector = pn.widgets.AutocompleteInput(name="Reference period of percentiles and median:",
+                                                         options=pr.REFERENCE_PERIODS,
+                                                         value="1981-2010",
+                                                         restrict=False,
+                                                         min_characters=0,
+                                                         placeholder="First and last year, e.g. 1981-2010",
+                                                         sizing_mode="stretch_width")
 pn.state.location.sync(reference_period_selector, {"value": "ref_period"})
 
 # Add a dropdown menu for selecting the color map for plotting the individual months.
@@ -110,17 +127,29 @@ trend_selector = pn.widgets.Select(name="Trend line:",
                                    sizing_mode="stretch_width")
 pn.state.location.sync(trend_selector, {"value": "trend"})
 
-@pn.cache(max_items=4)
-def get_data(index_selector, area_selector, VersionUrlParameter):
-    extracted_data = tk.download_and_extract_data(index_selector,
-                                                  area_selector,
-                                                  "monthly",
-                                                  VersionUrlParameter)
-    return extracted_data
+
+def metric_labels():
+    # Labels of the timing metrics of this session.
+    return {"app": "monthly", "area": area_selector.value, "index": index_selector.value}
+
+
+def profile_labels():
+    # The selection of this session, used to tag the profiles.
+    return {**metric_labels(),
+            "reference_period": reference_period_selector.value,
+            "colour": color_scale_selector.value,
+            "trend": trend_selector.value}
+
 
 try:
-    extracted_data = get_data(index_selector.value, area_selector.value, VersionUrlParameter.value)
-    da = extracted_data["da"]
+    # Get the derived products from the cache that is shared by all sessions.
+    products = pr.get_monthly_products(index_selector.value,
+                                       area_selector.value,
+                                       VersionUrlParameter.value,
+                                       reference_period_selector.value,
+                                       False)
+    extracted_data = products["extracted_data"]
+    da = products["da"]
 
     # Trim the title to not contain a "Mean" substring, the version number, and to deduplicate "Sea" substrings.
     trimmed_title = tk.trim_title(extracted_data["title"], None)
@@ -130,21 +159,35 @@ try:
 
     legend_collection = []
 
-    cds_all_months = tk.calculate_all_months(da)
+    cds_all_months = ColumnDataSource(products["all_months"])
     all_months_glyph = plot.line(x="x", y="index_values", source=cds_all_months, line_width=1.5, line_color="grey")
     all_months_glyph.visible = False
     legend_collection.append(("Monthly", [all_months_glyph]))
 
     colors_dict = tk.find_line_colors(calendar.month_name[1:], "viridis")
-    cds_monthly_dict = tk.calculate_monthly(da, month_offset=False)
-    reference_period_start = reference_period_selector.value[0:4]
-    reference_period_end = reference_period_selector.value[5:9]
-    trends = tk.Trends(da, reference_period_start, reference_period_end, False)
-    cds_monthly_trend_dict = trends.calculate_monthly_trend()
-    cds_decadal_trend_dict = trends.calculate_decadal_trend(edge_padding=0.1)
-
     current_month = datetime.now().strftime("%B")
 
+    # Only the current month is shown by default, so the sources of the other months and of the decadal trends are
+    # empty until they are shown for the first time.
+    def empty_data(columns):
+        return {column: [] for column in columns}
+
+    decadal_trend_columns = ["year",
+                             "trend_line_values",
+                             "month",
+                             "decade",
+                             "absolute_trend",
+                             "relative_trend",
+                             "reference_period"]
+
+    cds_monthly_dict = {month: ColumnDataSource(data if month == current_month else empty_data(data))
+                        for month, data in products["monthly"].items()}
+    cds_monthly_trend_dict = {month: ColumnDataSource(data if month == current_month else empty_data(data))
+                              for month, data in products["monthly_trend"].items()}
+    cds_decadal_trend_dict = {month: {decade: ColumnDataSource(empty_data(decadal_trend_columns))
+                                      for decade in products["decades"]}
+                              for month in products["monthly"]}
+
     line_glyphs = []
     circle_glyphs = []
     trend_line_glyphs = []
@@ -204,6 +247,55 @@ try:
             for one_decade_glyph in decade_trend_glyphs_one_month:
                 one_decade_glyph.visible = False
 
+    # The months whose values and full trends, and whose decadal trends, have been loaded into the sources.
+    loaded_months = {current_month}
+    loaded_decadal_months = set()
+
+    def load_month(month):
+        # Load the monthly values and the full trend of a month from the products of the session.
+        cds_monthly_dict[month].data.update(products["monthly"][month])
+        cds_monthly_trend_dict[month].data.update(products["monthly_trend"][month])
+        loaded_months.add(month)
+
+    def load_decadal_trends(month):
+        # Get the decadal trends of the month from the cache that is shared by all sessions, and only calculate them
+        # if no other session has shown them before.
+        decadal_trend_products = pr.get_decadal_trend_products(index_selector.value,
+                                                               area_selector.value,
+                                                               VersionUrlParameter.value,
+                                                               reference_period_selector.value,
+                                                               all_months_glyph.visible,
+                                                               month)
+        for decade, decadal_cds_unpacked in cds_decadal_trend_dict[month].items():
+            decadal_cds_unpacked.data.update(decadal_trend_products[decade])
+        loaded_decadal_months.add(month)
+
+    def show_month_callback(month):
+        # Load the values of the month when they are shown by clicking the legend.
+        def callback(attr, old, new):
+            if new and month not in loaded_months:
+                load_month(month)
+
+        return callback
+
+    def show_decadal_trends_callback(month):
+        # Load the decadal trends of the month when they are shown by clicking the legend or selecting decadal trends.
+        def callback(attr, old, new):
+            if new and month not in loaded_decadal_months:
+                load_decadal_trends(month)
+
+        return callback
+
+    for month, line_glyph, decade_trend_glyphs_one_month in zip(cds_monthly_dict,
+                                                                 line_glyphs,
+                                                                 decade_trend_line_glyphs):
+        line_glyph.on_change("visible", show_month_callback(month))
+        if decade_trend_glyphs_one_month:
+            decade_trend_glyphs_one_month[0].on_change("visible", show_decadal_trends_callback(month))
+            # The decadal trends of the current month are shown from the start if they are selected in the URL.
+            if decade_trend_glyphs_one_month[0].visible:
+                load_decadal_trends(month)
+
     legend = Legend(items=legend_collection, location="top_center")
     legend.spacing = 1
     plot.add_layout(legend, "right")
@@ -305,7 +397,7 @@ try:
         version_label = "v2.2"
         cdr_version = "v3"
 
-    last_month_string = str(da.time[-1].dt.strftime('%Y-%m').values)
+    last_month_string = str(tk.format_dates(da.time[-1], '%Y-%m'))
 
     label_text = f"Data: Derived from OSI SAF Sea Ice Concentration CDRs {cdr_version}\n" \
                  "Source: EUMETSAT OSI SAF data with R&D input from ESA CCI\n" \
@@ -343,47 +435,55 @@ try:
     pn.state.onload(on_load)
 
 
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_data(event):
         with pn.param.set_values(gspec, loading=True):
             # Try fetching new data because it might not be available.
             try:
-                # Update plot with new values from selectors.
-                index = index_selector.value
-                area = area_selector.value
-                version = VersionUrlParameter.value
-
-                # Download and extract new data.
-                extracted_data = tk.download_and_extract_data(index, area, "monthly", version)
-                da = extracted_data["da"]
-
-                new_cds_line_all_data = tk.calculate_all_months(da)
-                cds_all_months.data.update(new_cds_line_all_data.data)
-
                 if all_months_glyph.visible:
                     month_offset = True
                 else:
                     month_offset = False
 
-                new_cds_monthly_dict = tk.calculate_monthly(da, month_offset)
-                reference_period_start = reference_period_selector.value[0:4]
-                reference_period_end = reference_period_selector.value[5:9]
-                trends = tk.Trends(da, reference_period_start, reference_period_end, month_offset)
-                new_cds_monthly_trend_dict = trends.calculate_monthly_trend()
-                new_cds_decadal_trend_dict = trends.calculate_decadal_trend(edge_padding=0.1)
-
-                for month, new_cds_month in new_cds_monthly_dict.items():
-                    cds_monthly_dict[month].data.update(new_cds_month.data)
-                    cds_monthly_trend_dict[month].data.update(new_cds_monthly_trend_dict[month].data)
-                    for decadal_cds_unpacked, new_decadal_cds_unpacked in zip(cds_decadal_trend_dict[month].values(),
-                                                                              new_cds_decadal_trend_dict[month].values()):
-                        decadal_cds_unpacked.data.update(new_decadal_cds_unpacked.data)
+                # Update plot with new values from selectors. The derived products are fetched from the cache that
+                # is shared by all sessions, and only calculated if no other session has requested them before.
+                global products
+                products = pr.get_monthly_products(index_selector.value,
+                                                   area_selector.value,
+                                                   VersionUrlParameter.value,
+                                                   reference_period_selector.value,
+                                                   month_offset)
+                extracted_data = products["extracted_data"]
+                da = products["da"]
+
+                cds_all_months.data.update(products["all_months"])
+
+                # Update the sources of the visible months and decadal trends. The others are emptied, and loaded
+                # again when they are shown.
+                loaded_months.clear()
+                loaded_decadal_months.clear()
+                for month, line_glyph, decade_trend_glyphs_one_month in zip(cds_monthly_dict,
+                                                                             line_glyphs,
+                                                                             decade_trend_line_glyphs):
+                    if line_glyph.visible:
+                        load_month(month)
+                    else:
+                        cds_monthly_dict[month].data = empty_data(products["monthly"][month])
+                        cds_monthly_trend_dict[month].data = empty_data(products["monthly_trend"][month])
+
+                    if decade_trend_glyphs_one_month and decade_trend_glyphs_one_month[0].visible:
+                        load_decadal_trends(month)
+                    else:
+                        for decadal_cds_unpacked in cds_decadal_trend_dict[month].values():
+                            decadal_cds_unpacked.data = empty_data(decadal_trend_columns)
 
                 # Update the plot title and x-axis label.
                 trimmed_title = tk.trim_title(extracted_data["title"], None)
                 plot.title.text = trimmed_title
                 plot.yaxis.axis_label = f"{extracted_data['long_name']} - {extracted_data['units']}"
 
-                last_month_string = str(da.time[-1].dt.strftime('%Y-%m').values)
+                last_month_string = str(tk.format_dates(da.time[-1], '%Y-%m'))
                 label_text = f"Data: Derived from OSI SAF Sea Ice Concentration CDRs {cdr_version}\n" \
                              "Source: EUMETSAT OSI SAF data with R&D input from ESA CCI\n" \
                              f"Last data point: {last_month_string}"
@@ -394,6 +494,8 @@ try:
                 raise ValueError("Data currently unavailable. Please try again later.")
 
 
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_color_map(event):
         with pn.param.set_values(gspec, loading=True):
             colors_dict = tk.find_line_colors(calendar.month_name[1:], color_scale_selector.value)
@@ -410,6 +512,8 @@ try:
                     decade_trend_glyph.glyph.line_color = color
 
 
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
     def update_legend(event):
         with pn.param.set_values(gspec, loading=True):
             legend_collection = [("Monthly", [all_months_glyph])]
@@ -454,8 +558,33 @@ try:
 
     gspec.servable()
 
+    def release_session(session_context, sources=plot.select(type=ColumnDataSource)):
+        # Drop the references of the session to the data when it's closed, so that the memory is freed even if
+        # something still refers to the callbacks or models of the session. Bokeh may clear the module of the session
+        # before this runs, so the sources are bound when the function is defined.
+        global products, extracted_data, da
+        for source in sources:
+            source.data = {}
+        products = extracted_data = da = None
+
+    # Register the session for the memory accounting, and release its data when it's closed.
+    sessions.register("monthly", profile_labels, lambda: products)
+    pn.state.on_session_destroyed(release_session)
+
+    metrics.observe("session_build", time.perf_counter() - session_start, **metric_labels())
+
 except OSError:
     # If the datafile is unavailable when the script starts display the message below instead of running the script.
-    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.", style={"font-size": "30px"})
+    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.",
+                     styles={"font-size": "30px"})
 
     bokeh_pane = pn.pane.Bokeh(text).servable()
+
+except ValueError as ex:
+    # If the selection in the url is not valid, e.g. a reference period without data, display the reason instead.
+    text = Paragraph(text=str(ex), styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+finally:
+    profiling.stop(session_profiler, "session_build", **profile_labels())
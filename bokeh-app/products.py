@@ -0,0 +1,1005 @@
+import numpy as np
+import xarray as xr
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from collections import OrderedDict, namedtuple
+import multiprocessing
+import itertools
+import calendar
+import functools
+import hashlib
+import logging
+import pickle
+import re
+import struct
+import fcntl
+import glob
+import mmap
+import tempfile
+import os
+import threading
+import time
+import toolkit as tk
+import metrics
+
+# All the datasets that are served by the apps. These are used to warm up the cache when the server starts.
+VERSIONS = ["v2p2"]
+INDICES = ["sie", "sia"]
+AREAS = ["glb", "nh", "sh",
+         "bar", "beau", "chuk", "ess", "fram", "kara", "lap", "sval",
+         "bell", "drml", "indi", "ross", "trol", "wedd", "wpac"]
+# Any reference period can be selected, but only the standard periods are suggested in the apps and warmed up.
+REFERENCE_PERIODS = ["1981-2010", "1991-2020"]
+PLOT_TYPES = ["absolute", "anomaly"]
+
+# The number of seconds before the data is opened again to check for new data.
+DATA_TTL = int(os.getenv("DATA_TTL", 3600))
+
+# Store the derived products in float32 instead of float64 when COMPACT_PRODUCTS is 1, to reduce the memory use of the
+# caches and the size of the data sent to the browsers. See _compact_column.
+COMPACT_PRODUCTS = bool(int(os.getenv("COMPACT_PRODUCTS", 0)))
+
+# The number of decimals of the columns that are shown in the hovertools, e.g. @index_values{0.000}.
+DISPLAYED_DECIMALS = {"index_values": 3,
+                      "index_value": 3,
+                      "absolute_trend": 1,
+                      "relative_trend": 1,
+                      "anomaly": 3,
+                      "percentile": 0,
+                      "record_low": 3,
+                      "record_high": 3}
+
+# The number of cached products per app. Leave room for products of older data that have not been evicted yet.
+PRODUCTS_MAX_ITEMS = 2 * len(VERSIONS) * len(INDICES) * len(AREAS) * len(REFERENCE_PERIODS) * 2
+
+# Set when the warmup has finished, so that a load balancer can wait with routing traffic to the server until the
+# cache is warm.
+warmup_ready = threading.Event()
+
+# The pool of worker processes used for calculating the derived products when COMPUTE_PROCESSES is larger than 0.
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+# The number of worker processes that fetch the datasets when FETCH_PROCESSES is larger than 0, so that several
+# datasets are downloaded at the same time. By default the datasets are fetched in this process, one at a time, see
+# tk.download_and_extract_data.
+FETCH_PROCESSES = int(os.getenv("FETCH_PROCESSES", 0))
+_fetch_pool = None
+
+# The threads that fetch the datasets and calculate the products of the summary that are not in the memory cache, which
+# are shared by all sessions.
+_summary_pool = None
+
+# Location of a numeric array inside the shared memory block that is used to return products from a worker process.
+SharedArray = namedtuple("SharedArray", ["offset", "dtype", "shape"])
+
+# The memory caches of the datasets and products in this process by the name of the cached function, see _cached.
+_caches = {}
+
+
+def _cached(max_items=None, ttl=None):
+    """Cache the results of a function in memory by its arguments. The least recently used entries are removed when
+    there are more than max_items entries, and an entry is calculated again when it's older than ttl seconds. The
+    cache is registered in _caches, so that its entries can be listed by cache_entries.
+
+    Only one thread calculates an entry at a time. The other threads that ask for the same arguments in the meantime,
+    e.g. a session while the warmup is calculating the entry, wait for its result instead of calculating it again."""
+    def decorator(func):
+        entries = OrderedDict()
+        # The futures of the entries that are being calculated.
+        in_flight = {}
+        lock = threading.Lock()
+
+        def lookup(args):
+            # The entry of the arguments if it's cached and has not expired, otherwise None. Must hold the lock.
+            entry = entries.get(args)
+            now = time.monotonic()
+            if entry is None or (ttl is not None and now - entry["created"] >= ttl):
+                return None
+
+            entries.move_to_end(args)
+            entry["hits"] += 1
+            entry["last_used"] = now
+            return entry
+
+        @functools.wraps(func)
+        def wrapper(*args):
+            with lock:
+                entry = lookup(args)
+                if entry is not None:
+                    return entry["value"]
+
+                future = in_flight.get(args)
+                calculate = future is None
+                if calculate:
+                    future = in_flight[args] = Future()
+
+            # The result, or the exception, of the thread that calculates the entry is shared by the waiting threads.
+            # Failures are not cached, so the next call tries again.
+            if not calculate:
+                return future.result()
+
+            try:
+                value = func(*args)
+            except BaseException as ex:
+                with lock:
+                    del in_flight[args]
+                future.set_exception(ex)
+                raise
+
+            with lock:
+                now = time.monotonic()
+                entries[args] = {"value": value, "created": now, "hits": 0, "last_used": now}
+                entries.move_to_end(args)
+                while max_items is not None and len(entries) > max_items:
+                    entries.popitem(last=False)
+                del in_flight[args]
+            future.set_result(value)
+
+            return value
+
+        def cached_value(*args):
+            # The cached result of the arguments, or None if it would have to be calculated.
+            with lock:
+                entry = lookup(args)
+                return None if entry is None else entry["value"]
+
+        def clear():
+            with lock:
+                entries.clear()
+
+        def list_entries():
+            with lock:
+                return [dict(entry) for entry in entries.values()]
+
+        wrapper.cached_value = cached_value
+        wrapper.clear = clear
+        wrapper.entries = list_entries
+        _caches[func.__name__] = wrapper
+
+        return wrapper
+
+    return decorator
+
+
+def _data(cds):
+    # The products are shared by all sessions, and a Bokeh model can only belong to one document. Store the data of
+    # the ColumnDataSources instead, and let each session create its own ColumnDataSources from it.
+    if COMPACT_PRODUCTS:
+        return {column: _compact_column(column, values) for column, values in cds.data.items()}
+
+    return dict(cds.data)
+
+
+def _round_displayed(values, decimals):
+    # Round half up like Math.round in BokehJS, which is used when the values are formatted in the hovertools, so
+    # that the rounded values are shown the same as the original values.
+    scaled = values * 10**decimals
+    rounded = np.floor(scaled)
+    rounded += (scaled - rounded) >= 0.5
+    return rounded / 10**decimals
+
+
+def _compact_column(column, values):
+    """Return a column of the products in a compact data type. The floats are stored in float32, which is exact for
+    the ranks since they are integers or halves, and the columns that are shown in the hovertools are first rounded to
+    the shown decimals, so they are shown the same as the float64 values. The integers are stored in int16 if they
+    fit, and the strings in a numpy string array, which is memory-mapped from the on-disk cache like the numbers."""
+    if not isinstance(values, np.ndarray):
+        return values
+
+    if values.dtype.kind == "f":
+        if column in DISPLAYED_DECIMALS:
+            values = _round_displayed(values, DISPLAYED_DECIMALS[column])
+        return values.astype(np.float32)
+
+    if values.dtype.kind == "i":
+        limits = np.iinfo(np.int16)
+        if values.size == 0 or (limits.min <= values.min() and values.max() <= limits.max):
+            return values.astype(np.int16)
+    elif values.dtype == object and all(isinstance(value, str) for value in values):
+        return values.astype(str)
+
+    return values
+
+
+def _compact_series(da):
+    # The series that other products are calculated from are kept in float64, so that only the series that are just
+    # plotted are stored in float32.
+    return da.astype(np.float32) if COMPACT_PRODUCTS else da
+
+
+def _freeze(obj):
+    """Make the arrays of the products read-only. All sessions create their ColumnDataSources from views of the same
+    arrays, so no session must be able to modify them."""
+    if isinstance(obj, dict):
+        for value in obj.values():
+            _freeze(value)
+    elif isinstance(obj, np.ndarray):
+        obj.flags.writeable = False
+    elif isinstance(obj, xr.DataArray):
+        obj.values.flags.writeable = False
+    elif isinstance(obj, tk.DayOfYearIndex):
+        _freeze(vars(obj))
+
+    return obj
+
+
+def _pack(products):
+    """Move the numeric arrays of the products into one shared memory block, so they don't need to be pickled."""
+    arrays = []
+
+    def replace_arrays(obj, offset):
+        if isinstance(obj, dict):
+            packed = {}
+            for key, value in obj.items():
+                packed[key], offset = replace_arrays(value, offset)
+            return packed, offset
+
+        if isinstance(obj, np.ndarray) and obj.dtype.kind in "biuf":
+            arrays.append((offset, obj))
+            # Keep the arrays aligned to 8 bytes.
+            return SharedArray(offset, obj.dtype.str, obj.shape), offset + -(-obj.nbytes // 8) * 8
+
+        return obj, offset
+
+    structure, size = replace_arrays(products, 0)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        for offset, array in arrays:
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf, offset=offset)[...] = array
+    except BaseException:
+        # The block is otherwise only released by _unpack, so it must not be left behind if it can't be written.
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+
+    return shm.name, structure
+
+
+def _unpack(packed):
+    """Copy the numeric arrays of the products out of the shared memory block, and release the block."""
+    name, structure = packed
+    shm = shared_memory.SharedMemory(name=name)
+
+    def restore_arrays(obj):
+        if isinstance(obj, dict):
+            return {key: restore_arrays(value) for key, value in obj.items()}
+
+        if isinstance(obj, SharedArray):
+            return np.ndarray(obj.shape, dtype=obj.dtype, buffer=shm.buf, offset=obj.offset).copy()
+
+        return obj
+
+    try:
+        return restore_arrays(structure)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _run_packed(func, *args):
+    # Runs in the worker process.
+    return _pack(func(*args))
+
+
+def _get_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Use spawn instead of fork, since forking a process that runs the server threads is not safe.
+            _process_pool = ProcessPoolExecutor(max_workers=int(os.getenv("COMPUTE_PROCESSES")),
+                                                mp_context=multiprocessing.get_context("spawn"))
+
+    return _process_pool
+
+
+def _get_fetch_pool():
+    global _fetch_pool
+    with _process_pool_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ProcessPoolExecutor(max_workers=FETCH_PROCESSES,
+                                              mp_context=multiprocessing.get_context("spawn"))
+
+    return _fetch_pool
+
+
+def _get_summary_pool():
+    global _summary_pool
+    with _process_pool_lock:
+        if _summary_pool is None:
+            _summary_pool = ThreadPoolExecutor(max_workers=len(AREAS), thread_name_prefix="summary")
+
+    return _summary_pool
+
+
+def _compute(func, *args):
+    """Run a calculation of derived products in a worker process if COMPUTE_PROCESSES is set, otherwise run it in
+    this process."""
+    if int(os.getenv("COMPUTE_PROCESSES", 0)) > 0:
+        return _unpack(_get_process_pool().submit(_run_packed, func, *args).result())
+
+    return func(*args)
+
+
+def _write_entry(path, products):
+    """Write the products to the on-disk cache. The numeric arrays are written out-of-band, aligned, before the pickled
+    products, so that they can be memory-mapped when the entry is read. The file is written to a temporary file and
+    then renamed, so that other processes never see a partially written entry. The temporary file is named after the
+    entry, so that it can be removed by _remove_stale_entries if the process crashes while writing it."""
+    buffers = []
+    payload = pickle.dumps(products, protocol=5, buffer_callback=buffers.append)
+
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path),
+                                     prefix=f"{os.path.basename(path)}.",
+                                     suffix=".tmp",
+                                     delete=False) as f:
+        try:
+            layout = []
+            for buffer in buffers:
+                raw = buffer.raw()
+                f.write(b"\0" * (-f.tell() % 64))
+                layout.append((f.tell(), raw.nbytes))
+                f.write(raw)
+
+            payload_offset = f.tell()
+            f.write(payload)
+
+            # The layout is written at the end of the file, followed by its length.
+            footer = pickle.dumps({"payload": (payload_offset, len(payload)), "buffers": layout})
+            f.write(footer)
+            f.write(struct.pack("<Q", len(footer)))
+
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            # E.g. the disk is full.
+            os.remove(f.name)
+            raise
+
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+def _read_entry(path):
+    """Read products from the on-disk cache. The numeric arrays are read-only views of the memory-mapped file, so the
+    pages are shared by all processes that read the same entry. Returns None if the entry is missing, or can't be
+    read, e.g. if the file was truncated, so that it's calculated and written again."""
+    try:
+        with open(path, "rb") as f:
+            mapped_file = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # The file is empty.
+        logging.warning(f"Product cache entry {path} is empty, calculating it again")
+        return None
+
+    try:
+        view = memoryview(mapped_file)
+        footer_length, = struct.unpack("<Q", view[-8:])
+        footer = pickle.loads(view[-8 - footer_length:-8])
+
+        payload_offset, payload_length = footer["payload"]
+        buffers = [view[offset:offset + length] for offset, length in footer["buffers"]]
+
+        return pickle.loads(view[payload_offset:payload_offset + payload_length], buffers=buffers)
+    except Exception as ex:
+        # Any part of a damaged file can be garbage, so any error means that the entry can't be read.
+        logging.warning(f"Product cache entry {path} can't be read, calculating it again: {ex!r}")
+        return None
+
+
+def _load_or_compute(name, stamp, func, *args, persist=True):
+    """Get products from the on-disk cache in PRODUCT_CACHE_DIR, and calculate and store them if they are missing. If
+    PRODUCT_CACHE_DIR is not set, or persist is false, the products are always calculated."""
+    # The products of the reference periods that users enter are not stored, since any period can be entered and
+    # each one would add an entry that is rarely used again. They are only kept in the memory cache of the process.
+    cache_dir = os.getenv("PRODUCT_CACHE_DIR")
+    if not cache_dir or not persist:
+        with metrics.span("compute"):
+            return _compute(func, *args)
+
+    # The products of compact mode are stored separately, so that servers with and without compact mode can share the
+    # cache directory without removing each other's entries.
+    if COMPACT_PRODUCTS:
+        name = f"compact_{name}"
+
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{name}_{hashlib.sha256(stamp.encode()).hexdigest()[:16]}.products")
+
+    # Lock the selection while checking and reading the cache, so that only one process calculates the products, the
+    # others wait for them to be written, and no process removes the entry while another one is reading it.
+    with open(os.path.join(cache_dir, f"{name}.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+        metrics.count("disk_cache_requests")
+        with metrics.span("disk_cache_read"):
+            products = _read_entry(path)
+
+        if products is None:
+            metrics.count("disk_cache_misses")
+            with metrics.span("compute"):
+                products = _compute(func, *args)
+            with metrics.span("disk_cache_write"):
+                _write_entry(path, products)
+            with metrics.span("disk_cache_read"):
+                products = _read_entry(path)
+
+            _remove_stale_entries(cache_dir, name, path)
+        else:
+            # Mark the entry as used, so that other processes don't remove it as stale.
+            os.utime(path)
+
+    return products
+
+
+def _remove_stale_entries(cache_dir, name, path):
+    # Remove the entries of the selection that were calculated from other data and have not been used for
+    # PRODUCT_CACHE_MAX_AGE seconds. The processes check for new data at different times, so a process may still use
+    # the entry of the previous data for up to DATA_TTL seconds after another process has calculated the new one.
+    max_age = int(os.getenv("PRODUCT_CACHE_MAX_AGE", 2 * DATA_TTL))
+    now = time.time()
+    for old_path in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}_*.products")):
+        try:
+            if old_path != path and now - os.path.getmtime(old_path) > max_age:
+                os.remove(old_path)
+        except FileNotFoundError:
+            pass
+
+    # The temporary files of the selection were left by processes that crashed while writing an entry, since the lock
+    # of the selection is held, so no other process is writing one.
+    for temp_path in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(name)}_*.products.*.tmp")):
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+
+
+def dataset_stamp(extracted_data):
+    """Return a stamp of the dataset, which changes when there is a new version of the dataset or new data has been
+    added. The derived products only change when the stamp changes."""
+    last_timestamp = str(extracted_data["da"].time[-1].values)
+
+    return f"{extracted_data['ds_version']}_{last_timestamp}"
+
+
+@_cached(ttl=DATA_TTL)
+def get_data(index, area, frequency, version):
+    metrics.count("data_cache_misses", app=frequency, area=area, index=index)
+    with metrics.labels(app=frequency, area=area, index=index), metrics.span("fetch"):
+        # The netCDF library can only be used by one thread of a process at a time, so if FETCH_PROCESSES is set the
+        # datasets are fetched in the worker processes, where the downloads of several threads run at the same time.
+        if FETCH_PROCESSES > 0:
+            return _get_fetch_pool().submit(tk.download_and_extract_data, index, area, frequency, version).result()
+
+        return tk.download_and_extract_data(index, area, frequency, version)
+
+
+def calculate_daily_products(da):
+    """Calculate the derived products of the absolute values that are plotted in the daily app. They don't depend on
+    the reference period, see calculate_anomaly_products and calculate_reference_products for the ones that do."""
+    # Find the mapping from the time axis to an all_leap calendar once, convert the calendar with it, and interpolate
+    # the missing February 29th values.
+    day_of_year_index = tk.DayOfYearIndex(da.time.values)
+    da_leap, da_converted = tk.convert_and_interpolate_calendar(da, day_of_year_index)
+
+    return {"da": da,
+            "da_leap": da_leap,
+            "day_of_year_index": day_of_year_index,
+            **_calculate_derived_products(da_leap, da_converted, da_converted)}
+
+
+def calculate_anomaly_products(da_leap, da_converted, mean, day_of_year_index):
+    """Calculate the derived products of the anomalies in the daily app from the absolute values in an all_leap
+    calendar and the mean of each day of year of the reference period."""
+    da_leap_anomaly, da_converted_anomaly = tk.calculate_anomalies(da_leap, da_converted, mean, day_of_year_index)
+
+    products = _calculate_derived_products(da_leap_anomaly, da_converted_anomaly, da_converted)
+
+    # The anomalies are only plotted, and used for the decadal climatology, so they can be stored in compact mode.
+    return {**products,
+            "da": _compact_series(da_leap_anomaly),
+            "da_converted": _compact_series(products["da_converted"]),
+            "day_of_year_index": day_of_year_index}
+
+
+def _calculate_derived_products(da_leap, da_converted, da_converted_absolute):
+    # Calculate the maximum and minumum values of the index for the entire time series except the current year.
+    min_max_dict = tk.calculate_min_max(da_converted)
+
+    # Calculate the index for the individual years.
+    cds_individual_years = tk.calculate_individual_years(da_leap, da_converted)
+
+    # Calculate the yearly min and max values. The colors are added by each session since they depend on the
+    # selected color map.
+    cds_yearly_max, cds_yearly_min = tk.find_yearly_min_max(da_converted_absolute, da_converted)
+
+    # Find the min, max, and median values for each day of year. These are used in the zoom shortcuts.
+    grouped = da_converted.groupby("time.dayofyear")
+    dayofyear_median = grouped.median()
+
+    return {"da_converted": da_converted,
+            "minimum": _data(min_max_dict["cds_minimum"]),
+            "maximum": _data(min_max_dict["cds_maximum"]),
+            "individual_years": {year: _data(cds) for year, cds in cds_individual_years.items()},
+            "yearly_max": _data(cds_yearly_max),
+            "yearly_min": _data(cds_yearly_min),
+            "dayofyear_min": _compact_series(grouped.min()),
+            "dayofyear_max": _compact_series(grouped.max()),
+            "doy_minimum": dayofyear_median.idxmin().values.astype(int),
+            "doy_maximum": dayofyear_median.idxmax().values.astype(int)}
+
+
+def parse_reference_period(reference_period, years):
+    """Return the first and last year of a reference period given as e.g. "1981-2010". Raises a ValueError with a
+    message for the user if the reference period is not valid, or has no years with data."""
+    match = re.fullmatch(r"(\d{4})-(\d{4})", str(reference_period))
+    if match is None:
+        raise ValueError("The reference period must be given as the first and last year, e.g. 1981-2010.")
+
+    start_year, end_year = int(match[1]), int(match[2])
+    if start_year > end_year:
+        raise ValueError("The first year of the reference period must not be after the last year.")
+    if end_year < int(years[0]) or start_year > int(years[-1]):
+        raise ValueError(f"The reference period must include years with data, which is {years[0]}-{years[-1]}.")
+
+    return start_year, end_year
+
+
+def _anomaly_reference_period(reference_period, plot_type):
+    # Only the anomalies depend on the reference period, so the absolute values are shared by all reference periods.
+    return reference_period if plot_type == "anomaly" else None
+
+
+def get_daily_products(index, area, version, reference_period, plot_type):
+    """Get the derived products of the daily app. They are only calculated again when the data has changed."""
+    extracted_data = get_data(index, area, "daily", version)
+    parse_reference_period(reference_period, tk.get_list_of_years(extracted_data["da"]))
+    metrics.count("products_cache_requests", app="daily", area=area, index=index)
+
+    stamp = dataset_stamp(extracted_data)
+    products = _get_daily_products(index,
+                                   area,
+                                   version,
+                                   _anomaly_reference_period(reference_period, plot_type),
+                                   plot_type,
+                                   stamp)
+
+    return {**products, **_get_reference_products(index, area, version, reference_period, plot_type, stamp)}
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS)
+def _get_daily_products(index, area, version, reference_period, plot_type, stamp):
+    metrics.count("products_cache_misses", app="daily", area=area, index=index)
+    extracted_data = get_data(index, area, "daily", version)
+
+    name = f"daily_{version}_{area}_{index}_{reference_period}_{plot_type}"
+    with metrics.labels(app="daily", area=area, index=index):
+        if plot_type == "anomaly":
+            # The anomalies are calculated from the cached absolute values in an all_leap calendar and the mean of
+            # the reference period, so the data is not loaded and converted again when the plot type is changed.
+            absolute_products = _get_daily_products(index, area, version, None, "absolute", stamp)
+            start_year, end_year = parse_reference_period(reference_period,
+                                                          tk.get_list_of_years(absolute_products["da"]))
+            products = _load_or_compute(name,
+                                        stamp,
+                                        calculate_anomaly_products,
+                                        absolute_products["da_leap"],
+                                        absolute_products["da_converted"],
+                                        _get_baselines(index, area, version, stamp).mean(start_year, end_year),
+                                        absolute_products["day_of_year_index"],
+                                        persist=reference_period in REFERENCE_PERIODS)
+        else:
+            products = _load_or_compute(name, stamp, calculate_daily_products, extracted_data["da"])
+    _freeze(products)
+    products["extracted_data"] = extracted_data
+
+    return products
+
+
+def calculate_reference_products(baselines, reference_period, plot_type):
+    """Calculate the reference period climatology (percentiles and median) of the daily app."""
+    start_year, end_year = parse_reference_period(reference_period, baselines.years)
+    offset = baselines.mean(start_year, end_year) if plot_type == "anomaly" else 0
+    percentiles_and_median_dict = baselines.percentiles_and_median(start_year, end_year, offset)
+
+    return {"percentile_1090": _data(percentiles_and_median_dict["cds_percentile_1090"]),
+            "percentile_2575": _data(percentiles_and_median_dict["cds_percentile_2575"]),
+            "median": _data(percentiles_and_median_dict["cds_median"])}
+
+
+@_cached(max_items=len(VERSIONS) * len(INDICES) * len(AREAS) * 2)
+def _get_baselines(index, area, version, stamp):
+    # The baselines of all reference periods are found from the absolute values.
+    absolute_products = _get_daily_products(index, area, version, None, "absolute", stamp)
+
+    with metrics.labels(app="daily", area=area, index=index), metrics.span("reference_baselines"):
+        return tk.ReferenceBaselines(absolute_products["da_converted"], absolute_products["day_of_year_index"])
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS)
+def _get_reference_products(index, area, version, reference_period, plot_type, stamp):
+    # The reference period climatology is cached separately from the other products, so that changing the reference
+    # period of the absolute values doesn't calculate anything else.
+    metrics.count("products_cache_misses", app="daily_reference", area=area, index=index)
+    baselines = _get_baselines(index, area, version, stamp)
+
+    with metrics.labels(app="daily", area=area, index=index):
+        return _freeze(calculate_reference_products(baselines, reference_period, plot_type))
+
+
+def calculate_decadal_products(da_converted, day_of_year_index):
+    """Calculate the decadal climatology (0-100 percentile and median) of all decades in the daily app."""
+    decadal_dict = tk.calculate_decadal_span_and_median(da_converted, day_of_year_index)
+
+    return {decade: {"span": _data(clim_dict["cds_span"]), "median": _data(clim_dict["cds_median"])}
+            for decade, clim_dict in decadal_dict.items()}
+
+
+def get_decadal_products(index, area, version, reference_period, plot_type):
+    """Get the decadal climatology of the daily app by decade. The decadal curves are hidden by default, so they are
+    only calculated when a session shows a decade for the first time."""
+    extracted_data = get_data(index, area, "daily", version)
+    metrics.count("products_cache_requests", app="daily_decadal", area=area, index=index)
+
+    return _get_decadal_products(index,
+                                 area,
+                                 version,
+                                 _anomaly_reference_period(reference_period, plot_type),
+                                 plot_type,
+                                 dataset_stamp(extracted_data))
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS)
+def _get_decadal_products(index, area, version, reference_period, plot_type, stamp):
+    metrics.count("products_cache_misses", app="daily_decadal", area=area, index=index)
+    products = _get_daily_products(index, area, version, reference_period, plot_type, stamp)
+
+    with metrics.labels(app="daily", area=area, index=index):
+        return _freeze(calculate_decadal_products(products["da_converted"], products["day_of_year_index"]))
+
+
+def calculate_monthly_products(da, reference_period, month_offset):
+    """Calculate all the derived products that are plotted in the monthly app."""
+    reference_period_start = reference_period[0:4]
+    reference_period_end = reference_period[5:9]
+    trends = tk.Trends(da, reference_period_start, reference_period_end, month_offset)
+
+    # The decadal trends are only calculated when they are shown, see get_decadal_trend_products.
+    return {"da": da,
+            "all_months": _data(tk.calculate_all_months(da)),
+            "monthly": {month: _data(cds) for month, cds in tk.calculate_monthly(da, month_offset).items()},
+            "monthly_trend": {month: _data(cds) for month, cds in trends.calculate_monthly_trend().items()},
+            "decades": [f"{decade_start}-{decade_end}" for decade_start, decade_end in trends.decades]}
+
+
+def get_monthly_products(index, area, version, reference_period, month_offset):
+    """Get the derived products of the monthly app. They are only calculated again when the data has changed."""
+    extracted_data = get_data(index, area, "monthly", version)
+    parse_reference_period(reference_period, tk.get_list_of_years(extracted_data["da"]))
+    metrics.count("products_cache_requests", app="monthly", area=area, index=index)
+
+    return _get_monthly_products(index, area, version, reference_period, month_offset, dataset_stamp(extracted_data))
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS)
+def _get_monthly_products(index, area, version, reference_period, month_offset, stamp):
+    metrics.count("products_cache_misses", app="monthly", area=area, index=index)
+    extracted_data = get_data(index, area, "monthly", version)
+
+    with metrics.labels(app="monthly", area=area, index=index):
+        products = _load_or_compute(f"monthly_{version}_{area}_{index}_{reference_period}_{month_offset}",
+                                    stamp,
+                                    calculate_monthly_products,
+                                    extracted_data["da"],
+                                    reference_period,
+                                    month_offset,
+                                    persist=reference_period in REFERENCE_PERIODS)
+    _freeze(products)
+    products["extracted_data"] = extracted_data
+
+    return products
+
+
+def calculate_decadal_trend_products(da, reference_period, month_offset, month):
+    """Calculate the decadal trends of one month in the monthly app."""
+    trends = tk.Trends(da, reference_period[0:4], reference_period[5:9], month_offset)
+    decadal_trend_dict = trends.calculate_decadal_trend(edge_padding=0.1,
+                                                        months=[list(calendar.month_name).index(month)])
+
+    return {decade: _data(cds) for decade, cds in decadal_trend_dict[month].items()}
+
+
+def get_decadal_trend_products(index, area, version, reference_period, month_offset, month):
+    """Get the decadal trends of one month in the monthly app. Only the full trend of the current month is shown by
+    default, so the decadal trends are only calculated when a session shows them for the first time."""
+    extracted_data = get_data(index, area, "monthly", version)
+    metrics.count("products_cache_requests", app="monthly_decadal", area=area, index=index)
+
+    return _get_decadal_trend_products(index,
+                                       area,
+                                       version,
+                                       reference_period,
+                                       month_offset,
+                                       month,
+                                       dataset_stamp(extracted_data))
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS * 12)
+def _get_decadal_trend_products(index, area, version, reference_period, month_offset, month, stamp):
+    metrics.count("products_cache_misses", app="monthly_decadal", area=area, index=index)
+    da = get_monthly_products(index, area, version, reference_period, month_offset)["da"]
+
+    with metrics.labels(app="monthly", area=area, index=index):
+        return _freeze(calculate_decadal_trend_products(da, reference_period, month_offset, month))
+
+
+def calculate_comparison_products(areas, absolute_products, reference_period):
+    """Calculate the last year of the daily data of several areas as values, anomalies and percentiles of the reference
+    period of each area, in one pass over all areas."""
+    start_year, end_year = parse_reference_period(reference_period, tk.get_list_of_years(absolute_products[0]["da"]))
+    cds_areas = tk.compare_areas({area: (products["da_converted"], products["day_of_year_index"])
+                                  for area, products in zip(areas, absolute_products)},
+                                 start_year,
+                                 end_year)
+
+    return {"areas": {area: _data(cds) for area, cds in cds_areas.items()},
+            "last_dates": {area: str(tk.format_dates(products["da"].time[-1]))
+                           for area, products in zip(areas, absolute_products)}}
+
+
+def get_comparison_products(index, areas, version, reference_period):
+    """Get the last year of the daily data of several areas for comparing them. The datasets of the areas are fetched
+    concurrently, and the products are only calculated again when the data of one of the areas has changed."""
+    unknown_areas = set(areas) - set(AREAS)
+    if unknown_areas or not areas:
+        raise ValueError(f"Select one or more of the areas {', '.join(AREAS)}.")
+
+    # The areas are kept in the order of AREAS, so that every selection of the same areas uses the same cache entry.
+    areas = tuple(area for area in AREAS if area in areas)
+    metrics.count("products_cache_requests", app="compare", index=index)
+
+    # Most of the time of fetching a dataset is spent waiting for the data server, so the datasets that are not in the
+    # cache are fetched at the same time by the fetch processes, if FETCH_PROCESSES is set.
+    with ThreadPoolExecutor(max_workers=len(areas)) as executor:
+        stamps = tuple(executor.map(lambda area: dataset_stamp(get_data(index, area, "daily", version)), areas))
+
+    return _get_comparison_products(index, areas, version, reference_period, stamps)
+
+
+@_cached(max_items=PRODUCTS_MAX_ITEMS)
+def _get_comparison_products(index, areas, version, reference_period, stamps):
+    metrics.count("products_cache_misses", app="compare", index=index)
+
+    # The absolute values of the areas are shared with the daily app. The areas that are not in the cache yet are
+    # calculated concurrently.
+    with ThreadPoolExecutor(max_workers=len(areas)) as executor:
+        absolute_products = list(executor.map(lambda area, stamp: _get_daily_products(index,
+                                                                                       area,
+                                                                                       version,
+                                                                                       None,
+                                                                                       "absolute",
+                                                                                       stamp),
+                                              areas,
+                                              stamps))
+
+    with metrics.labels(app="compare", index=index):
+        return _freeze(calculate_comparison_products(areas, absolute_products, reference_period))
+
+
+def calculate_summary_products(datasets, absolute_products, reference_period):
+    """Calculate the summary of the latest day of the daily data of several datasets, given as (index, area), in one
+    pass over all datasets. The products of the datasets that are unavailable are None, and their rows have no
+    values."""
+    available = np.array([products is not None for products in absolute_products])
+    rows = np.flatnonzero(available)
+    first_products = absolute_products[rows[0]]
+    start_year, end_year = parse_reference_period(reference_period, tk.get_list_of_years(first_products["da"]))
+    cds_summary = tk.summarize_areas({datasets[row]: (absolute_products[row]["da_converted"],
+                                                      absolute_products[row]["day_of_year_index"])
+                                      for row in rows},
+                                     start_year,
+                                     end_year)
+
+    cds_summary.data = {column: _summary_column(values, rows, len(datasets))
+                        for column, values in cds_summary.data.items()}
+
+    return {"summary": {"index": np.array([index for index, _ in datasets], dtype=object),
+                        "area": np.array([area for _, area in datasets], dtype=object),
+                        "available": available,
+                        **_data(cds_summary)},
+            "units": {datasets[row][0]: absolute_products[row]["extracted_data"]["units"] for row in rows}}
+
+
+def _summary_column(values, rows, length):
+    # Place the values of the available datasets in their rows of the summary. The other rows are shown as unavailable,
+    # with NaN values, and 0 as the number of years and the years of the records.
+    if values.dtype == object:
+        column = np.full(length, "unavailable", dtype=object)
+    elif values.dtype.kind == "f":
+        column = np.full(length, np.nan)
+    else:
+        column = np.zeros(length, dtype=values.dtype)
+    column[rows] = values
+
+    return column
+
+
+def get_summary_products(version, reference_period):
+    """Get the summary of the latest day of all areas and indices. The summary is calculated again when new data has
+    been added to any of the datasets, but only the products of the datasets that have changed are calculated again."""
+    datasets = tuple(itertools.product(INDICES, AREAS))
+    metrics.count("products_cache_requests", app="summary")
+
+    def find_stamp(dataset):
+        # A dataset that is unavailable is shown as unavailable in the summary, instead of failing the whole summary.
+        # It's opened again by the next request, since failures are not cached.
+        try:
+            return dataset_stamp(get_data(*dataset, "daily", version))
+        except OSError as ex:
+            logging.warning(f"Dataset {dataset} of the summary is unavailable: {ex}")
+            return None
+
+    # The datasets are usually in the cache, so their stamps are read one after the other for every session. Only the
+    # datasets that have expired are fetched, at the same time in the summary threads.
+    stamps = [None if extracted_data is None else dataset_stamp(extracted_data)
+              for extracted_data in (get_data.cached_value(*dataset, "daily", version) for dataset in datasets)]
+    expired = [i for i, stamp in enumerate(stamps) if stamp is None]
+    if expired:
+        for i, stamp in zip(expired, _get_summary_pool().map(find_stamp, [datasets[i] for i in expired])):
+            stamps[i] = stamp
+    stamps = tuple(stamps)
+
+    if all(stamp is None for stamp in stamps):
+        raise OSError("None of the datasets of the summary are available.")
+
+    return _get_summary_products(version, reference_period, datasets, stamps)
+
+
+@_cached(max_items=2 * len(VERSIONS) * len(REFERENCE_PERIODS))
+def _get_summary_products(version, reference_period, datasets, stamps):
+    metrics.count("products_cache_misses", app="summary")
+
+    # The absolute values are shared with the daily app, so when new data arrives only the datasets with new data are
+    # calculated again, and the summary is one pass over the stacked data. The datasets without a stamp are unavailable.
+    # Only the products that are not in the cache are calculated, at the same time in the summary threads.
+    arguments = [None if stamp is None else (*dataset, version, None, "absolute", stamp)
+                 for dataset, stamp in zip(datasets, stamps)]
+    absolute_products = [None if args is None else _get_daily_products.cached_value(*args) for args in arguments]
+    missing = [i for i, products in enumerate(absolute_products) if products is None and arguments[i] is not None]
+    if missing:
+        for i, products in zip(missing, _get_summary_pool().map(lambda i: _get_daily_products(*arguments[i]),
+                                                                 missing)):
+            absolute_products[i] = products
+
+    with metrics.labels(app="summary"):
+        return _freeze(calculate_summary_products(datasets, absolute_products, reference_period))
+
+
+def _stack(tables, key_column=None):
+    """Stack tables with the same columns into one table. The keys of the tables are added as the column key_column if
+    it's given."""
+    stacked = {}
+    if key_column is not None:
+        stacked[key_column] = np.concatenate([np.full(len(next(iter(table.values()))), key)
+                                              for key, table in tables.items()])
+    for column in next(iter(tables.values())):
+        stacked[column] = np.concatenate([table[column] for table in tables.values()])
+
+    return stacked
+
+
+def daily_tables(products):
+    """Return the derived products of the daily app as tables, i.e. dicts of columns of the same length."""
+    return {"climatology": {"day_of_year": products["median"]["day_of_year"],
+                            "percentile_10": products["percentile_1090"]["percentile_10"],
+                            "percentile_25": products["percentile_2575"]["percentile_25"],
+                            "median": products["median"]["median"],
+                            "percentile_75": products["percentile_2575"]["percentile_75"],
+                            "percentile_90": products["percentile_1090"]["percentile_90"]},
+            "min_max": {**products["minimum"], **products["maximum"]},
+            "individual_years": _stack(products["individual_years"], "year"),
+            "yearly_max": dict(products["yearly_max"]),
+            "yearly_min": dict(products["yearly_min"])}
+
+
+def monthly_tables(products, decadal_trends):
+    """Return the derived products and the decadal trends of all months of the monthly app as tables."""
+    return {"all_months": dict(products["all_months"]),
+            "monthly": _stack(products["monthly"]),
+            "monthly_trend": _stack(products["monthly_trend"]),
+            "decadal_trend": _stack({(month, decade): table
+                                     for month, month_trends in decadal_trends.items()
+                                     for decade, table in month_trends.items()})}
+
+
+def get_product_tables(index, area, version, frequency, reference_period, plot_type="absolute"):
+    """Get the derived products of a dataset as tables, for use outside the apps. They come from the same caches as
+    the products of the apps."""
+    if frequency == "daily":
+        return daily_tables(get_daily_products(index, area, version, reference_period, plot_type))
+
+    # Without the offset of the months, the x values of the monthly products are the years.
+    products = get_monthly_products(index, area, version, reference_period, False)
+    decadal_trends = {month: get_decadal_trend_products(index, area, version, reference_period, False, month)
+                      for month in products["monthly_trend"]}
+
+    return monthly_tables(products, decadal_trends)
+
+
+def cache_entries():
+    """Return the entries of the caches of datasets and products in this process, with the name of the cache, the
+    number of hits, the time of the last use and the cached value."""
+    now = time.monotonic()
+
+    return [{"cache": name,
+             "hits": entry["hits"],
+             "age_seconds": now - entry["created"],
+             "idle_seconds": now - entry["last_used"],
+             "value": entry["value"]}
+            for name, func in _caches.items() for entry in func.entries()]
+
+
+def clear_caches():
+    """Remove all datasets and products from the caches of this process."""
+    for func in [get_data,
+                 _get_daily_products,
+                 _get_baselines,
+                 _get_reference_products,
+                 _get_decadal_products,
+                 _get_monthly_products,
+                 _get_decadal_trend_products,
+                 _get_comparison_products,
+                 _get_summary_products]:
+        func.clear()
+
+
+def _warm_dataset(index, area, frequency, version):
+    # Download the dataset once, and then calculate the products for all the selector combinations of the app.
+    extracted_data = get_data(index, area, frequency, version)
+
+    if frequency == "daily":
+        # The colour palettes of the individual years are memoized by the number of years, so evaluate them here
+        # instead of in the first session.
+        tk.warm_palettes(tk.get_list_of_years(extracted_data["da"]))
+        for reference_period, plot_type in itertools.product(REFERENCE_PERIODS, PLOT_TYPES):
+            get_daily_products(index, area, version, reference_period, plot_type)
+    else:
+        for reference_period, month_offset in itertools.product(REFERENCE_PERIODS, [False, True]):
+            get_monthly_products(index, area, version, reference_period, month_offset)
+
+
+def warmup(max_workers=None):
+    """Download the data and calculate the derived products of all datasets using a bounded pool of workers."""
+    if max_workers is None:
+        max_workers = int(os.getenv("WARMUP_WORKERS", 4))
+
+    datasets = list(itertools.product(INDICES, AREAS, ["daily", "monthly"], VERSIONS))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_warm_dataset, *dataset): dataset for dataset in datasets}
+        for future in as_completed(futures):
+            # A dataset that is unavailable should not keep the server from becoming ready. Sessions will try
+            # downloading it again when it's requested.
+            if future.exception() is not None:
+                logging.warning(f"Warmup of {futures[future]} failed: {future.exception()}")
+
+    # The summary of all datasets is calculated from the products that were just calculated.
+    for version, reference_period in itertools.product(VERSIONS, REFERENCE_PERIODS):
+        try:
+            get_summary_products(version, reference_period)
+        except (OSError, ValueError) as ex:
+            logging.warning(f"Warmup of the summary of {version} {reference_period} failed: {ex}")
+
+    warmup_ready.set()
+
+
+def start_warmup():
+    """Run the warmup in a background thread so that the server can start while the cache is being filled."""
+    thread = threading.Thread(target=warmup, name="warmup", daemon=True)
+    thread.start()
+
+    return thread
@@ -0,0 +1,77 @@
+import cProfile
+import datetime
+import functools
+import logging
+import os
+import random
+import re
+import threading
+
+# Profiling is turned on by setting PROFILE_DIR to the directory where the profiles are written. Only a fraction
+# PROFILE_SAMPLE_RATE of the calls are profiled, so that it can stay on under real load, and at most PROFILE_MAX_FILES
+# profiles are written by each process.
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1"))
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "1000"))
+
+_lock = threading.Lock()
+_files_written = 0
+# Only one profiler can be active in a thread, so calls made while another call is profiled are not profiled.
+_active = threading.local()
+
+
+def start():
+    """Start profiling if profiling is turned on and this call is sampled. Returns the profiler, or None."""
+    if PROFILE_DIR is None or getattr(_active, "profiler", None) is not None or _files_written >= PROFILE_MAX_FILES:
+        return None
+    if random.random() >= PROFILE_SAMPLE_RATE:
+        return None
+
+    profiler = cProfile.Profile()
+    _active.profiler = profiler
+    profiler.enable()
+
+    return profiler
+
+
+def stop(profiler, name, **labels):
+    """Stop the profiler returned by start, and write the profile to a file named after the time, the process, the
+    name and the labels, e.g. the selection of the session."""
+    global _files_written
+
+    if profiler is None:
+        return
+
+    profiler.disable()
+    _active.profiler = None
+
+    with _lock:
+        if _files_written >= PROFILE_MAX_FILES:
+            return
+        _files_written += 1
+
+    tags = "_".join(re.sub(r"[^\w.-]", "-", str(value)) for value in [name, *labels.values()])
+    time = datetime.datetime.now().strftime("%Y%m%dT%H%M%S.%f")
+    path = os.path.join(PROFILE_DIR, f"{time}_{os.getpid()}_{tags}.prof")
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError:
+        logging.exception(f"Could not write the profile {path}")
+
+
+def profiled(func=None, *, labels=None):
+    """Decorator that profiles a sample of the calls of a function, using the function name as the name of the
+    profiles. The labels can be given as a function that is called to find the labels at the time of the call."""
+    if func is None:
+        return functools.partial(profiled, labels=labels)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profiler = start()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            stop(profiler, func.__name__, **(labels() if labels and profiler else {}))
+
+    return wrapper
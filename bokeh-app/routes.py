@@ -0,0 +1,194 @@
+from email.utils import parsedate_to_datetime
+import datetime
+import hashlib
+import json
+import os
+import numpy as np
+import panel as pn
+from tornado.ioloop import IOLoop
+from tornado.web import RequestHandler, HTTPError
+import products as pr
+import metrics
+import sessions
+
+# The number of encoded responses of the products API that are kept in memory.
+API_CACHE_ITEMS = int(os.getenv("API_CACHE_ITEMS", 32))
+
+
+def mark_ready_without_warmup():
+    """Report the server as ready when the warmup is disabled with WARMUP=false. The entrypoint only runs the warmup
+    setup script when WARMUP is true, and without it nothing else would set warmup_ready."""
+    if (os.getenv("WARMUP") or "true") != "true":
+        pr.warmup_ready.set()
+
+
+# The routes are loaded once per server process, like the setup script.
+mark_ready_without_warmup()
+
+
+class ReadinessHandler(RequestHandler):
+    """Report whether the product cache is warm, so that a load balancer only routes traffic to a ready server."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain")
+        if pr.warmup_ready.is_set():
+            self.write("ready")
+        else:
+            self.set_status(503)
+            self.write("warming up")
+
+
+class MetricsHandler(RequestHandler):
+    """Serve the timing metrics and cache counters of this process in the Prometheus text format."""
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.write(metrics.render())
+
+
+class MemoryHandler(RequestHandler):
+    """Report the estimated memory of the largest live sessions and cache entries of this process, and the sessions
+    whose documents were not freed after they were destroyed."""
+
+    def get(self):
+        limit = int(self.get_argument("limit", "10"))
+        self.write(sessions.report(pr.cache_entries(), limit))
+
+
+def _json_column(column):
+    # The float32 values of COMPACT_PRODUCTS are written with their shortest representation, e.g. 14.123 instead of
+    # 14.123000144958496.
+    if column.dtype == np.float32:
+        column = column.astype(str).astype(np.float64)
+
+    # JSON has no NaN, so missing values are written as null.
+    if column.dtype.kind == "f":
+        column = np.where(np.isnan(column), None, column.astype(object))
+
+    return column.tolist()
+
+
+def encode_json(tables, metadata):
+    """Encode the tables as compact JSON, with the columns of each table as lists."""
+    return json.dumps({**metadata,
+                       "tables": {name: {column: _json_column(values) for column, values in table.items()}
+                                  for name, table in tables.items()}},
+                      separators=(",", ":")).encode()
+
+
+def encode_arrow(table, metadata):
+    """Encode one table in the Arrow IPC stream format, with the metadata in the schema."""
+    # pyarrow is only imported when it's used, since it takes a while to import.
+    import pyarrow as pa
+
+    record_batch = pa.record_batch({column: pa.array(values) for column, values in table.items()},
+                                   metadata={key: str(value) for key, value in metadata.items() if value is not None})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, record_batch.schema) as writer:
+        writer.write_batch(record_batch)
+
+    return sink.getvalue().to_pybytes()
+
+
+@pn.cache(max_items=API_CACHE_ITEMS)
+def _encoded_products(index, area, version, frequency, reference_period, plot_type, output_format, table, stamp):
+    # The encoded responses are cached by the stamp of the dataset, like the products.
+    metadata = {"index": index,
+                "area": area,
+                "version": version,
+                "frequency": frequency,
+                "reference_period": reference_period,
+                "type": plot_type,
+                "stamp": stamp}
+    tables = pr.get_product_tables(index, area, version, frequency, reference_period, plot_type)
+    if table is not None and table not in tables:
+        raise HTTPError(400, reason=f"Unknown table {table}, choose one of {', '.join(tables)}")
+
+    with metrics.span("api_encode", frequency=frequency, format=output_format):
+        if output_format == "json":
+            return encode_json(tables if table is None else {table: tables[table]}, metadata)
+        else:
+            return encode_arrow(tables[table], metadata)
+
+
+class ProductsHandler(RequestHandler):
+    """Serve the derived products of a dataset as compact JSON or Arrow, for use by other tools. The responses have an
+    ETag and Last-Modified header based on the data, so a request with If-None-Match or If-Modified-Since returns 304
+    without the products until new data has been added. Example: /api/products?frequency=daily&area=nh&index=sie"""
+
+    def argument(self, name, choices, default=None):
+        value = self.get_argument(name, default)
+        if value is None or (choices is not None and value not in choices):
+            raise HTTPError(400, reason=f"{name} must be one of {', '.join(choices)}")
+
+        return value
+
+    async def get(self):
+        frequency = self.argument("frequency", ["daily", "monthly"])
+        index = self.argument("index", pr.INDICES)
+        area = self.argument("area", pr.AREAS)
+        version = self.argument("version", pr.VERSIONS, pr.VERSIONS[0])
+        reference_period = self.argument("ref_period", None, pr.REFERENCE_PERIODS[0])
+        # The plot type only applies to the daily products.
+        plot_type = self.argument("type", pr.PLOT_TYPES, "absolute") if frequency == "daily" else None
+        output_format = self.argument("format", ["json", "arrow"], "json")
+        table = self.get_argument("table", None)
+        if output_format == "arrow" and table is None:
+            raise HTTPError(400, reason="An Arrow response holds one table, choose it with table")
+
+        # Opening the data and calculating the products can take a while, so do it outside of the event loop.
+        loop = IOLoop.current()
+        try:
+            extracted_data = await loop.run_in_executor(None, pr.get_data, index, area, frequency, version)
+        except OSError:
+            raise HTTPError(503, reason="Sea ice data unavailable")
+
+        stamp = pr.dataset_stamp(extracted_data)
+        selection = [index, area, version, frequency, reference_period, plot_type, output_format, table]
+        last_modified = extracted_data["da"].time[-1].values.astype("datetime64[s]").item()
+        self.set_header("Etag", f'"{hashlib.sha256(json.dumps([*selection, stamp]).encode()).hexdigest()[:32]}"')
+        self.set_header("Last-Modified", last_modified)
+        # Clients and proxies may store the response, but must check that it's still valid.
+        self.set_header("Cache-Control", "no-cache")
+
+        if self.not_modified(last_modified):
+            metrics.count("api_requests", frequency=frequency, status="304")
+            self.set_status(304)
+            return
+
+        try:
+            body = await loop.run_in_executor(None, _encoded_products, *selection, stamp)
+        except ValueError as ex:
+            # E.g. a reference period without data.
+            raise HTTPError(400, reason=str(ex))
+
+        metrics.count("api_requests", frequency=frequency, status="200")
+        if output_format == "json":
+            self.set_header("Content-Type", "application/json")
+        else:
+            self.set_header("Content-Type", "application/vnd.apache.arrow.stream")
+        self.write(body)
+
+    def not_modified(self, last_modified):
+        # If-None-Match takes precedence over If-Modified-Since.
+        if self.request.headers.get("If-None-Match") is not None:
+            return self.check_etag_header()
+
+        if_modified_since = self.request.headers.get("If-Modified-Since")
+        if if_modified_since is None:
+            return False
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is not None:
+            since = since.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+        return last_modified <= since
+
+
+# Extra routes that are added to the server with "panel serve --plugins routes".
+ROUTES = [(r"/ready", ReadinessHandler, {}),
+          (r"/metrics", MetricsHandler, {}),
+          (r"/memory", MemoryHandler, {}),
+          (r"/api/products", ProductsHandler, {})]
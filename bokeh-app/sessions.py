@@ -0,0 +1,142 @@
+from collections import deque
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+import numpy as np
+import xarray as xr
+import panel as pn
+from bokeh.models import ColumnDataSource
+import metrics
+
+# Set MEMORY_TRACE_FRAMES to the number of frames to store per memory allocation to trace the allocations with
+# tracemalloc, and list the largest allocation sites in the memory report. Tracing makes the apps slower.
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", 0))
+if MEMORY_TRACE_FRAMES > 0 and not tracemalloc.is_tracing():
+    tracemalloc.start(MEMORY_TRACE_FRAMES)
+
+# The number of seconds after a session has been destroyed before its document is reported as leaked if it's still in
+# memory.
+LEAK_GRACE_PERIOD = int(os.getenv("LEAK_GRACE_PERIOD", 60))
+
+_lock = threading.Lock()
+# The live sessions of this process by session id.
+_sessions = {}
+# Weak references to the documents of the most recently destroyed sessions. A document that is still alive a while
+# after its session was destroyed is kept in memory by something, and leaks.
+_destroyed = deque(maxlen=1000)
+
+
+def estimate_size(obj, _seen=None):
+    """Estimate the memory used by the arrays, data arrays, ColumnDataSources and containers inside an object. Returns
+    the bytes owned by the object, and the bytes of read-only arrays that are shared with the product cache."""
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0, 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return (obj.nbytes, 0) if obj.flags.writeable else (0, obj.nbytes)
+    if isinstance(obj, (xr.DataArray, xr.Dataset)):
+        # Only count the variables that have been loaded. Getting the values of the other variables would download
+        # them.
+        variables = obj.variables if isinstance(obj, xr.Dataset) else {None: obj.variable, **obj.coords.variables}
+        sizes = [estimate_size(variable.values, seen) for variable in variables.values() if variable._in_memory]
+    elif isinstance(obj, ColumnDataSource):
+        sizes = [estimate_size(obj.data, seen)]
+    elif isinstance(obj, dict):
+        sizes = [(sys.getsizeof(obj), 0)] + [estimate_size(value, seen) for value in obj.values()]
+    elif isinstance(obj, (list, tuple)):
+        sizes = [(sys.getsizeof(obj), 0)] + [estimate_size(value, seen) for value in obj]
+    else:
+        return sys.getsizeof(obj), 0
+
+    return sum(owned for owned, _ in sizes), sum(shared for _, shared in sizes)
+
+
+def register(app, labels, objects=None):
+    """Register the current session for the memory accounting. The labels are a function that returns the selection of
+    the session, and the objects a function that returns the data that the session keeps outside its document."""
+    doc = pn.state.curdoc
+    session_id = doc.session_context.id
+    with _lock:
+        _sessions[session_id] = {"app": app,
+                                 "document": weakref.ref(doc),
+                                 "labels": labels,
+                                 "objects": objects,
+                                 "created": time.time()}
+    metrics.count("sessions_created", app=app)
+
+    pn.state.on_session_destroyed(_session_destroyed)
+
+
+def _session_destroyed(session_context):
+    with _lock:
+        session = _sessions.pop(session_context.id, None)
+    if session is None:
+        return
+
+    _destroyed.append({"id": session_context.id,
+                       "app": session["app"],
+                       "document": session["document"],
+                       "destroyed": time.time()})
+    metrics.count("sessions_destroyed", app=session["app"])
+
+
+def _session_report(session_id, session):
+    doc = session["document"]()
+    if doc is None:
+        return None
+
+    sources = [model for model in doc.models if isinstance(model, ColumnDataSource)]
+    owned, shared = estimate_size([sources, session["objects"]() if session["objects"] else None])
+
+    return {"id": session_id,
+            "app": session["app"],
+            **session["labels"](),
+            "age_seconds": time.time() - session["created"],
+            "sources": len(sources),
+            "owned_mb": owned / 2**20,
+            "shared_mb": shared / 2**20}
+
+
+def report(cache_entries=(), limit=10):
+    """Report the estimated memory of the largest live sessions and cache entries, the documents of destroyed sessions
+    that are still in memory, and the largest allocation sites if the allocations are traced."""
+    # Free the documents that are only kept alive by reference cycles before looking for leaks.
+    gc.collect()
+
+    with _lock:
+        sessions = list(_sessions.items())
+    session_reports = [report for report in (_session_report(*session) for session in sessions) if report]
+
+    cache_reports = []
+    for entry in cache_entries:
+        owned, shared = estimate_size(entry["value"])
+        cache_reports.append({**{key: value for key, value in entry.items() if key != "value"},
+                              "size_mb": (owned + shared) / 2**20})
+
+    now = time.time()
+    leaked = [{"id": session["id"], "app": session["app"], "destroyed_seconds_ago": now - session["destroyed"]}
+              for session in list(_destroyed)
+              if session["document"]() is not None and now - session["destroyed"] > LEAK_GRACE_PERIOD]
+
+    result = {"live_sessions": len(session_reports),
+              "sessions_owned_mb": sum(session["owned_mb"] for session in session_reports),
+              "cache_entries": len(cache_reports),
+              "cache_mb": sum(entry["size_mb"] for entry in cache_reports),
+              "largest_sessions": sorted(session_reports, key=lambda session: session["owned_mb"], reverse=True)[:limit],
+              "largest_cache_entries": sorted(cache_reports, key=lambda entry: entry["size_mb"], reverse=True)[:limit],
+              "leaked_sessions": leaked}
+
+    if tracemalloc.is_tracing():
+        statistics = tracemalloc.take_snapshot().statistics("traceback")[:limit]
+        result["largest_allocations"] = [{"size_mb": statistic.size / 2**20,
+                                          "count": statistic.count,
+                                          "traceback": statistic.traceback.format()}
+                                         for statistic in statistics]
+
+    return result
@@ -0,0 +1,247 @@
+import panel as pn
+from panel.io.notifications import NotificationArea
+from bokeh.models import ColumnDataSource, DataTable, TableColumn, NumberFormatter, Paragraph
+import asyncio
+import logging
+import param
+import time
+import os
+import products as pr
+import metrics
+import profiling
+import sessions
+
+# Start timing (and possibly profiling) the creation of the session.
+session_start = time.perf_counter()
+session_profiler = profiling.start()
+
+# Get the root directory of the app.
+app_root = os.getenv('APP_ROOT')
+
+# The number of seconds between the checks for new data in an open session. The check only finds the stamps of the
+# cached datasets, and the table is only sent again when the summary has changed.
+SUMMARY_REFRESH = int(os.getenv("SUMMARY_REFRESH", 600))
+
+# Specify a loading spinner wheel to display when data is being loaded.
+pn.extension(loading_spinner='dots', loading_color='#696969')
+
+
+def exception_handler(ex):
+    # Function used to handle exceptions by showing an error message to the user.
+    logging.error("Error", exc_info=ex)
+    notifications.error(f'{ex}')
+
+
+# Handle exceptions. The notification area is added to the page by the app instead of by Panel, since Panel doesn't
+# remove its own one from its registry of views when the session is destroyed, which keeps the document in memory.
+pn.extension('notifications')
+pn.extension(exception_handler=exception_handler, notifications=False)
+notifications = NotificationArea()
+notifications.servable()
+
+
+# Add a parameter for setting the desired version of the sea ice data, and sync to url parameter.
+class VersionUrlParameter(param.Parameterized):
+    value = param.Parameter("v2p2")
+
+
+pn.state.location.sync(VersionUrlParameter, {'value': 'version'})
+
+# Add an input for the reference period of the anomalies, and sync to url parameter. Any period can be given as the
+# first and last year, and the standard periods are suggested.
+reference_period_selector = pn.widgets.AutocompleteInput(name="Reference period of anomalies:",
+                                                         options=pr.REFERENCE_PERIODS,
+                                                         value="1981-2010",
+                                                         restrict=False,
+                                                         min_characters=0,
+                                                         placeholder="First and last year, e.g. 1981-2010",
+                                                         sizing_mode="stretch_width")
+pn.state.location.sync(reference_period_selector, {"value": "ref_period"})
+
+index_names = {"sie": "Sea Ice Extent", "sia": "Sea Ice Area"}
+
+area_names = {
+    "glb": "Global",
+    "nh": "Northern Hemisphere",
+    "sh": "Southern Hemisphere",
+    "bar": "Barents Sea",
+    "beau": "Beaufort Sea",
+    "chuk": "Chukchi Sea",
+    "ess": "East Siberian Sea",
+    "fram": "Fram Strait",
+    "kara": "Kara Sea",
+    "lap": "Laptev Sea",
+    "sval": "Svalbard",
+    "bell": "Amundsen-Bellingshausen Sea",
+    "drml": "Dronning Maud Land",
+    "indi": "Indian Ocean",
+    "ross": "Ross Sea",
+    "trol": "Troll Station",
+    "wedd": "Weddell Sea",
+    "wpac": "Western Pacific Ocean",
+}
+
+
+def metric_labels():
+    # Labels of the timing metrics of this session.
+    return {"app": "summary"}
+
+
+def profile_labels():
+    # The selection of this session, used to tag the profiles.
+    return {**metric_labels(), "reference_period": reference_period_selector.value}
+
+
+def get_products():
+    # Get the summary of all areas and indices from the cache that is shared by all sessions.
+    return pr.get_summary_products(VersionUrlParameter.value, reference_period_selector.value)
+
+
+def table_data(products):
+    # The names of the areas and indices are added by the session, so that the cached summary only holds the keys.
+    summary = products["summary"]
+    return {**summary,
+            "area_name": [area_names[area] for area in summary["area"]],
+            "index_name": [index_names[index] for index in summary["index"]]}
+
+
+try:
+    products = get_products()
+
+    cds_summary = ColumnDataSource(table_data(products))
+
+    # The values are formatted with the same number of decimals as in the hovertools of the daily app. The rows of the
+    # datasets that are unavailable have NaN values, which are shown as a dash.
+    values_formatter = NumberFormatter(format="0.000", nan_format="-")
+    anomaly_formatter = NumberFormatter(format="+0.000", nan_format="-")
+    # The indices have the same units, and at least one dataset is available.
+    units = next(iter(products["units"].values()))
+    columns = [TableColumn(field="area_name", title="Area", width=200),
+               TableColumn(field="index_name", title="Index", width=110),
+               TableColumn(field="date", title="Date", width=90),
+               TableColumn(field="index_values", title=f"Value ({units})", formatter=values_formatter),
+               TableColumn(field="anomaly", title="Anomaly", formatter=anomaly_formatter),
+               TableColumn(field="rank",
+                           title="Rank",
+                           formatter=NumberFormatter(format="0[.]0", nan_format="-"),
+                           width=60),
+               TableColumn(field="years", title="Years", width=60),
+               TableColumn(field="record_low", title="Record low", formatter=values_formatter),
+               TableColumn(field="record_low_year", title="Year", width=60),
+               TableColumn(field="record_high", title="Record high", formatter=values_formatter),
+               TableColumn(field="record_high_year", title="Year", width=60)]
+
+    table = DataTable(source=cds_summary,
+                      columns=columns,
+                      index_position=None,
+                      sortable=True,
+                      sizing_mode="stretch_both")
+
+    info = pn.pane.HTML(sizing_mode="stretch_width")
+
+    def update_info():
+        # Describe the columns, since the statistics depend on the reference period and the day of year, and list the
+        # datasets that are currently unavailable.
+        summary = products["summary"]
+        last_date = max(date for date, available in zip(summary["date"], summary["available"]) if available)
+        unavailable = [f"{area_names[area]} ({index_names[index]})"
+                       for index, area, available in zip(summary["index"], summary["area"], summary["available"])
+                       if not available]
+        text = ("<h3>Sea ice on the latest day of data</h3>"
+                f"<p>Anomalies are calculated relative to the mean of {reference_period_selector.value} on the same "
+                "day of year. The rank is the rank of the value among all years on the same day of year, where 1 is "
+                "the lowest. The records are the lowest and highest values on the same day of year before the latest "
+                f"year.</p><p>Last data point: {last_date}</p>")
+        if unavailable:
+            text += f"<p>Data currently unavailable: {', '.join(unavailable)}</p>"
+        info.object = text
+
+    update_info()
+
+    # Use a grid layout.
+    gspec = pn.GridSpec(sizing_mode="stretch_both")
+
+    inputs = pn.Column(reference_period_selector)
+
+
+    def on_load():
+        # Divide the layout into 5 rows and 5 columns. The table uses 4 rows and 4 columns below the description,
+        # the widgets get the last column and first 3 rows, and the logo gets the last 2 rows.
+        gspec[0, 0:4] = info
+        gspec[1:5, 0:4] = pn.pane.Bokeh(table)
+        gspec[0:3, 4] = inputs
+        gspec[3:5, 4] = pn.pane.PNG(f'{app_root}/assets/logo.png', sizing_mode='scale_both')
+
+    # There is currently a bug in Bokeh 3.1.1 where it incorrectly calculates the amount of available space. To work
+    # around this we load the gridspec elements after the page has finished loading.
+    pn.state.onload(on_load)
+
+
+    @metrics.timed(labels=metric_labels)
+    @profiling.profiled(labels=profile_labels)
+    def update_data(event):
+        with pn.param.set_values(gspec, loading=True):
+            # Try fetching new data because it might not be available.
+            try:
+                global products
+                products = get_products()
+                cds_summary.data = table_data(products)
+                update_info()
+
+            except OSError:
+                # Raise an exception with a custom error message that will be displayed in error prompt for the user.
+                raise ValueError("Data currently unavailable. Please try again later.")
+
+
+    async def refresh():
+        # Check for new data without blocking the server, since the datasets are opened again when they have expired
+        # from the cache. The summary is the same object until the data of one of the datasets has changed, so the
+        # table is only sent to the browser when there is new data.
+        global products
+        try:
+            new_products = await asyncio.get_running_loop().run_in_executor(None, get_products)
+        except (OSError, ValueError) as ex:
+            # Keep showing the current summary, and check again later.
+            logging.warning(f"Refreshing the summary failed: {ex}")
+            return
+
+        if new_products is not products:
+            products = new_products
+            cds_summary.data = table_data(products)
+            update_info()
+
+    # Run callbacks when widget values change, and check for new data periodically.
+    reference_period_selector.param.watch(update_data, "value")
+    pn.state.add_periodic_callback(refresh, period=SUMMARY_REFRESH * 1000)
+
+    gspec.servable()
+
+    def release_session(session_context, source=cds_summary):
+        # Drop the references of the session to the data when it's closed, so that the memory is freed even if
+        # something still refers to the callbacks or models of the session. Bokeh may clear the module of the session
+        # before this runs, so the source is bound when the function is defined.
+        global products
+        source.data = {}
+        products = None
+
+    # Register the session for the memory accounting, and release its data when it's closed.
+    sessions.register("summary", profile_labels, lambda: products)
+    pn.state.on_session_destroyed(release_session)
+
+    metrics.observe("session_build", time.perf_counter() - session_start, **metric_labels())
+
+except OSError:
+    # If the datafile is unavailable when the script starts display the message below instead of running the script.
+    text = Paragraph(text="Sea ice data unavailable. Please try again in a few minutes.",
+                     styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+except ValueError as ex:
+    # If the selection in the url is not valid, e.g. a reference period without data, display the reason instead.
+    text = Paragraph(text=str(ex), styles={"font-size": "30px"})
+
+    bokeh_pane = pn.pane.Bokeh(text).servable()
+
+finally:
+    profiling.stop(session_profiler, "session_build", **profile_labels())
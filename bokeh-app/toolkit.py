@@ -1,24 +1,39 @@
 import xarray as xr
+import cftime
 from bokeh.models import ColumnDataSource
 import numpy as np
-import cmcrameri.cm as cm
-import matplotlib
 import itertools
+import functools
 import calendar
+import warnings
+import json
+import metrics
+import os
+import threading
 
+# The location of the datasets. This can be changed to a local directory or another OPeNDAP server with the same
+# directory structure, e.g. to run the apps against local test data.
+DATA_URL_PREFIX = os.getenv("DATA_URL_PREFIX", "https://thredds.met.no/thredds/dodsC/osisaf/met.no/ice/index")
+
+# The netCDF and HDF5 libraries are not thread-safe. xarray serializes the reads of the data, but not the opening of the
+# datasets, so opening a dataset while another thread reads one can fail with an HDF error or crash the process. All
+# access to the library in this process is therefore done under one lock. Datasets can be fetched at the same time in
+# separate processes instead, see FETCH_PROCESSES in products.py.
+_netcdf_lock = threading.Lock()
 
-def download_and_extract_data(index, area, frequency, version):
-    url_prefix = "https://thredds.met.no/thredds/dodsC/osisaf/met.no/ice/index"
 
-    url = f"{url_prefix}/{version}/{area}/osisaf_{area}_{index}_{frequency}.nc"
+@metrics.timed
+def download_and_extract_data(index, area, frequency, version):
+    url = f"{DATA_URL_PREFIX}/{version}/{area}/osisaf_{area}_{index}_{frequency}.nc"
 
     # Open the dataset with cache set to false, otherwise the plots will keep showing old data when updated data is
-    # available.
-    ds = xr.open_dataset(url, cache=False)
+    # available. The data is loaded and the dataset closed while the lock is held, so that the library is not used
+    # outside the lock later.
+    with _netcdf_lock, xr.open_dataset(url, cache=False) as ds:
+        da = ds[index].load()
+        title = ds.title
+        ds_version = ds.version
 
-    da = ds[index]
-    title = ds.title
-    ds_version = ds.version
     long_name = da.attrs["long_name"]
     units = da.attrs["units"]
 
@@ -29,40 +44,169 @@ def get_list_of_years(da):
     return np.unique(da.time.dt.year.values).astype(str)
 
 
-def convert_and_interpolate_calendar(da):
-    # Convert the calendar to leap years for all years in the data, and fill the missing day with -999 as value.
-    da = da.convert_calendar("all_leap", missing=-999)
-
-    # Replace the -999 values with interpolated values between the preceding and succeeding day.
-    for i, val in enumerate(da.values):
-        if val == -999:
-            da.values[i] = (da.values[i-1] + da.values[i+1]) / 2
-
-    return da
-
-
-def calculate_percentiles_and_median(da):
-    percentile_10 = da.groupby("time.dayofyear").quantile(0.10)
-    percentile_90 = da.groupby("time.dayofyear").quantile(0.90)
-    cds_percentile_1090 = ColumnDataSource({"day_of_year": percentile_10.dayofyear.values,
-                                            "percentile_10": percentile_10.values,
-                                            "percentile_90": percentile_90.values})
-
-    percentile_25 = da.groupby("time.dayofyear").quantile(0.25)
-    percentile_75 = da.groupby("time.dayofyear").quantile(0.75)
-    cds_percentile_2575 = ColumnDataSource({"day_of_year": percentile_25.dayofyear.values,
-                                            "percentile_25": percentile_25.values,
-                                            "percentile_75": percentile_75.values})
-
-    median_array = da.groupby("time.dayofyear").median()
-    day_of_year = median_array.dayofyear.values
-    cds_median = ColumnDataSource({"day_of_year": day_of_year, "median": median_array.values})
-
-    return {"cds_percentile_1090": cds_percentile_1090,
-            "cds_percentile_2575": cds_percentile_2575,
-            "cds_median": cds_median}
-
-
+def format_dates(times, date_format="%Y-%m-%d"):
+    """Format an array of numpy or cftime dates as strings. The dates are formatted one by one, since xarray formats
+    them through pandas, which fails when pandas stores the strings with pyarrow."""
+    values = np.asarray(times)
+    if np.issubdtype(values.dtype, np.datetime64):
+        values = values.astype("datetime64[us]").astype(object)
+
+    return np.array([date.strftime(date_format) for date in values.ravel()], dtype=object).reshape(values.shape)
+
+
+# The day of year of the first day of each month in a leap year, counted from zero.
+_LEAP_MONTH_STARTS = np.concatenate([[0], np.cumsum([calendar.monthrange(2000, month)[1] for month in range(1, 12)])])
+
+
+class DayOfYearIndex:
+    """Integer mapping from the time axis of the daily data to a layout where every year has 366 days, i.e. an all_leap
+    calendar. It's found once per dataset, so that the data is converted to the layout, and the derived products are
+    arranged by year and day of year, by indexing instead of converting the calendar with xarray."""
+    def __init__(self, time):
+        time = np.asarray(time, dtype="datetime64[ns]")
+        years = time.astype("datetime64[Y]").astype(int) + 1970
+        months = time.astype("datetime64[M]").astype(int) % 12
+        days = (time.astype("datetime64[D]") - time.astype("datetime64[M]")).astype(int)
+
+        # All years from the first to the last year of the data, and the year and day of year indices of each time.
+        self.years = np.arange(years[0], years[-1] + 1)
+        self.year_index = years - years[0]
+        self.doy_index = _LEAP_MONTH_STARTS[months] + days
+
+        # The positions of the data in the layout, counted from January 1st of the first year, and the positions of
+        # all days from the first to the last day of the data, including the days that are missing from the data.
+        self.positions = self.year_index * 366 + self.doy_index
+        self.all_positions = np.arange(self.positions[0], self.positions[-1] + 1)
+        self.all_doy_index = self.all_positions % 366
+
+        # The time of day of the data, which is kept in the converted time axis.
+        self.time_of_day = (time[0] - time[0].astype("datetime64[D]")) / np.timedelta64(1, "D")
+
+    def interpolate(self, values):
+        """Return the values of all days from the first to the last day of the data. The days that are missing from
+        the data, i.e. February 29th of the years that are not leap years, are interpolated between the preceding and
+        succeeding day."""
+        all_values = np.interp(self.all_positions, self.positions, values)
+        all_values[self.positions - self.positions[0]] = values
+        return all_values
+
+    def to_grid(self, all_values):
+        """Arrange the values of all days in a year x day of year array, with NaN for the days without data."""
+        grid = np.full((len(self.years), 366), np.nan)
+        grid.flat[self.all_positions] = all_values
+        return grid
+
+    def leap_time(self):
+        """Return the time axis of all days from the first to the last day of the data in an all_leap calendar."""
+        return cftime.num2date(self.all_positions + self.time_of_day,
+                               f"days since {self.years[0]}-01-01",
+                               calendar="all_leap",
+                               only_use_cftime_datetimes=True)
+
+
+@metrics.timed
+def convert_and_interpolate_calendar(da, day_of_year_index):
+    """Convert the calendar to leap years for all years in the data. Returns the converted data, and the converted data
+    with the missing days, i.e. February 29th of the years that are not leap years, interpolated."""
+    # The converted data is scattered to the all_leap layout with the day of year index, instead of converting the
+    # calendar with xarray.
+    da_converted = xr.DataArray(day_of_year_index.interpolate(da.values),
+                                coords={"time": day_of_year_index.leap_time()},
+                                dims="time",
+                                name=da.name,
+                                attrs=da.attrs)
+
+    # The converted data is the interpolated data without the missing days.
+    da_leap = da_converted.isel(time=day_of_year_index.positions - day_of_year_index.positions[0])
+
+    return da_leap, da_converted
+
+
+@metrics.timed
+def calculate_anomalies(da_leap, da_converted, mean, day_of_year_index):
+    """Subtract the mean of each day of year, e.g. of a reference period, from the converted data and the interpolated
+    converted data. The mean is indexed by the day of year index of each time step instead of grouping the data."""
+    return (da_leap.copy(data=da_leap.values - mean[day_of_year_index.doy_index]),
+            da_converted.copy(data=da_converted.values - mean[day_of_year_index.all_doy_index]))
+
+
+class ReferenceBaselines:
+    """Mean, percentile and median baselines of the daily data for any reference period. The data is arranged in a
+    year x day of year array once, so that the baselines of a reference period are found without grouping the data."""
+    def __init__(self, da_converted, day_of_year_index):
+        # The data must be the interpolated data in an all_leap calendar, so that every year has 366 days.
+        self.years = day_of_year_index.years
+        self.day_of_year = np.arange(1, 367)
+        grid = day_of_year_index.to_grid(da_converted.values)
+        valid = ~np.isnan(grid)
+
+        # Cumulative sums and counts over the years, starting with zero, so that the sum of the years i to j - 1 is
+        # cumulative_sum[j] - cumulative_sum[i] for each day of year.
+        self.cumulative_sum = np.concatenate([np.zeros((1, 366)), np.cumsum(np.where(valid, grid, 0), axis=0)])
+        self.cumulative_count = np.concatenate([np.zeros((1, 366), dtype=int), np.cumsum(valid, axis=0)])
+
+        # The year indices sorted by the value of each day of year, with the missing values last.
+        self.order = np.argsort(grid, axis=0)
+        self.sorted_values = np.take_along_axis(grid, self.order, axis=0)
+        self.sorted_valid = np.take_along_axis(valid, self.order, axis=0)
+
+    def _year_indices(self, start_year, end_year):
+        return np.searchsorted(self.years, int(start_year)), np.searchsorted(self.years, int(end_year), side="right")
+
+    def mean(self, start_year, end_year):
+        """Return the mean of each day of year in the reference period."""
+        i, j = self._year_indices(start_year, end_year)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return (self.cumulative_sum[j] - self.cumulative_sum[i]) / (self.cumulative_count[j] -
+                                                                       self.cumulative_count[i])
+
+    def quantiles(self, start_year, end_year, quantiles):
+        """Return the quantiles of each day of year in the reference period, interpolated linearly between the values
+        like numpy.quantile."""
+        i, j = self._year_indices(start_year, end_year)
+
+        # The number of values of the reference period at or before each position in the sorted values.
+        in_period = self.sorted_valid & (self.order >= i) & (self.order < j)
+        rank = np.cumsum(in_period, axis=0)
+        count = rank[-1]
+        columns = np.arange(366)
+
+        def kth_value(k):
+            # The k-th smallest value of the reference period, or NaN for days without values.
+            row = np.argmax(in_period & (rank == k + 1), axis=0)
+            return np.where(count > 0, self.sorted_values[row, columns], np.nan)
+
+        values = []
+        for quantile in quantiles:
+            position = quantile * np.maximum(count - 1, 0)
+            lower = np.floor(position).astype(int)
+            upper = np.minimum(lower + 1, np.maximum(count - 1, 0))
+            lower_value = kth_value(lower)
+            values.append(lower_value + (position - lower) * (kth_value(upper) - lower_value))
+
+        return values
+
+    @metrics.timed
+    def percentiles_and_median(self, start_year, end_year, offset=0):
+        """Return the percentiles and median of the reference period as ColumnDataSources. The offset is subtracted
+        from the values, e.g. the mean of the reference period to get the percentiles of the anomalies."""
+        percentile_10, percentile_25, median, percentile_75, percentile_90 = (
+            values - offset for values in self.quantiles(start_year, end_year, [0.10, 0.25, 0.50, 0.75, 0.90]))
+
+        cds_percentile_1090 = ColumnDataSource({"day_of_year": self.day_of_year,
+                                                "percentile_10": percentile_10,
+                                                "percentile_90": percentile_90})
+        cds_percentile_2575 = ColumnDataSource({"day_of_year": self.day_of_year,
+                                                "percentile_25": percentile_25,
+                                                "percentile_75": percentile_75})
+        cds_median = ColumnDataSource({"day_of_year": self.day_of_year, "median": median})
+
+        return {"cds_percentile_1090": cds_percentile_1090,
+                "cds_percentile_2575": cds_percentile_2575,
+                "cds_median": cds_median}
+
+
+@metrics.timed
 def calculate_min_max(da):
     # Min/max values are calculated based on the data in the entire period except for the current year.
     years_list = get_list_of_years(da)
@@ -79,22 +223,164 @@ def calculate_min_max(da):
     return {"cds_minimum": cds_minimum, "cds_maximum": cds_maximum}
 
 
-def calculate_span_and_median(da):
-    minimum = da.groupby("time.dayofyear").min()
-    maximum = da.groupby("time.dayofyear").max()
-    cds_span = ColumnDataSource({"day_of_year": minimum.dayofyear.values,
-                                 "minimum": minimum.values,
-                                 "maximum": maximum.values})
-
-    median_array = da.groupby("time.dayofyear").median()
-    day_of_year = median_array.dayofyear.values
-    cds_median = ColumnDataSource({"day_of_year": day_of_year, "median": median_array.values})
-
-    return {"cds_span": cds_span, "cds_median": cds_median}
-
-
-def calculate_individual_years(da, da_interpolated):
-    da_converted = da.convert_calendar("all_leap")
+def find_decades(years):
+    """Group the years into decades labelled by the start of the decade, e.g. "1990s". The years before the first
+    complete decade are included in it, so that the first decade of the data is 1978-1989. The last decade is included
+    even if it has not ended yet."""
+    years = np.asarray(years).astype(int)
+    decade_starts = years // 10 * 10
+    if years[0] % 10 != 0 and decade_starts[-1] != decade_starts[0]:
+        decade_starts[decade_starts == decade_starts[0]] += 10
+
+    return {f"{start}s": years[decade_starts == start].astype(str) for start in np.unique(decade_starts)}
+
+
+@metrics.timed
+def calculate_decadal_span_and_median(da_converted, day_of_year_index):
+    # The data must be the interpolated data in an all_leap calendar, so that every year has 366 days.
+    decades = find_decades(day_of_year_index.years)
+
+    # Arrange the index values in a decade x year in decade x day of year array, with NaN for the days without data,
+    # so that the span and median of all decades are calculated in one pass instead of grouping each decade by day.
+    grid = day_of_year_index.to_grid(da_converted.values)
+    decadal_grid = np.full((len(decades), max(len(decade_years) for decade_years in decades.values()), 366), np.nan)
+    for i, decade_years in enumerate(decades.values()):
+        start = int(decade_years[0]) - day_of_year_index.years[0]
+        decadal_grid[i, :len(decade_years)] = grid[start:start + len(decade_years)]
+
+    # Days without data in a decade that has just started are NaN, and leave gaps in the curves.
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        minimum = np.nanmin(decadal_grid, axis=1)
+        maximum = np.nanmax(decadal_grid, axis=1)
+        median = np.nanmedian(decadal_grid, axis=1)
+
+    all_days = np.arange(1, 367)
+    decadal_dict = {}
+    for i, decade in enumerate(decades):
+        cds_span = ColumnDataSource({"day_of_year": all_days, "minimum": minimum[i], "maximum": maximum[i]})
+        cds_median = ColumnDataSource({"day_of_year": all_days, "median": median[i]})
+        decadal_dict[decade] = {"cds_span": cds_span, "cds_median": cds_median}
+
+    return decadal_dict
+
+
+def _stack_series(series):
+    """Stack several series of interpolated daily data in an all_leap calendar, given with their day of year index, in
+    a series x year x day of year array with NaN for the days without data. Returns the years, the array, a mask of
+    the days that are in the data, i.e. not interpolated, and the year offset of each series in the array."""
+    first_year = min(day_of_year_index.years[0] for _, day_of_year_index in series.values())
+    years = np.arange(first_year, max(day_of_year_index.years[-1] for _, day_of_year_index in series.values()) + 1)
+    grid = np.full((len(series), len(years), 366), np.nan)
+    observed = np.zeros(grid.shape, dtype=bool)
+    offsets = np.zeros(len(series), dtype=int)
+    for i, (da_converted, day_of_year_index) in enumerate(series.values()):
+        offsets[i] = day_of_year_index.years[0] - first_year
+        grid[i, offsets[i]:offsets[i] + len(day_of_year_index.years)] = day_of_year_index.to_grid(da_converted.values)
+        observed[i, offsets[i]:offsets[i] + len(day_of_year_index.years)].flat[day_of_year_index.positions] = True
+
+    return years, grid, observed, offsets
+
+
+@metrics.timed
+def compare_areas(series, start_year, end_year):
+    """Compare the last year of the daily data of several areas with the reference period of each area. The series
+    are given by area as the interpolated data in an all_leap calendar and its day of year index. Returns a
+    ColumnDataSource by area with the values of the last year, their anomalies relative to the mean of the reference
+    period, and their percentiles among the values of the reference period on the same day of year."""
+    # Stack the data of all areas, so that the statistics of all areas are calculated in one pass.
+    years, grid, observed, _ = _stack_series(series)
+
+    # The interpolated days, i.e. February 29th of a year that is not a leap year, are used for the reference period
+    # like in the percentiles of the daily app, but are not shown for the last year.
+    i, j = np.searchsorted(years, int(start_year)), np.searchsorted(years, int(end_year), side="right")
+    reference = grid[:, i:j]
+    values = np.where(observed[:, -1], grid[:, -1], np.nan)[:, np.newaxis]
+
+    # The mean is found from cumulative sums like in ReferenceBaselines, so that the anomalies are the same as in the
+    # daily app.
+    valid = ~np.isnan(grid)
+    cumulative_sum = np.concatenate([np.zeros((len(series), 1, 366)), np.cumsum(np.where(valid, grid, 0), axis=1)],
+                                    axis=1)
+    cumulative_count = np.concatenate([np.zeros((len(series), 1, 366), dtype=int), np.cumsum(valid, axis=1)], axis=1)
+    count = cumulative_count[:, j] - cumulative_count[:, i]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        anomalies = values[:, 0] - (cumulative_sum[:, j] - cumulative_sum[:, i]) / count
+        # The share of the reference values that are below the value, counting equal values as half.
+        percentiles = 100 * (np.sum(reference < values, axis=1) + 0.5 * np.sum(reference == values, axis=1)) / count
+    percentiles[np.isnan(values[:, 0])] = np.nan
+
+    # The dates of the last year, where February 29th is never shown if it's not a leap year.
+    dates = np.array([f"{years[-1]}-{month_day}" for month_day in
+                      format_dates(np.arange("2000-01-01", "2001-01-01", dtype="datetime64[D]"), "%m-%d")])
+
+    return {area: ColumnDataSource({"day_of_year": np.arange(1, 367),
+                                    "date": dates,
+                                    "index_values": values[i, 0],
+                                    "anomaly": anomalies[i],
+                                    "percentile": percentiles[i]})
+            for i, area in enumerate(series)}
+
+
+@metrics.timed
+def summarize_areas(series, start_year, end_year):
+    """Summarize the latest day of the daily data of several series, e.g. of all areas and indices, in one pass. The
+    series are given like in compare_areas. Returns a ColumnDataSource with one row per series with the date and value
+    of the latest day, its anomaly relative to the mean of the reference period, its rank among all years on the same
+    day of year (1 is the lowest, NaN if the value is missing), and the record low and high of that day of year before
+    the latest year."""
+    years, grid, _, offsets = _stack_series(series)
+    rows = np.arange(len(series))
+
+    # The year and day of year of the latest day of each series, which can differ between the series.
+    year_index = offsets + np.array([day_of_year_index.year_index[-1] for _, day_of_year_index in series.values()])
+    doy_index = np.array([day_of_year_index.doy_index[-1] for _, day_of_year_index in series.values()])
+
+    # All years of the day of year of the latest day, as a series x year array.
+    day = grid[rows, :, doy_index]
+    valid = ~np.isnan(day)
+    values = day[rows, year_index]
+
+    # The mean of the reference period is found from cumulative sums like in ReferenceBaselines, so that the anomalies
+    # are the same as in the daily app.
+    i, j = np.searchsorted(years, int(start_year)), np.searchsorted(years, int(end_year), side="right")
+    cumulative_sum = np.concatenate([np.zeros((len(series), 1)), np.cumsum(np.where(valid, day, 0), axis=1)], axis=1)
+    cumulative_count = np.concatenate([np.zeros((len(series), 1), dtype=int), np.cumsum(valid, axis=1)], axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        anomalies = values - (cumulative_sum[:, j] - cumulative_sum[:, i]) / (cumulative_count[:, j] -
+                                                                               cumulative_count[:, i])
+
+    # The rank is the average rank of equal values like in calculate_individual_years. A missing latest value has no
+    # rank, instead of the rank 0.5 of a value that is neither lower than nor equal to any other value.
+    rank = (np.sum(day < values[:, np.newaxis], axis=1)
+            + (np.sum(day == values[:, np.newaxis], axis=1) + 1) / 2)
+    rank = np.where(np.isnan(values), np.nan, rank)
+
+    # The records are found among the years before the latest year, like the minimum and maximum in calculate_min_max.
+    # The records are NaN, and their years 0, if there are no earlier years.
+    before = valid & (np.arange(len(years)) < year_index[:, np.newaxis])
+    any_before = before.any(axis=1)
+    record_low_index = np.argmin(np.where(before, day, np.inf), axis=1)
+    record_high_index = np.argmax(np.where(before, day, -np.inf), axis=1)
+
+    # The dates are formatted from an all_leap template, since the latest day is always in the data.
+    month_days = format_dates(np.arange("2000-01-01", "2001-01-01", dtype="datetime64[D]"), "%m-%d")
+
+    return ColumnDataSource({"date": np.array([f"{years[year]}-{month_days[doy]}"
+                                               for year, doy in zip(year_index, doy_index)], dtype=object),
+                             "index_values": values,
+                             "anomaly": anomalies,
+                             "rank": rank,
+                             "years": valid.sum(axis=1),
+                             "record_low": np.where(any_before, day[rows, record_low_index], np.nan),
+                             "record_low_year": np.where(any_before, years[record_low_index], 0),
+                             "record_high": np.where(any_before, day[rows, record_high_index], np.nan),
+                             "record_high_year": np.where(any_before, years[record_high_index], 0)})
+
+
+@metrics.timed
+def calculate_individual_years(da_converted, da_interpolated):
+    # The data must be converted to an all_leap calendar.
     years = get_list_of_years(da_converted)
 
     # Calculate the rank of the index value for each day.
@@ -103,7 +389,7 @@ def calculate_individual_years(da, da_interpolated):
     cds_dict = {year: None for year in years}
     for year in years:
         one_year_data = da_converted.sel(time=year)
-        date = one_year_data.time.dt.strftime("%Y-%m-%d").values
+        date = format_dates(one_year_data.time)
         day_of_year = one_year_data.time.dt.dayofyear.values
         index_values = one_year_data.values
         rank_values = rank.sel(time=one_year_data.time.values).values
@@ -115,6 +401,7 @@ def calculate_individual_years(da, da_interpolated):
     return cds_dict
 
 
+@metrics.timed
 def calculate_monthly(da, month_offset=True):
     # Find which months are in the data.
     months = np.unique(da.time.dt.month)
@@ -145,6 +432,7 @@ def calculate_monthly(da, month_offset=True):
     return cds_monthly_dict
 
 
+@metrics.timed
 def calculate_all_months(da):
     # Create a ColumnDataSource for plotting the line with all months in the monthly plot.
 
@@ -209,6 +497,7 @@ class Trends:
 
         return year, trend_line_values, absolute_trend, relative_trend
 
+    @metrics.timed
     def calculate_monthly_trend(self):
         da = self.da
 
@@ -231,11 +520,12 @@ class Trends:
 
         return monthly_trends
 
-    def calculate_decadal_trend(self, edge_padding):
+    @metrics.timed
+    def calculate_decadal_trend(self, edge_padding, months=None):
         da = self.da
 
         monthly_trends = {}
-        for month in self.months:
+        for month in self.months if months is None else months:
             month_subset = da.sel(time=da.time.dt.month.isin(month))
             reference_subset = month_subset.sel(time=slice(self.reference_period_start, self.reference_period_end))
 
@@ -263,7 +553,8 @@ class Trends:
         return monthly_trends
 
 
-def find_yearly_min_max(da_converted, da_converted_anomaly, fill_colors_dict):
+@metrics.timed
+def find_yearly_min_max(da_converted, da_converted_anomaly, fill_colors_dict=None):
     # Find the years we have data for, except the current one. Select the data from those years and group it by year.
     years = get_list_of_years(da_converted)[:-1].tolist()
 
@@ -276,21 +567,18 @@ def find_yearly_min_max(da_converted, da_converted_anomaly, fill_colors_dict):
     da_sliced_and_grouped = da_converted.sel(time=slice(years[0], years[-1])).groupby("time.year")
 
     # Find the yearly max/min date, day of year, and index value.
-    yearly_max_date = da_sliced_and_grouped.apply(lambda x: x.idxmax(dim="time"))
+    yearly_max_date = da_sliced_and_grouped.map(lambda x: x.idxmax(dim="time"))
     yearly_max_doy = da_converted.sel(time=yearly_max_date).time.dt.dayofyear
 
-    yearly_min_date = da_sliced_and_grouped.apply(lambda x: x.idxmin(dim="time"))
+    yearly_min_date = da_sliced_and_grouped.map(lambda x: x.idxmin(dim="time"))
     yearly_min_doy = da_converted.sel(time=yearly_min_date).time.dt.dayofyear
 
     yearly_max_index_value = da_converted_anomaly.sel(time=yearly_max_date)
     yearly_min_index_value = da_converted_anomaly.sel(time=yearly_min_date)
 
-    # Use the same colours as the lines of the individual years.
-    colors = [fill_colors_dict[year] for year in years]
-
     # Convert the max/min date to a string for use in hovertool display.
-    hovertool_max_date = yearly_max_date.dt.strftime("%Y-%m-%d")
-    hovertool_min_date = yearly_min_date.dt.strftime("%Y-%m-%d")
+    hovertool_max_date = format_dates(yearly_max_date)
+    hovertool_min_date = format_dates(yearly_min_date)
 
     # Find the rank of the max/min values. The ranks are such that the lowest value for both min and max has a rank
     # of 1.
@@ -299,18 +587,27 @@ def find_yearly_min_max(da_converted, da_converted_anomaly, fill_colors_dict):
 
     cds_yearly_max = ColumnDataSource({"day_of_year": yearly_max_doy.values,
                                        "index_value": yearly_max_index_value.values,
-                                       "color": colors,
-                                       "date": hovertool_max_date.values,
+                                       "date": hovertool_max_date,
                                        "rank": yearly_max_rank.values})
     cds_yearly_min = ColumnDataSource({"day_of_year": yearly_min_doy.values,
                                        "index_value": yearly_min_index_value.values,
-                                       "color": colors,
-                                       "date": hovertool_min_date.values,
+                                       "date": hovertool_min_date,
                                        "rank": yearly_min_rank.values})
 
+    if fill_colors_dict is not None:
+        # Use the same colours as the lines of the individual years.
+        colors = [fill_colors_dict[year] for year in years]
+        cds_yearly_max.data["color"] = colors
+        cds_yearly_min.data["color"] = colors
+
     return cds_yearly_max, cds_yearly_min
 
 
+def yearly_min_max_colors(yearly_data, colors_dict):
+    # Use the same colours for the yearly min/max values as the lines of the individual years.
+    return [colors_dict[date[:4]] for date in yearly_data["date"]]
+
+
 def find_nice_yrange(monthly_data, trend_data, padding_mult, min_span):
     """Function to find a nice y-range that is not too narrow."""
     all_monthly_data = np.concatenate((monthly_data, trend_data))
@@ -333,76 +630,105 @@ def find_nice_yrange(monthly_data, trend_data, padding_mult, min_span):
     return monthly_min, monthly_max
 
 
+# The colour tables of the matplotlib and cmcrameri colour maps, written by make_palettes.py. The apps look up the
+# colours in the tables like matplotlib does, so they don't need to import matplotlib and cmcrameri.
+PALETTES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "palettes.json")
+
+# The colour maps of the individual years. The colours of the sequential colour maps are evenly spaced over the whole
+# colour map, and the cyclic colours are repeated.
+SEQUENTIAL_COLOR_MAPS = ["viridis", "viridis_r", "plasma", "plasma_r", "batlow", "batlow_r", "batlowS"]
+
+CYCLIC_COLORS = {"cyclic_8": ["#ffe119", "#4363d8", "#f58231", "#dcbeff", "#800000", "#000075", "#a9a9a9", "#000000"],
+                 "cyclic_17": ["#e6194B",
+                               "#3cb44b",
+                               "#ffe119",
+                               "#4363d8",
+                               "#f58231",
+                               "#42d4f4",
+                               "#f032e6",
+                               "#fabed4",
+                               "#469990",
+                               "#dcbeff",
+                               "#9A6324",
+                               "#fffac8",
+                               "#800000",
+                               "#aaffc3",
+                               "#000075",
+                               "#a9a9a9",
+                               "#000000"]}
+
+# The colour maps of the decades in the custom decadal colour map.
+DECADAL_COLOR_MAPS = {1970: "Purples_r",
+                      1980: "Purples_r",
+                      1990: "Blues_r",
+                      2000: "Greens_r",
+                      2010: "Reds_r",
+                      2020: "Wistia_r"}
+
+LINE_COLORS = [*SEQUENTIAL_COLOR_MAPS, "decadal", *CYCLIC_COLORS]
+
+
+@functools.lru_cache(maxsize=None)
+def _palette_tables():
+    with open(PALETTES_PATH) as f:
+        return json.load(f)
+
+
+def colormap_colors(color, values):
+    """Return the hex colours of a colour map at values between 0 and 1. The colour table has N colours, and the
+    value is mapped to a colour like matplotlib does, i.e. by truncating value * N."""
+    table = _palette_tables()[color]
+    indices = np.clip((np.asarray(values, dtype=float) * len(table)).astype(int), 0, len(table) - 1)
+    return [table[i] for i in indices]
+
+
 def decade_color_dict(decade, color):
     # Don't use the full breadth of the colormap, only go up till middle (halfway) to avoid the light colors.
     normalisation = np.linspace(0, 0.5, 10)
-    normalised_color = [matplotlib.colors.to_hex(color) for color in color(normalisation)]
+    normalised_color = colormap_colors(color, normalisation)
     years_in_decade = np.arange(decade, decade + 10, 1).astype(str)
 
     return {year: year_color for year, year_color in zip(years_in_decade, normalised_color)}
 
 
-def find_line_colors(years, color):
-    """Find a colors for the individual years."""
+@functools.lru_cache(maxsize=None)
+def _sequential_palette(color, number_of_years):
+    # The palettes are memoized by colour map and number of years, so the colours are only looked up once. The colours
+    # of a year only depend on its position among the years.
+    return tuple(colormap_colors(color, np.linspace(0, 1, number_of_years)))
 
+
+@functools.lru_cache(maxsize=None)
+def _decadal_palette():
+    # The colours of all years of the custom decadal colour map, which don't depend on the years of the data.
+    full_color_dict = {}
+    for decade, color in DECADAL_COLOR_MAPS.items():
+        full_color_dict.update(decade_color_dict(decade, color))
+
+    return full_color_dict
+
+
+def warm_palettes(years):
+    """Evaluate the colour maps of the years, and of the years except the current year, for all colour maps, so that
+    no session has to evaluate them."""
+    for color in LINE_COLORS:
+        find_line_colors(years, color)
+        find_line_colors(years[:-1], color)
+
+
+@metrics.timed
+def find_line_colors(years, color):
+    """Find a colors for the individual years. The colours are looked up in palettes that are only evaluated once per
+    process."""
     if color == "decadal":
-        decades = [1970, 1980, 1990, 2000, 2010, 2020]
-        colors = [matplotlib.cm.Purples_r,
-                   matplotlib.cm.Purples_r,
-                   matplotlib.cm.Blues_r,
-                   matplotlib.cm.Greens_r,
-                   matplotlib.cm.Reds_r,
-                   matplotlib.cm.Wistia_r]
-
-        full_color_dict = {}
-
-        for decade, color in zip(decades, colors):
-            decade_dict = decade_color_dict(decade, color)
-            full_color_dict.update(decade_dict)
-
-        color_dict = {year: full_color_dict[year] for year in years}
-
-    elif color == "cyclic_8":
-        colors = ["#ffe119", "#4363d8", "#f58231", "#dcbeff", "#800000", "#000075", "#a9a9a9", "#000000"]
-
-        cyclic_colors = itertools.cycle(colors)
-        color_dict = {year: next(cyclic_colors) for year in years}
-
-    elif color == "cyclic_17":
-        colors = ["#e6194B",
-                  "#3cb44b",
-                  "#ffe119",
-                  "#4363d8",
-                  "#f58231",
-                  "#42d4f4",
-                  "#f032e6",
-                  "#fabed4",
-                  "#469990",
-                  "#dcbeff",
-                  "#9A6324",
-                  "#fffac8",
-                  "#800000",
-                  "#aaffc3",
-                  "#000075",
-                  "#a9a9a9",
-                  "#000000"]
-
-        cyclic_colors = itertools.cycle(colors)
-        color_dict = {year: next(cyclic_colors) for year in years}
+        decadal_palette = _decadal_palette()
+        color_dict = {year: decadal_palette[year] for year in years}
+
+    elif color in CYCLIC_COLORS:
+        color_dict = {year: year_color for year, year_color in zip(years, itertools.cycle(CYCLIC_COLORS[color]))}
 
     else:
-        translation_dictionary = {"viridis": matplotlib.cm.viridis,
-                                  "viridis_r": matplotlib.cm.viridis_r,
-                                  "plasma": matplotlib.cm.plasma,
-                                  "plasma_r": matplotlib.cm.plasma_r,
-                                  "batlow": cm.batlow,
-                                  "batlow_r": cm.batlow_r,
-                                  "batlowS": cm.batlowS}
-
-        normalised = np.linspace(0, 1, len(years))
-        colors = translation_dictionary[color](normalised)
-        colors_in_hex = [matplotlib.colors.to_hex(color) for color in colors]
-        color_dict = {year: color for year, color in zip(years, colors_in_hex)}
+        color_dict = {year: year_color for year, year_color in zip(years, _sequential_palette(color, len(years)))}
 
     return color_dict
 
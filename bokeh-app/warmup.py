@@ -0,0 +1,6 @@
+# Setup script that is run by "panel serve --setup" when the server starts. The data and derived products of all
+# datasets are downloaded and calculated in the background, so that the first visitor of each dataset does not have
+# to wait for it. The server reports itself as ready on the /ready endpoint once the warmup has finished.
+import products as pr
+
+pr.start_warmup()
@@ -1,2 +1,14 @@
 #!/bin/bash
-panel serve --port ${PORT} --address 0.0.0.0 --log-level ${LOG_LEVEL} /bokeh-app/daily /bokeh-app/monthly
+
+# Warm up the cache of data and derived products when the server starts, unless disabled with WARMUP=false.
+if [ "${WARMUP:-true}" = "true" ]; then
+    SETUP_ARGS="--setup /bokeh-app/warmup.py"
+fi
+
+panel serve /bokeh-app/daily /bokeh-app/monthly /bokeh-app/compare /bokeh-app/summary \
+    --port ${PORT} \
+    --address 0.0.0.0 \
+    --log-level ${LOG_LEVEL} \
+    --num-procs ${NUM_PROCS:-1} \
+    --plugins routes \
+    ${SETUP_ARGS}
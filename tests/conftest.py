@@ -0,0 +1,36 @@
+import os
+import sys
+import pytest
+
+# The apps import their modules from bokeh-app, and the synthetic data is shared with the benchmarks.
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "bokeh-app"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+import products as pr  # noqa: E402
+import synthetic  # noqa: E402
+
+
+@pytest.fixture
+def synthetic_data(monkeypatch):
+    """Serve synthetic datasets instead of opening them on the data server, with empty caches and the products
+    calculated in the test process."""
+    datasets = {}
+
+    def get_data(index, area, frequency, version):
+        if (index, area, frequency, version) not in datasets:
+            datasets[(index, area, frequency, version)] = synthetic.create_extracted_data(index,
+                                                                                           area,
+                                                                                           frequency,
+                                                                                           version,
+                                                                                           end="2024-06-30")
+        return datasets[(index, area, frequency, version)]
+
+    get_data.cached_value = lambda *key: datasets.get(key)
+    get_data.clear = datasets.clear
+    monkeypatch.setattr(pr, "get_data", get_data)
+    monkeypatch.delenv("PRODUCT_CACHE_DIR", raising=False)
+    monkeypatch.delenv("COMPUTE_PROCESSES", raising=False)
+    pr.clear_caches()
+    yield
+    pr.clear_caches()
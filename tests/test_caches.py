@@ -0,0 +1,98 @@
+"""The memory caches of the datasets and products, which are listed in the memory report of the server."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import products as pr
+
+
+def test_least_recently_used_entries_are_removed(monkeypatch):
+    monkeypatch.setattr(pr, "_caches", {})
+    calls = []
+
+    @pr._cached(max_items=2)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert [square(1), square(2), square(1), square(3), square(1), square(2)] == [1, 4, 1, 9, 1, 4]
+    # 2 was the least recently used entry when 3 was added, so it was calculated again.
+    assert calls == [1, 2, 3, 2]
+    assert [entry["value"] for entry in square.entries()] == [1, 4]
+
+    square.clear()
+    assert square.entries() == []
+
+
+def test_cached_value_does_not_calculate(monkeypatch):
+    monkeypatch.setattr(pr, "_caches", {})
+    calls = []
+
+    @pr._cached(ttl=0.2)
+    def square(x):
+        calls.append(x)
+        return x * x
+
+    assert square.cached_value(2) is None
+    assert square(2) == 4
+    assert square.cached_value(2) == 4
+    assert square.entries()[0]["hits"] == 1
+
+    # An expired entry is not returned.
+    time.sleep(0.3)
+    assert square.cached_value(2) is None
+    assert calls == [2]
+
+
+def test_concurrent_requests_calculate_once(monkeypatch):
+    monkeypatch.setattr(pr, "_caches", {})
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    @pr._cached()
+    def slow(x):
+        calls.append(x)
+        started.set()
+        release.wait(10)
+        if x < 0:
+            raise ValueError("negative")
+        return object()
+
+    for x in [1, -1]:
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(slow, x)]
+            started.wait(10)
+            futures += [executor.submit(slow, x) for _ in range(3)]
+            # Give the other threads time to ask for the entry while it's being calculated.
+            time.sleep(0.2)
+            release.set()
+
+            if x > 0:
+                # All threads get the same object from the one calculation.
+                assert len({id(future.result()) for future in futures}) == 1
+            else:
+                # The failure is shared with the waiting threads, and is not cached.
+                for future in futures:
+                    with pytest.raises(ValueError):
+                        future.result()
+
+        started.clear()
+        release.clear()
+
+    assert calls == [1, -1]
+    release.set()
+    with pytest.raises(ValueError):
+        slow(-1)
+    assert calls == [1, -1, -1]
+
+
+def test_cache_entries_include_all_caches(synthetic_data):
+    pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", "absolute")
+    pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", "absolute")
+
+    entries = {entry["cache"]: entry for entry in pr.cache_entries()}
+    assert {"_get_daily_products", "_get_baselines", "_get_reference_products"} <= set(entries)
+    assert entries["_get_reference_products"]["hits"] == 1
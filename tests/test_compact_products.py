@@ -0,0 +1,61 @@
+"""COMPACT_PRODUCTS stores the products in float32, which must not change the values that are shown or the ranks."""
+import itertools
+import numpy as np
+
+import products as pr
+
+
+def shown(values, decimals):
+    # The integers that BokehJS rounds to when formatting the values with e.g. {0.000}, i.e. Math.round, which rounds
+    # half up, of the values as float64.
+    scaled = np.asarray(values, dtype=np.float64) * 10**decimals
+    rounded = np.floor(scaled)
+    return rounded + ((scaled - rounded) >= 0.5)
+
+
+def product_tables(monkeypatch, compact):
+    # The mode is read when the products are calculated, so the caches are cleared when it's changed.
+    monkeypatch.setattr(pr, "COMPACT_PRODUCTS", compact)
+    pr.clear_caches()
+
+    tables = {}
+    for index, reference_period in itertools.product(pr.INDICES, pr.REFERENCE_PERIODS):
+        for plot_type in pr.PLOT_TYPES:
+            tables[(index, reference_period, "daily", plot_type)] = pr.get_product_tables(index,
+                                                                                          "nh",
+                                                                                          "v2p2",
+                                                                                          "daily",
+                                                                                          reference_period,
+                                                                                          plot_type)
+        tables[(index, reference_period, "monthly")] = pr.get_product_tables(index,
+                                                                             "nh",
+                                                                             "v2p2",
+                                                                             "monthly",
+                                                                             reference_period)
+
+    return tables
+
+
+def shown_columns(tables):
+    # The columns that are shown in the hovertools, with the shown decimals, and the ranks.
+    for key, selection_tables in tables.items():
+        for table, columns in selection_tables.items():
+            for column, values in columns.items():
+                if column in pr.DISPLAYED_DECIMALS or column == "rank":
+                    yield (*key, table, column), values
+
+
+def test_compact_products_show_the_same_values_and_ranks(synthetic_data, monkeypatch):
+    default = dict(shown_columns(product_tables(monkeypatch, False)))
+    compact = dict(shown_columns(product_tables(monkeypatch, True)))
+
+    assert default.keys() == compact.keys()
+    assert any(column == "rank" for *_, column in default)
+    for key, values in default.items():
+        # The compact columns must be stored in float32, otherwise the test doesn't test anything.
+        assert compact[key].dtype == np.float32, key
+        if key[-1] == "rank":
+            np.testing.assert_array_equal(compact[key].astype(np.float64), values, err_msg=str(key))
+        else:
+            decimals = pr.DISPLAYED_DECIMALS[key[-1]]
+            np.testing.assert_array_equal(shown(compact[key], decimals), shown(values, decimals), err_msg=str(key))
@@ -0,0 +1,106 @@
+"""COMPUTE_PROCESSES calculates the products in worker processes, which return them in shared memory blocks."""
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+import pytest
+import xarray as xr
+
+import products as pr
+import toolkit as tk
+
+
+@pytest.fixture
+def compute_process(synthetic_data, monkeypatch):
+    """Calculate the products in one worker process, which is stopped after the test."""
+    monkeypatch.setenv("COMPUTE_PROCESSES", "1")
+    monkeypatch.setattr(pr, "_process_pool", None)
+    yield
+    if pr._process_pool is not None:
+        pr._process_pool.shutdown()
+
+
+def shared_memory_blocks():
+    # The shared memory blocks that are created by the multiprocessing module on Linux.
+    return {name for name in os.listdir("/dev/shm") if name.startswith("psm_")}
+
+
+def assert_same_products(products, expected, path=()):
+    if isinstance(expected, dict):
+        assert products.keys() == expected.keys(), path
+        for key, value in expected.items():
+            assert_same_products(products[key], value, (*path, key))
+    elif isinstance(expected, xr.DataArray):
+        xr.testing.assert_identical(products, expected)
+    elif isinstance(expected, np.ndarray):
+        assert products.dtype == expected.dtype, path
+        np.testing.assert_array_equal(products, expected, err_msg=str(path))
+    elif isinstance(expected, tk.DayOfYearIndex):
+        assert_same_products(vars(products), vars(expected), path)
+    else:
+        assert products == expected, path
+
+
+def calculate_products():
+    return {plot_type: pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", plot_type)
+            for plot_type in pr.PLOT_TYPES}
+
+
+def fail():
+    raise ValueError("failed in the worker")
+
+
+def test_products_of_the_worker_are_the_same(compute_process, monkeypatch):
+    blocks = shared_memory_blocks()
+    products = calculate_products()
+    assert pr._process_pool is not None
+
+    monkeypatch.delenv("COMPUTE_PROCESSES")
+    pr.clear_caches()
+    assert_same_products(products, calculate_products())
+
+    # The blocks of the worker have been released.
+    assert shared_memory_blocks() == blocks
+
+
+def test_failure_in_the_worker_is_raised(compute_process):
+    blocks = shared_memory_blocks()
+    with pytest.raises(ValueError, match="failed in the worker"):
+        pr._compute(fail)
+
+    assert shared_memory_blocks() == blocks
+
+
+def test_shared_memory_is_released():
+    products = {"values": np.arange(10.0), "nested": {"years": np.arange(1978, 2025)}, "name": "nh"}
+
+    name, structure = pr._pack(products)
+    assert name in shared_memory_blocks()
+    assert_same_products(pr._unpack((name, structure)), products)
+    assert name not in shared_memory_blocks()
+
+    # The block is released even if the products can't be restored from it.
+    name, structure = pr._pack(products)
+    structure["values"] = pr.SharedArray(0, "<f8", (1000,))
+    with pytest.raises(TypeError):
+        pr._unpack((name, structure))
+    assert name not in shared_memory_blocks()
+
+
+def test_shared_memory_is_released_if_it_cannot_be_written(monkeypatch):
+    created = []
+
+    class UnwritableSharedMemory(shared_memory.SharedMemory):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            created.append(self.name)
+
+        @property
+        def buf(self):
+            raise MemoryError("cannot be written")
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", UnwritableSharedMemory)
+    with pytest.raises(MemoryError):
+        pr._pack({"values": np.arange(10.0)})
+
+    assert created and created[0] not in shared_memory_blocks()
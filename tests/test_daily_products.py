@@ -0,0 +1,47 @@
+"""The derived products of the daily app, compared with calculating them directly from the data."""
+import numpy as np
+import pytest
+import xarray as xr
+
+import products as pr
+
+
+def calculate_anomaly_products_directly(da, reference_period):
+    # The anomalies are found by grouping the converted data by day of year and subtracting the mean of the reference
+    # period, and the products are calculated from them like the absolute products.
+    da_converted = pr.calculate_daily_products(da)["da_converted"]
+    start_year, end_year = reference_period.split("-")
+    mean = da_converted.sel(time=slice(start_year, end_year)).groupby("time.dayofyear").mean()
+    da_converted_anomaly = da_converted.groupby("time.dayofyear") - mean
+    da_leap_anomaly = da.convert_calendar("all_leap").groupby("time.dayofyear") - mean
+
+    return {**pr._calculate_derived_products(da_leap_anomaly, da_converted_anomaly, da_converted),
+            "da": da_leap_anomaly}
+
+
+def product_values(products, path=()):
+    # All the values of the products by their path, except the dataset and the day of year index.
+    for key, value in products.items():
+        if key in ["extracted_data", "day_of_year_index"]:
+            continue
+        if isinstance(value, dict):
+            yield from product_values(value, (*path, key))
+        else:
+            yield (*path, key), value.values if isinstance(value, xr.DataArray) else np.asarray(value)
+
+
+@pytest.mark.parametrize("reference_period", ["1981-2010", "1985-1995", "2024-2030"])
+def test_anomaly_products_match_the_direct_calculation(synthetic_data, reference_period):
+    # The absolute products are cached first, like when the plot type is changed in the app.
+    pr.get_daily_products("sie", "nh", "v2p2", reference_period, "absolute")
+    products = dict(product_values(pr.get_daily_products("sie", "nh", "v2p2", reference_period, "anomaly")))
+
+    da = pr.get_data("sie", "nh", "daily", "v2p2")["da"]
+    expected = dict(product_values(calculate_anomaly_products_directly(da, reference_period)))
+
+    assert expected.keys() <= products.keys()
+    for key, values in expected.items():
+        if values.dtype.kind == "f":
+            np.testing.assert_allclose(products[key], values, rtol=1e-12, atol=1e-12, err_msg=str(key))
+        else:
+            np.testing.assert_array_equal(products[key], values, err_msg=str(key))
@@ -0,0 +1,124 @@
+"""The on-disk cache is shared by all server processes, and only holds the products of the standard reference
+periods."""
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pytest
+
+import products as pr
+
+# The processes are started like the worker processes of the server, so they only share the cache directory.
+SPAWN = multiprocessing.get_context("spawn")
+
+
+def stored_names(cache_dir):
+    # The names of the entries without the hash of the dataset stamp.
+    return sorted(path.name.rsplit("_", 1)[0] for path in cache_dir.glob("*.products"))
+
+
+def test_only_standard_reference_periods_are_stored(synthetic_data, monkeypatch, tmp_path):
+    monkeypatch.setenv("PRODUCT_CACHE_DIR", str(tmp_path))
+
+    standard = pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", "anomaly")
+    entered = pr.get_daily_products("sie", "nh", "v2p2", "1985-1999", "anomaly")
+    pr.get_monthly_products("sie", "nh", "v2p2", "1985-1999", False)
+
+    assert stored_names(tmp_path) == ["daily_v2p2_nh_sie_1981-2010_anomaly", "daily_v2p2_nh_sie_None_absolute"]
+
+    # The anomalies of an entered period are still calculated from the mean of that period.
+    assert not np.allclose(standard["da"].values, entered["da"].values)
+
+
+def calculate_slowly(calls_dir):
+    # Record which process calculated the products, and take long enough that the other processes ask for them in the
+    # meantime.
+    with open(os.path.join(calls_dir, "calls"), "a") as f:
+        f.write(f"{os.getpid()}\n")
+    time.sleep(1)
+    return {"values": np.arange(1000.0), "name": "race"}
+
+
+def compete(cache_dir, calls_dir, barrier, results):
+    os.environ["PRODUCT_CACHE_DIR"] = cache_dir
+    barrier.wait()
+    products = pr._load_or_compute("race", "stamp", calculate_slowly, calls_dir)
+    results.put((products["values"].sum(), products["name"]))
+
+
+def crash_while_writing(cache_dir, calls_dir):
+    # The process dies after writing the temporary file, before it's renamed to the entry.
+    os.environ["PRODUCT_CACHE_DIR"] = cache_dir
+    os.replace = lambda *args: os._exit(1)
+    pr._load_or_compute("race", "stamp", calculate_slowly, calls_dir)
+
+
+def calls(calls_dir):
+    # The processes that have calculated the products, once for each time.
+    return (calls_dir / "calls").read_text().split()
+
+
+def cache_files(cache_dir):
+    return sorted(path.suffix for path in cache_dir.iterdir())
+
+
+def test_one_process_calculates_an_entry(tmp_path):
+    cache_dir = tmp_path / "cache"
+    calls_dir = tmp_path / "calls"
+    calls_dir.mkdir()
+    barrier = SPAWN.Barrier(4)
+    results = SPAWN.Queue()
+
+    processes = [SPAWN.Process(target=compete, args=(str(cache_dir), str(calls_dir), barrier, results))
+                 for _ in range(4)]
+    for process in processes:
+        process.start()
+    received = [results.get(timeout=60) for _ in processes]
+    for process in processes:
+        process.join(60)
+        assert process.exitcode == 0
+
+    # The other processes waited for the entry, and read it when it had been written.
+    assert len(calls(calls_dir)) == 1
+    assert received == [(np.arange(1000.0).sum(), "race")] * 4
+    assert cache_files(cache_dir) == [".lock", ".products"]
+
+
+def test_entry_of_a_crashed_writer_is_calculated_again(tmp_path, monkeypatch):
+    cache_dir = tmp_path / "cache"
+    calls_dir = tmp_path / "calls"
+    calls_dir.mkdir()
+
+    process = SPAWN.Process(target=crash_while_writing, args=(str(cache_dir), str(calls_dir)))
+    process.start()
+    process.join(60)
+    assert process.exitcode == 1
+    # The lock is released with the process, and the temporary file is left behind.
+    assert cache_files(cache_dir) == [".lock", ".tmp"]
+
+    monkeypatch.setenv("PRODUCT_CACHE_DIR", str(cache_dir))
+    products = pr._load_or_compute("race", "stamp", calculate_slowly, str(calls_dir))
+
+    assert products["name"] == "race"
+    assert len(calls(calls_dir)) == 2
+    assert cache_files(cache_dir) == [".lock", ".products"]
+
+
+@pytest.mark.parametrize("size", [0, 5, 100, -10])
+def test_truncated_entry_is_calculated_again(tmp_path, monkeypatch, size):
+    cache_dir = tmp_path / "cache"
+    calls_dir = tmp_path / "calls"
+    calls_dir.mkdir()
+    monkeypatch.setenv("PRODUCT_CACHE_DIR", str(cache_dir))
+    pr._load_or_compute("race", "stamp", calculate_slowly, str(calls_dir))
+
+    # The entry is cut at the given size, or the given number of bytes before its end.
+    path, = cache_dir.glob("*.products")
+    data = path.read_bytes()
+    path.write_bytes(data[:size])
+
+    products = pr._load_or_compute("race", "stamp", calculate_slowly, str(calls_dir))
+    np.testing.assert_array_equal(products["values"], np.arange(1000.0))
+    assert len(calls(calls_dir)) == 2
+    assert path.read_bytes() == data
@@ -0,0 +1,53 @@
+"""The pool of prebuilt figures of the daily app."""
+from types import SimpleNamespace
+
+import figures
+
+
+def pool_with_builds(size=2, max_selections=8):
+    builds = []
+
+    def build(products, name):
+        builds.append(name)
+        return SimpleNamespace(products=products, name=name)
+
+    return figures.FigurePool("test", build, size, max_selections), builds
+
+
+def wait_for_prebuilds(pool):
+    # The figures are prebuilt one at a time in the order they were requested.
+    pool._executor.submit(lambda: None).result()
+
+
+def test_figures_are_prebuilt_for_repeated_selections():
+    pool, builds = pool_with_builds()
+    products = {"da": object()}
+
+    # A selection that is opened once doesn't cost any figures in the background.
+    pool.take("a", products, "a")
+    pool.take("b", products, "b")
+    wait_for_prebuilds(pool)
+    assert builds == ["a", "b"]
+
+    # The second request of a selection is built in the session, and spares are prebuilt for the following ones.
+    pool.take("a", products, "a")
+    wait_for_prebuilds(pool)
+    assert builds == ["a", "b", "a", "a", "a"]
+
+    figure = pool.take("a", products, "a")
+    assert figure.products is products
+    wait_for_prebuilds(pool)
+    assert builds == ["a", "b", "a", "a", "a", "a"]
+    assert pool._pending == {}
+
+
+def test_figures_of_old_products_are_not_used():
+    pool, builds = pool_with_builds(size=1)
+    old_products = {"da": object()}
+    new_products = {"da": object()}
+
+    pool.take("a", old_products, "a")
+    pool.take("a", old_products, "a")
+    wait_for_prebuilds(pool)
+
+    assert pool.take("a", new_products, "a").products is new_products
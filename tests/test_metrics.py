@@ -0,0 +1,26 @@
+"""The timing metrics that are served on /metrics."""
+import re
+
+import metrics
+
+
+def test_render_is_a_consistent_snapshot(monkeypatch):
+    monkeypatch.setattr(metrics, "_histograms", {})
+    monkeypatch.setattr(metrics, "_counters", {})
+    metrics.observe("test", 0.1)
+
+    # Record another duration while the metrics are being rendered, like a session callback would do in another thread.
+    format_labels = metrics._format_labels
+
+    def format_labels_and_observe(key, extra=()):
+        if metrics._histograms[key][2] == 1:
+            metrics.observe("test", 0.1)
+        return format_labels(key, extra)
+
+    monkeypatch.setattr(metrics, "_format_labels", format_labels_and_observe)
+    text = metrics.render()
+
+    # The +Inf bucket counts all durations, so it's the same as the count in a consistent snapshot.
+    inf_bucket = re.search(r'_bucket\{stage="test",le="\+Inf"\} (\d+)', text)[1]
+    count = re.search(r'_count\{stage="test"\} (\d+)', text)[1]
+    assert inf_bucket == count == "1"
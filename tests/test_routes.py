@@ -0,0 +1,119 @@
+"""The extra routes of the server, which are added with "panel serve --plugins routes"."""
+import datetime
+import json
+import os
+import threading
+from email.utils import format_datetime, parsedate_to_datetime
+from unittest import mock
+from urllib.parse import urlencode
+
+import numpy as np
+import pyarrow as pa
+import pytest
+from tornado.testing import AsyncHTTPTestCase
+from tornado.web import Application
+
+import products as pr
+import routes
+
+
+class RoutesTestCase(AsyncHTTPTestCase):
+    """Serve the routes on their own, without the apps."""
+
+    def get_app(self):
+        return Application(routes.ROUTES)
+
+
+class ReadinessTest(RoutesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(pr, "warmup_ready", threading.Event())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_not_ready_until_the_warmup_has_finished(self):
+        with mock.patch.dict(os.environ, {"WARMUP": "true"}):
+            routes.mark_ready_without_warmup()
+        self.assertEqual(self.fetch("/ready").code, 503)
+
+        pr.warmup_ready.set()
+        self.assertEqual(self.fetch("/ready").code, 200)
+
+    def test_ready_without_warmup(self):
+        with mock.patch.dict(os.environ, {"WARMUP": "false"}):
+            routes.mark_ready_without_warmup()
+        self.assertEqual(self.fetch("/ready").code, 200)
+
+
+@pytest.mark.usefixtures("synthetic_data")
+class ProductsTest(RoutesTestCase):
+
+    def setUp(self):
+        super().setUp()
+        routes._encoded_products.clear()
+        self.addCleanup(routes._encoded_products.clear)
+        # The products are calculated before the requests, which time out after a few seconds in the tests.
+        self.tables = pr.get_product_tables("sie", "nh", "v2p2", "daily", "1981-2010", "absolute")
+
+    def fetch_products(self, headers=None, **arguments):
+        return self.fetch("/api/products?" + urlencode({"frequency": "daily", "index": "sie", "area": "nh",
+                                                        **arguments}),
+                          headers=headers)
+
+    def test_json(self):
+        response = self.fetch_products()
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/json")
+
+        body = json.loads(response.body)
+        self.assertEqual(body["reference_period"], "1981-2010")
+        self.assertEqual(body["type"], "absolute")
+        self.assertEqual(body["tables"].keys(), self.tables.keys())
+        for name, table in self.tables.items():
+            for column, values in table.items():
+                # NaN is written as null.
+                received = np.array([np.nan if value is None else value for value in body["tables"][name][column]])
+                np.testing.assert_array_equal(received, values, err_msg=f"{name} {column}")
+
+    def test_arrow(self):
+        response = self.fetch_products(format="arrow", table="climatology")
+        self.assertEqual(response.code, 200)
+        self.assertEqual(response.headers["Content-Type"], "application/vnd.apache.arrow.stream")
+
+        table = pa.ipc.open_stream(response.body).read_all()
+        self.assertEqual(table.schema.metadata[b"reference_period"], b"1981-2010")
+        self.assertEqual(table.column_names, list(self.tables["climatology"]))
+        for column, values in self.tables["climatology"].items():
+            np.testing.assert_array_equal(table[column].to_numpy(), values, err_msg=column)
+
+    def test_not_modified_if_none_match(self):
+        response = self.fetch_products()
+        etag = response.headers["Etag"]
+
+        response = self.fetch_products(headers={"If-None-Match": etag})
+        self.assertEqual(response.code, 304)
+        self.assertEqual(response.body, b"")
+
+        # Another selection has another ETag.
+        self.assertEqual(self.fetch_products(headers={"If-None-Match": etag}, type="anomaly").code, 200)
+
+    def test_not_modified_if_modified_since(self):
+        last_modified = parsedate_to_datetime(self.fetch_products().headers["Last-Modified"])
+
+        response = self.fetch_products(headers={"If-Modified-Since": format_datetime(last_modified, usegmt=True)})
+        self.assertEqual(response.code, 304)
+
+        # The data has been modified since the day before the last day of the data.
+        earlier = format_datetime(last_modified - datetime.timedelta(days=1), usegmt=True)
+        self.assertEqual(self.fetch_products(headers={"If-Modified-Since": earlier}).code, 200)
+
+    def test_invalid_selection(self):
+        for arguments in [{"area": "xyz"},
+                          {"frequency": "weekly"},
+                          {"format": "arrow"},
+                          {"table": "xyz"},
+                          {"ref_period": "2100-2110"},
+                          {"ref_period": "1981"}]:
+            response = self.fetch_products(**arguments)
+            self.assertEqual(response.code, 400, arguments)
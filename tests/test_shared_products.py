@@ -0,0 +1,69 @@
+"""The derived products are shared by all sessions, so no session must be able to modify them."""
+import numpy as np
+import pytest
+import xarray as xr
+from bokeh.models import ColumnDataSource
+
+import products as pr
+import toolkit as tk
+
+
+def shared_arrays(obj):
+    # All the numpy arrays of the products, including the data of the DataArrays and the day of year index.
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            # The extracted data is the dataset itself, which is added to the products after they are frozen.
+            if key != "extracted_data":
+                yield from shared_arrays(value)
+    elif isinstance(obj, np.ndarray):
+        yield obj
+    elif isinstance(obj, xr.DataArray):
+        yield obj.values
+    elif isinstance(obj, tk.DayOfYearIndex):
+        yield from shared_arrays(vars(obj))
+
+
+def all_products():
+    products = [pr.get_monthly_products("sie", "nh", "v2p2", "1981-2010", False),
+                pr.get_decadal_trend_products("sie", "nh", "v2p2", "1981-2010", False, "September"),
+                pr.get_comparison_products("sie", ["nh", "bar"], "v2p2", "1981-2010")]
+    for plot_type in pr.PLOT_TYPES:
+        products.append(pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", plot_type))
+        products.append(pr.get_decadal_products("sie", "nh", "v2p2", "1981-2010", plot_type))
+
+    return products
+
+
+def assert_read_only(products):
+    arrays = list(shared_arrays(products))
+    assert arrays
+    for array in arrays:
+        with pytest.raises(ValueError):
+            array[...] = 0
+
+
+def test_products_are_read_only(synthetic_data):
+    for products in all_products():
+        assert_read_only(products)
+
+
+def test_column_data_sources_share_read_only_arrays(synthetic_data):
+    # Each session creates its own ColumnDataSources from the data of the products.
+    products = pr.get_daily_products("sie", "nh", "v2p2", "1981-2010", "absolute")
+    for data in [products["minimum"], products["median"], products["individual_years"]["2024"]]:
+        cds = ColumnDataSource(data)
+        for column in cds.data.values():
+            with pytest.raises(ValueError):
+                column[0] = 0
+
+
+def test_disk_cache_entries_are_read_only(synthetic_data, monkeypatch, tmp_path):
+    monkeypatch.setenv("PRODUCT_CACHE_DIR", str(tmp_path))
+
+    # The first call writes the entries, and after clearing the memory caches they are read from disk.
+    all_products()
+    pr.clear_caches()
+    assert list(tmp_path.glob("*.products"))
+
+    for products in all_products():
+        assert_read_only(products)
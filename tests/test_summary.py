@@ -0,0 +1,81 @@
+"""The summary of the latest day of all datasets."""
+import numpy as np
+import pytest
+
+import products as pr
+
+
+@pytest.fixture
+def unavailable_datasets(synthetic_data, monkeypatch):
+    """Make the datasets in the returned set fail to open, like when the data server is down. The summary is made of a
+    few areas, to keep the tests fast."""
+    monkeypatch.setattr(pr, "AREAS", ["nh", "sh", "bar"])
+    unavailable = set()
+    get_data = pr.get_data
+
+    def get_data_or_fail(index, area, frequency, version):
+        if (index, area) in unavailable:
+            raise OSError(f"Dataset {index} {area} is unavailable")
+        return get_data(index, area, frequency, version)
+
+    # The datasets that failed to open are not in the cache.
+    get_data_or_fail.cached_value = lambda *key: None if key[:2] in unavailable else get_data.cached_value(*key)
+    get_data_or_fail.clear = get_data.clear
+    monkeypatch.setattr(pr, "get_data", get_data_or_fail)
+
+    return unavailable
+
+
+def test_unavailable_datasets_are_shown_as_unavailable(unavailable_datasets):
+    products = pr.get_summary_products("v2p2", "1981-2010")
+
+    unavailable_datasets.add(("sia", "bar"))
+    partial = pr.get_summary_products("v2p2", "1981-2010")["summary"]
+    summary = products["summary"]
+
+    row = list(zip(partial["index"], partial["area"])).index(("sia", "bar"))
+    assert not partial["available"][row]
+    assert partial["date"][row] == "unavailable"
+    assert np.isnan(partial["index_values"][row]) and np.isnan(partial["anomaly"][row])
+    assert partial["years"][row] == 0
+
+    # The other rows are the same as when all datasets are available.
+    others = np.arange(len(summary["area"])) != row
+    assert partial["available"][others].all()
+    for column in ["date", "index_values", "anomaly", "rank", "years", "record_low", "record_high_year"]:
+        np.testing.assert_array_equal(partial[column][others], summary[column][others])
+
+
+def test_summary_fails_if_no_dataset_is_available(unavailable_datasets):
+    unavailable_datasets.update((index, area) for index in pr.INDICES for area in pr.AREAS)
+
+    with pytest.raises(OSError):
+        pr.get_summary_products("v2p2", "1981-2010")
+
+
+def test_cached_summary_uses_no_threads(unavailable_datasets, monkeypatch):
+    products = pr.get_summary_products("v2p2", "1981-2010")
+
+    # The datasets and products are all in the cache, so they are read without the summary threads.
+    def no_pool():
+        raise AssertionError("The summary threads were used")
+
+    monkeypatch.setattr(pr, "_get_summary_pool", no_pool)
+    assert pr.get_summary_products("v2p2", "1981-2010") is products
+    pr._get_summary_products.clear()
+    np.testing.assert_array_equal(pr.get_summary_products("v2p2", "1981-2010")["summary"]["rank"],
+                                  products["summary"]["rank"])
+
+
+def test_missing_latest_value_has_no_rank(unavailable_datasets):
+    # The latest day of one dataset is in the data, but its value is missing.
+    extracted_data = pr.get_data("sie", "sh", "daily", "v2p2")
+    da = extracted_data["da"]
+    extracted_data["da"] = da.copy(data=np.concatenate([da.values[:-1], [np.nan]]))
+
+    summary = pr.get_summary_products("v2p2", "1981-2010")["summary"]
+
+    missing = np.array([(index, area) == ("sie", "sh") for index, area in zip(summary["index"], summary["area"])])
+    assert np.isnan(summary["index_values"][missing]).all() and np.isnan(summary["rank"][missing]).all()
+    assert summary["available"][missing].all()
+    assert (summary["rank"][~missing] >= 1).all()
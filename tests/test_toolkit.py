@@ -0,0 +1,149 @@
+"""The calculations of the toolkit, compared with the straightforward xarray versions that they replace."""
+import numpy as np
+import pytest
+
+import products as pr
+import toolkit as tk
+
+QUANTILES = [0.10, 0.25, 0.50, 0.75, 0.90]
+
+
+@pytest.fixture
+def daily_data(synthetic_data):
+    """The synthetic daily data, which ends on 2024-06-30, and its conversion to an all_leap calendar."""
+    da = pr.get_data("sie", "nh", "daily", "v2p2")["da"]
+    day_of_year_index = tk.DayOfYearIndex(da.time.values)
+    da_leap, da_converted = tk.convert_and_interpolate_calendar(da, day_of_year_index)
+
+    return da, day_of_year_index, da_leap, da_converted
+
+
+def by_day_of_year(grouped_values):
+    # Values for all 366 days of year, with NaN for the days without any time in the period.
+    return grouped_values.reindex(dayofyear=np.arange(1, 367)).values
+
+
+# The periods cover the missing values of every other day before August 1987 and of the 1987/88 gap, the partial first
+# and last years, periods that extend beyond the data, and single years.
+@pytest.mark.parametrize("start_year, end_year", [(1981, 2010),
+                                                  (1991, 2020),
+                                                  (1985, 1989),
+                                                  (1970, 1985),
+                                                  (2015, 2030),
+                                                  (1978, 1978),
+                                                  (1988, 1988),
+                                                  (2024, 2024)])
+def test_reference_baselines_match_groupby(daily_data, start_year, end_year):
+    _, day_of_year_index, _, da_converted = daily_data
+    baselines = tk.ReferenceBaselines(da_converted, day_of_year_index)
+
+    grouped = da_converted.sel(time=slice(str(start_year), str(end_year))).groupby("time.dayofyear")
+
+    np.testing.assert_allclose(baselines.mean(start_year, end_year), by_day_of_year(grouped.mean()), rtol=1e-12)
+    for quantile, values in zip(QUANTILES, baselines.quantiles(start_year, end_year, QUANTILES)):
+        np.testing.assert_allclose(values, by_day_of_year(grouped.quantile(quantile)), rtol=1e-12)
+
+
+def test_reference_products_match_the_percentiles_of_the_period(daily_data):
+    _, day_of_year_index, _, da_converted = daily_data
+    baselines = tk.ReferenceBaselines(da_converted, day_of_year_index)
+
+    grouped = da_converted.sel(time=slice("1991", "2020")).groupby("time.dayofyear")
+    mean = by_day_of_year(grouped.mean())
+    for plot_type, offset in [("absolute", 0), ("anomaly", mean)]:
+        products = pr.calculate_reference_products(baselines, "1991-2020", plot_type)
+        np.testing.assert_allclose(products["percentile_1090"]["percentile_10"],
+                                   by_day_of_year(grouped.quantile(0.10)) - offset,
+                                   atol=1e-12)
+        np.testing.assert_allclose(products["median"]["median"], by_day_of_year(grouped.median()) - offset, atol=1e-12)
+
+
+@pytest.mark.parametrize("reference_period", ["2100-2110", "1950-1960", "2010-2000", "1981"])
+def test_reference_period_without_data_is_rejected(daily_data, reference_period):
+    _, day_of_year_index, _, da_converted = daily_data
+    baselines = tk.ReferenceBaselines(da_converted, day_of_year_index)
+
+    # The message of the ValueError is shown to the user by the apps.
+    with pytest.raises(ValueError, match="reference period"):
+        pr.calculate_reference_products(baselines, reference_period, "absolute")
+    with pytest.raises(ValueError, match="reference period"):
+        pr.get_daily_products("sie", "nh", "v2p2", reference_period, "anomaly")
+
+
+def convert_and_interpolate_with_xarray(da):
+    # The conversion with xarray, with February 29th of the years that are not leap years interpolated between the
+    # preceding and succeeding day.
+    da_leap = da.convert_calendar("all_leap", align_on="date")
+    # The missing days are filled in a time axis like the data, which keeps a last day at the end of a month at the end
+    # of the month, and adds February 29th after data that ends on February 28th. It's cut at the last day of the data.
+    da_converted = da.convert_calendar("all_leap", align_on="date", missing=-999).sel(time=slice(None,
+                                                                                                 da_leap.time[-1]))
+    values = da_converted.values
+    for i in np.flatnonzero(values == -999):
+        values[i] = (values[i - 1] + values[i + 1]) / 2
+
+    return da_leap, da_converted
+
+
+# The data includes the missing values of every other day before August 1987 and of the 1987/88 gap, and ends with a
+# partial last year, before, on and after February 29th.
+@pytest.mark.parametrize("end", ["2024-06-30", "2023-02-28", "2023-03-01", "2020-02-29", "2022-12-31"])
+def test_calendar_conversion_matches_xarray(daily_data, end):
+    da = daily_data[0].sel(time=slice(None, end))
+    day_of_year_index = tk.DayOfYearIndex(da.time.values)
+    da_leap, da_converted = tk.convert_and_interpolate_calendar(da, day_of_year_index)
+    expected_leap, expected_converted = convert_and_interpolate_with_xarray(da)
+
+    for converted, expected in [(da_leap, expected_leap), (da_converted, expected_converted)]:
+        assert converted.time.dt.calendar == "all_leap"
+        np.testing.assert_array_equal(converted.time.values, expected.time.values)
+        np.testing.assert_allclose(converted.values, expected.values, rtol=1e-12)
+
+    # February 29th is interpolated in the years that are not leap years, and kept in the leap years.
+    feb_29 = da_converted.sel(time=(da_converted.time.dt.month == 2) & (da_converted.time.dt.day == 29))
+    assert len(feb_29) == len(range(1979, int(end[:4]) + (end[5:] >= "02-29")))
+    np.testing.assert_array_equal(da_leap.time.dt.dayofyear - 1, day_of_year_index.doy_index)
+    np.testing.assert_array_equal(da_converted.time.dt.dayofyear - 1, day_of_year_index.all_doy_index)
+
+
+@pytest.mark.parametrize("first_year, last_year, decades", [
+    # The years before the first complete decade are included in it, and the last decade may have just started.
+    (1978, 2024, {"1980s": (1978, 1989), "1990s": (1990, 1999), "2000s": (2000, 2009), "2010s": (2010, 2019),
+                  "2020s": (2020, 2024)}),
+    (1978, 2020, {"1980s": (1978, 1989), "1990s": (1990, 1999), "2000s": (2000, 2009), "2010s": (2010, 2019),
+                  "2020s": (2020, 2020)}),
+    (1980, 2019, {"1980s": (1980, 1989), "1990s": (1990, 1999), "2000s": (2000, 2009), "2010s": (2010, 2019)}),
+    (1979, 1990, {"1980s": (1979, 1989), "1990s": (1990, 1990)}),
+    (1978, 1980, {"1980s": (1978, 1980)}),
+    # The years are a decade of their own if the data doesn't reach the next decade.
+    (1978, 1979, {"1970s": (1978, 1979)}),
+    (2000, 2000, {"2000s": (2000, 2000)}),
+])
+def test_find_decades(first_year, last_year, decades):
+    found = tk.find_decades(np.arange(first_year, last_year + 1).astype(str))
+
+    assert list(found) == list(decades)
+    for decade, (start_year, end_year) in decades.items():
+        np.testing.assert_array_equal(found[decade], np.arange(start_year, end_year + 1).astype(str))
+
+
+# The data ends in the middle of a year, and in the first months of a decade.
+@pytest.mark.parametrize("end", ["2024-06-30", "2020-03-01"])
+def test_decadal_span_and_median_match_groupby(daily_data, end):
+    da = daily_data[0].sel(time=slice(None, end))
+    day_of_year_index = tk.DayOfYearIndex(da.time.values)
+    _, da_converted = tk.convert_and_interpolate_calendar(da, day_of_year_index)
+
+    decadal_dict = tk.calculate_decadal_span_and_median(da_converted, day_of_year_index)
+
+    decades = tk.find_decades(day_of_year_index.years)
+    assert list(decadal_dict) == list(decades)
+    for decade, decade_years in decades.items():
+        grouped = da_converted.sel(time=slice(decade_years[0], decade_years[-1])).groupby("time.dayofyear")
+        span = decadal_dict[decade]["cds_span"].data
+        median = decadal_dict[decade]["cds_median"].data
+
+        np.testing.assert_array_equal(span["day_of_year"], np.arange(1, 367))
+        np.testing.assert_array_equal(span["minimum"], by_day_of_year(grouped.min()), err_msg=decade)
+        np.testing.assert_array_equal(span["maximum"], by_day_of_year(grouped.max()), err_msg=decade)
+        np.testing.assert_allclose(median["median"], by_day_of_year(grouped.median()), rtol=1e-12, err_msg=decade)